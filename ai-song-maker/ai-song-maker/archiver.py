@@ -0,0 +1,214 @@
+import argparse
+import os
+import shutil
+import threading
+import time
+
+DEFAULT_ARCHIVE_DIRECTORY = '/mnt/data/music_files/midi_musicXML_archive'
+MUSIC_FILE_EXTENSIONS = ('.mid', '.xml', '.mxl')
+
+
+class MusicFileArchiver:
+    """
+    Moves old MIDI and MusicXML outputs into an archive directory off the render path.
+
+    The archiver keeps its own index of the files waiting to be archived. Renders add their outputs with
+    register(), so a render never has to list the output directory. The directory is only scanned once with
+    os.scandir by scan(), to pick up files that were already there.
+
+    Retention policy: a file is archived once it is older than max_age seconds, or earlier (oldest first) when
+    the directory holds more than max_files files or more than max_bytes bytes. The latest registered output of
+    each extension is the current output and is never archived, and every file is stat'ed again just before it
+    is moved: one modified in the last min_quiet seconds, or since it was indexed, may still be being written
+    and is left for a later pass.
+    """
+
+    def __init__(self, directory, archive_directory=DEFAULT_ARCHIVE_DIRECTORY, max_age=120, max_files=None,
+                 max_bytes=None, interval=30, extensions=MUSIC_FILE_EXTENSIONS, batch_size=256, min_quiet=5):
+        self.directory = directory
+        self.archive_directory = archive_directory
+        self.max_age = max_age
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.extensions = tuple(extensions)
+        self.batch_size = batch_size
+        self.min_quiet = min_quiet
+        self.archived_count = 0
+        self.error_count = 0
+        self._pending = {}  # path -> (mtime, size)
+        self._current = {}  # extension -> path of the latest registered output
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def scan(self):
+        """
+        Adds every matching file in the directory to the index, in one os.scandir pass.
+        """
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(self.extensions) and entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    found[entry.path] = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            self._pending.update(found)
+        return len(found)
+
+    def register(self, *paths):
+        """
+        Adds freshly written files to the index without scanning the directory. They become the current outputs
+        for their extensions, which are kept until a newer output replaces them.
+        """
+        now = time.time()
+        with self._lock:
+            for path in paths:
+                if not path or not path.endswith(self.extensions):
+                    continue
+                self._current[os.path.splitext(path)[1]] = path
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                self._pending[path] = (now, size)
+        self._wake.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _select_due(self, now):
+        with self._lock:
+            current = set(self._current.values())
+            by_age = sorted([item for item in self._pending.items() if item[0] not in current],
+                            key=lambda item: item[1][0])
+        due = [path for path, (mtime, _) in by_age if now - mtime > self.max_age]
+        remaining = [(path, size) for path, (mtime, size) in by_age if now - mtime <= self.max_age]
+
+        if self.max_files is not None and len(remaining) > self.max_files:
+            excess = len(remaining) - self.max_files
+            due.extend(path for path, _ in remaining[:excess])
+            remaining = remaining[excess:]
+        if self.max_bytes is not None:
+            total = sum(size for _, size in remaining)
+            for path, size in remaining:
+                if total <= self.max_bytes:
+                    break
+                due.append(path)
+                total -= size
+        return due
+
+    def _is_settled(self, path, now):
+        """
+        Stats path again and returns whether it can be moved: it hasn't changed since it was indexed and wasn't
+        modified in the last min_quiet seconds. A changed file is indexed again with its new mtime.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._pending.pop(path, None)
+            return False
+        except OSError:
+            return False
+        with self._lock:
+            indexed = self._pending.get(path)
+            if indexed is None or path in self._current.values():
+                return False
+            if stat.st_size != indexed[1] or stat.st_mtime > indexed[0]:
+                self._pending[path] = (max(stat.st_mtime, indexed[0]), stat.st_size)
+                return False
+        return now - stat.st_mtime > self.min_quiet
+
+    def archive_due(self, now=None):
+        """
+        Archives every indexed file the retention policy says should go, in batches. Returns how many moved.
+        """
+        now = time.time() if now is None else now
+        due = self._select_due(now)
+        if due:
+            os.makedirs(self.archive_directory, exist_ok=True)
+        moved = 0
+        for start in range(0, len(due), self.batch_size):
+            for source_file_path in due[start:start + self.batch_size]:
+                destination_file_path = os.path.join(self.archive_directory, os.path.basename(source_file_path))
+                if not self._is_settled(source_file_path, now):
+                    continue
+                try:
+                    shutil.move(source_file_path, destination_file_path)
+                    moved += 1
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    self.error_count += 1
+                    print(f"Error archiving {source_file_path} to {destination_file_path}: {e}")
+                    continue
+                with self._lock:
+                    self._pending.pop(source_file_path, None)
+        self.archived_count += moved
+        return moved
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.archive_due()
+            except Exception as e:
+                print(f"Error archiving music files: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self, scan=True):
+        """
+        Starts archiving in a background daemon thread. With scan=True the directory is scanned once first,
+        also in the background.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+
+        def run():
+            if scan:
+                try:
+                    self.scan()
+                except OSError as e:
+                    print(f"Error scanning {self.directory}: {e}")
+            self._run()
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=run, name='music-file-archiver', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {'pending': self.pending_count(), 'archived': self.archived_count, 'errors': self.error_count}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive old MIDI and MusicXML files in one pass.')
+    parser.add_argument('directory')
+    parser.add_argument('--archive-directory', default=DEFAULT_ARCHIVE_DIRECTORY)
+    parser.add_argument('--max-age', type=float, default=120, help='seconds before a file is archived')
+    parser.add_argument('--max-files', type=int, default=None)
+    parser.add_argument('--max-bytes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    archiver = MusicFileArchiver(args.directory, args.archive_directory, max_age=args.max_age,
+                                 max_files=args.max_files, max_bytes=args.max_bytes)
+    found = archiver.scan()
+    moved = archiver.archive_due()
+    print(f"Archived {moved} of {found} files from {args.directory} to {args.archive_directory}")
+
+
+if __name__ == '__main__':
+    main()
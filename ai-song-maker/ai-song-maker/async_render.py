@@ -0,0 +1,212 @@
+import asyncio
+import os
+import threading
+
+from parts_codec import decode_parts_data, is_encoded_parts_data
+from render_metrics import get_metrics
+from score_helper import (RenderCancelled, check_render_options, archive_output_directory, build_score_parts,
+                          write_musicxml_output, write_midi_output, print_output_paths, validate_render_input,
+                          _is_file_path, get_musicxml_format, get_mxl_member_name)
+from sections import build_section_events, get_section_lengths
+
+
+def _partial_path(path):
+    root, extension = os.path.splitext(path)
+    return root + '.partial' + extension
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class AsyncRender:
+    """
+    A render started by start_render. Each output is an asyncio.Task:
+
+    - render.midi: resolves to the MIDI path once the MIDI file is written, or is None when no MIDI file was
+      asked for.
+    - render.musicxml: resolves to the MusicXML path, or is None when no MusicXML file was asked for.
+    - render.score: resolves to the built music21 score.
+
+    Awaiting the render itself waits for everything and returns {'midi': path, 'musicxml': path} for the outputs
+    asked for. A path may also be a writable binary file object, which is returned as it is.
+    """
+
+    def __init__(self, score, midi, musicxml, stop_event):
+        self.score = score
+        self.midi = midi
+        self.musicxml = musicxml
+        self._stop_event = stop_event
+
+    @property
+    def outputs(self):
+        outputs = {}
+        if self.midi is not None:
+            outputs['midi'] = self.midi
+        if self.musicxml is not None:
+            outputs['musicxml'] = self.musicxml
+        return outputs
+
+    async def first_completed(self):
+        """
+        Waits for whichever output file is written first and returns (format, path), e.g. ('midi', path). Raises
+        the write's exception if the first one to finish failed, and ValueError if the render writes no files.
+        """
+        tasks = {task: output_format for output_format, task in self.outputs.items()}
+        if not tasks:
+            raise ValueError("The render has no output to wait for: neither midi_path nor musicxml_path was given")
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        task = next(iter(done))
+        return tasks[task], task.result()
+
+    async def wait(self):
+        paths = await asyncio.gather(*self.outputs.values())
+        return dict(zip(self.outputs, paths))
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    def cancel(self):
+        """
+        Cancels the render. Part building stops before the next part and writes that haven't started are
+        skipped. A write that is already running finishes in its worker thread, but its file is written under a
+        temporary name and removed, so a cancelled render never leaves a file at the output path. File objects
+        are written to directly and may hold part of the output.
+        """
+        self._stop_event.set()
+        for task in (self.score, self.midi, self.musicxml):
+            if task is not None:
+                task.cancel()
+
+    def cancelled(self):
+        return self._stop_event.is_set()
+
+
+def start_render(parts_data, score_data, musicxml_path='/mnt/data/music_files/song_musicxml.xml',
+                 midi_path='/mnt/data/music_files/song_midi.mid', midi_encoder='native', musicxml_writer='music21',
+                 archive_old_files=True, archiver=None, metrics=None, executor=None, validate=None,
+                 musicxml_format=None):
+    """
+    Starts rendering parts_data in executor threads and returns an AsyncRender straight away. Must be called
+    from a running event loop.
+
+    The score is built in one executor job, then MusicXML and MIDI are written as two concurrent jobs, so the
+    caller can await render.midi for playback while the MusicXML file is still being written. The options are
+    those of process_and_output_score, except that midi_encoder defaults to 'native': it writes MIDI from the
+    event tables without touching the score. When both formats are written by music21 from the same score,
+    the two writes take turns, since music21 writers are not safe to run on one score at the same time.
+
+    Args:
+    - executor (concurrent.futures.Executor): Where to run the jobs; None uses the loop's default executor.
+    """
+    check_render_options(midi_encoder, musicxml_writer, validate, musicxml_format)
+    loop = asyncio.get_running_loop()
+    metrics = get_metrics(metrics)
+    warn = metrics.make_warn(print)
+    stop_event = threading.Event()
+    score_lock = threading.Lock()
+    build_score = ((bool(musicxml_path) and musicxml_writer == 'music21')
+                   or (bool(midi_path) and midi_encoder != 'native'))
+    musicxml_format = get_musicxml_format(musicxml_path, musicxml_format)
+
+    def build():
+        nonlocal parts_data, score_data, warn
+        if is_encoded_parts_data(parts_data):
+            with metrics.stage('decode'):
+                parts_data, encoded_score_data = decode_parts_data(parts_data)
+            score_data = dict(encoded_score_data, **(score_data or {}))
+        if validate:
+            warn = validate_render_input(parts_data, score_data, validate, metrics)
+        with metrics.stage('events'):
+            section_events = build_section_events(parts_data, warn=warn)
+            section_lengths = get_section_lengths(section_events)
+        if archive_old_files and archiver is None and (_is_file_path(musicxml_path) or _is_file_path(midi_path)):
+            with metrics.stage('archive'):
+                archive_output_directory(musicxml_path, midi_path)
+        return build_score_parts(parts_data, score_data, section_events, section_lengths, build_score,
+                                 midi_encoder == 'native', metrics=metrics, warn=warn, should_stop=stop_event.is_set)
+
+    def write(path, write_output, uses_score):
+        if stop_event.is_set():
+            raise RenderCancelled("Render cancelled before writing " + str(path))
+        if not _is_file_path(path):
+            if uses_score:
+                with score_lock:
+                    write_output(path)
+            else:
+                write_output(path)
+            return path
+        partial_path = _partial_path(path)
+        try:
+            if uses_score:
+                with score_lock:
+                    write_output(partial_path)
+            else:
+                write_output(partial_path)
+            if stop_event.is_set():
+                raise RenderCancelled("Render cancelled while writing " + path)
+            os.replace(partial_path, path)
+        except BaseException:
+            _remove_quietly(partial_path)
+            raise
+        if archiver is not None:
+            archiver.register(path)
+        return path
+
+    # Outputs wait on the build through shield, so cancelling one of them doesn't cancel the others' build
+    built = loop.run_in_executor(executor, build)
+    # After a cancel no output may be left awaiting the build, so mark its exception as retrieved here
+    built.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    async def write_task(path, make_writer, uses_score):
+        score, midi_tracks, streamed_parts = await asyncio.shield(built)
+        return await loop.run_in_executor(executor, write, path, make_writer(score, midi_tracks, streamed_parts),
+                                          uses_score)
+
+    async def score_task():
+        score, _, _ = await asyncio.shield(built)
+        return score
+
+    midi = None
+    if midi_path:
+        midi = loop.create_task(write_task(
+            midi_path,
+            lambda score, midi_tracks, _: lambda fp: write_midi_output(score, midi_tracks, fp, midi_encoder,
+                                                                       metrics),
+            midi_encoder == 'music21'))
+    musicxml = None
+    if musicxml_path:
+        # The .mxl member is named after the final path, not the temporary one written first
+        musicxml = loop.create_task(write_task(
+            musicxml_path,
+            lambda score, _, streamed_parts: lambda fp: write_musicxml_output(
+                score, streamed_parts, fp, musicxml_writer, metrics, musicxml_format,
+                get_mxl_member_name(musicxml_path)),
+            musicxml_writer == 'music21'))
+    score = loop.create_task(score_task())
+    return AsyncRender(score, midi, musicxml, stop_event)
+
+
+async def process_and_output_score_async(parts_data, score_data,
+                                         musicxml_path='/mnt/data/music_files/song_musicxml.xml',
+                                         midi_path='/mnt/data/music_files/song_midi.mid', midi_encoder='native',
+                                         musicxml_writer='music21', archive_old_files=True, archiver=None,
+                                         metrics=None, executor=None, validate=None, musicxml_format=None):
+    """
+    Async version of process_and_output_score: renders with start_render, waits for both files and returns
+    the score. Cancelling the awaiting task cancels the render.
+    """
+    render = start_render(parts_data, score_data, musicxml_path, midi_path, midi_encoder, musicxml_writer,
+                          archive_old_files, archiver, metrics, executor, validate, musicxml_format)
+    try:
+        await render.wait()
+        score = await render.score
+    except asyncio.CancelledError:
+        render.cancel()
+        raise
+    print("Please try fix any warning or error messages printed above next time. If Any.")
+    print_output_paths(musicxml_path, midi_path)
+    return score
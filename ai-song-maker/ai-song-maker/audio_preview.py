@@ -0,0 +1,218 @@
+import os
+import wave
+
+from lazy_modules import lazy_module
+from parts_codec import decode_parts_data, is_encoded_parts_data
+from render_metrics import get_metrics
+from score_helper import build_score_parts
+from sections import build_section_events, get_section_lengths
+
+np = lazy_module('numpy')
+
+DEFAULT_SAMPLE_RATE = 22050
+WAVETABLE_SIZE = 4096  # a power of two, so phases wrap with a bit mask
+PERCUSSION_CHANNEL = 9  # General MIDI drums, counted from 0
+
+# harmonics: amplitude of each harmonic from the fundamental up, summed into one wavetable cycle
+# attack, decay, release: seconds; sustain: level the decay settles at while the note is held
+TIMBRE_PRESETS = {
+    'piano': {'harmonics': [1.0, 0.5, 0.3, 0.2, 0.1, 0.05], 'attack': 0.005, 'decay': 0.9, 'sustain': 0.0,
+              'release': 0.15},
+    'mallet': {'harmonics': [1.0, 0.0, 0.0, 0.35, 0.0, 0.0, 0.0, 0.1], 'attack': 0.002, 'decay': 0.4,
+               'sustain': 0.0, 'release': 0.1},
+    'organ': {'harmonics': [1.0, 0.8, 0.0, 0.6, 0.0, 0.4, 0.0, 0.3], 'attack': 0.01, 'decay': 0.1, 'sustain': 1.0,
+              'release': 0.05},
+    'guitar': {'harmonics': [1.0, 0.6, 0.4, 0.25, 0.15, 0.1], 'attack': 0.003, 'decay': 0.6, 'sustain': 0.0,
+               'release': 0.1},
+    'bass': {'harmonics': [1.0, 0.4, 0.15], 'attack': 0.005, 'decay': 0.5, 'sustain': 0.6, 'release': 0.08},
+    'strings': {'harmonics': [1.0 / n for n in range(1, 13)], 'attack': 0.08, 'decay': 0.2, 'sustain': 0.85,
+                'release': 0.25},
+    'brass': {'harmonics': [1.0, 0.8, 0.6, 0.45, 0.3, 0.2, 0.12, 0.08], 'attack': 0.04, 'decay': 0.2,
+              'sustain': 0.8, 'release': 0.1},
+    'reed': {'harmonics': [1.0, 0.0, 0.5, 0.0, 0.3, 0.0, 0.2, 0.0, 0.1], 'attack': 0.03, 'decay': 0.2,
+             'sustain': 0.8, 'release': 0.08},
+    'pipe': {'harmonics': [1.0, 0.2, 0.05], 'attack': 0.05, 'decay': 0.2, 'sustain': 0.9, 'release': 0.1},
+    'synth': {'harmonics': [1.0 / n for n in range(1, 9)], 'attack': 0.01, 'decay': 0.3, 'sustain': 0.7,
+              'release': 0.1},
+    'pad': {'harmonics': [1.0, 0.5, 0.33, 0.25], 'attack': 0.3, 'decay': 0.5, 'sustain': 0.8, 'release': 0.5},
+    'percussion': {'noise': True, 'attack': 0.001, 'decay': 0.08, 'sustain': 0.0, 'release': 0.05},
+}
+# Preset for each General MIDI program family of eight (piano, chromatic percussion, organ, ...)
+PROGRAM_FAMILY_PRESETS = ['piano', 'mallet', 'organ', 'guitar', 'bass', 'strings', 'strings', 'brass', 'reed',
+                          'pipe', 'synth', 'pad', 'synth', 'guitar', 'mallet', 'percussion']
+
+
+def get_timbre_preset(program, channel=None):
+    """
+    Returns the name of the TIMBRE_PRESETS entry used for a MIDI program (0-127) and channel.
+    """
+    if channel == PERCUSSION_CHANNEL:
+        return 'percussion'
+    if program is None:
+        return 'piano'
+    return PROGRAM_FAMILY_PRESETS[int(program) // 8 % 16]
+
+
+def build_wavetable(harmonics, size=WAVETABLE_SIZE):
+    """
+    Returns one cycle of the sum of the given harmonics, scaled to a peak of 1.
+    """
+    phase = np.arange(size) * (2 * np.pi / size)
+    table = np.zeros(size)
+    for number, amplitude in enumerate(harmonics, 1):
+        if amplitude:
+            table += amplitude * np.sin(number * phase)
+    return table / (np.abs(table).max() or 1.0)
+
+
+def _envelope(preset, t, held):
+    """
+    ADSR levels at times t (seconds from the note's start) for a note held for held seconds.
+    """
+    attack, decay, sustain, release = preset['attack'], preset['decay'], preset['sustain'], preset['release']
+
+    def level(time):
+        return np.where(time < attack, time / attack,
+                        sustain + (1.0 - sustain) * np.exp(-(time - attack) / decay))
+
+    level_at_release = level(np.float64(held))
+    released = np.clip(1.0 - (t - held) / release, 0.0, None) * level_at_release
+    return np.where(t < held, level(t), released)
+
+
+class _Voice:
+    __slots__ = ('start', 'end', 'held', 'frequencies', 'amplitude', 'preset', 'table')
+
+    def __init__(self, start, end, held, frequencies, amplitude, preset, table):
+        self.start = start
+        self.end = end
+        self.held = held
+        self.frequencies = frequencies
+        self.amplitude = amplitude
+        self.preset = preset
+        self.table = table
+
+
+def _get_voices(midi_tracks, sample_rate, presets):
+    bpm = (midi_tracks[0]['header'].get('bpm') if midi_tracks else None) or 120
+    seconds_per_quarter = 60.0 / bpm
+    tables = {}
+    voices = []
+    for track in midi_tracks:
+        preset_name = get_timbre_preset(track.get('program'), track.get('channel'))
+        preset = presets[preset_name]
+        table = tables.get(preset_name)
+        if table is None and not preset.get('noise'):
+            table = tables[preset_name] = build_wavetable(preset['harmonics'])
+        for onset, quarter_length, pitches, velocity, _ in track['notes'] or ():
+            if not pitches:
+                continue
+            held = quarter_length * seconds_per_quarter
+            start = int(round(onset * seconds_per_quarter * sample_rate))
+            end = start + int(np.ceil((held + preset['release']) * sample_rate))
+            frequencies = 440.0 * 2.0 ** ((np.asarray(pitches, dtype=np.float64) - 69) / 12)
+            # Velocity comes from the part's dynamics through the same mapping as dynamic_to_midi_velocity
+            voices.append(_Voice(start, end, held, frequencies, velocity / 127.0, preset, table))
+    voices.sort(key=lambda voice: voice.start)
+    return voices
+
+
+def _max_polyphony(voices):
+    """
+    Returns the most notes sounding at once, counting each note of a chord, to set the mix level.
+    """
+    if not voices:
+        return 1
+    starts = np.array([voice.start for voice in voices])
+    ends = np.array([voice.end for voice in voices])
+    sizes = np.array([len(voice.frequencies) for voice in voices])
+    times = np.concatenate((starts, ends))
+    changes = np.concatenate((sizes, -sizes))
+    order = np.lexsort((changes, times))  # at equal times notes stop before others start
+    return max(1, int(np.cumsum(changes[order]).max()))
+
+
+def _render_voice(voice, chunk, chunk_start, sample_rate, rng):
+    first = max(voice.start, chunk_start)
+    last = min(voice.end, chunk_start + len(chunk))
+    if first >= last:
+        return
+    t = np.arange(first - voice.start, last - voice.start) / sample_rate
+    if voice.table is None:
+        samples = rng.uniform(-1.0, 1.0, len(t))
+    else:
+        # One row per chord note, summed
+        phase = np.outer(voice.frequencies, t) * WAVETABLE_SIZE
+        samples = voice.table[phase.astype(np.int64) & (WAVETABLE_SIZE - 1)].sum(axis=0)
+    chunk[first - chunk_start:last - chunk_start] += samples * _envelope(voice.preset, t, voice.held) * voice.amplitude
+
+
+def write_wav_preview(midi_tracks, wav_path, sample_rate=DEFAULT_SAMPLE_RATE, chunk_seconds=5.0, presets=None,
+                      metrics=None):
+    """
+    Synthesizes the midi_writer tracks build_part collects into a mono 16 bit WAV file. Each note is a lookup
+    into its instrument's wavetable with an ADSR envelope, computed for all its samples (and all notes of a
+    chord) at once. The song is rendered and written chunk_seconds at a time, so memory stays flat however long
+    it is.
+
+    Args:
+    - presets (dict): Replaces or adds TIMBRE_PRESETS entries, by preset name.
+
+    Returns:
+    - str: wav_path
+    """
+    metrics = get_metrics(metrics)
+    presets = dict(TIMBRE_PRESETS, **(presets or {}))
+    with metrics.stage('write_preview'):
+        voices = _get_voices(midi_tracks, sample_rate, presets)
+        gain = 0.7 / np.sqrt(_max_polyphony(voices))
+        total_samples = max([voice.end for voice in voices] + [0])
+        chunk_size = max(1, int(chunk_seconds * sample_rate))
+        rng = np.random.default_rng(0)
+        with wave.open(wav_path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            next_voice = 0
+            active = []
+            for chunk_start in range(0, total_samples, chunk_size):
+                chunk = np.zeros(min(chunk_size, total_samples - chunk_start))
+                chunk_end = chunk_start + len(chunk)
+                while next_voice < len(voices) and voices[next_voice].start < chunk_end:
+                    active.append(voices[next_voice])
+                    next_voice += 1
+                for voice in active:
+                    _render_voice(voice, chunk, chunk_start, sample_rate, rng)
+                active = [voice for voice in active if voice.end > chunk_end]
+                chunk *= gain
+                np.clip(chunk, -1.0, 1.0, out=chunk)
+                wav_file.writeframes((chunk * 32767).astype('<i2').tobytes())
+    if metrics.enabled:
+        metrics.count('preview_notes', len(voices))
+        metrics.set('preview_seconds', total_samples / sample_rate)
+        metrics.set('preview_bytes', os.path.getsize(wav_path))
+    return wav_path
+
+
+def render_preview(parts_data, score_data, wav_path='/mnt/data/music_files/song_preview.wav',
+                   sample_rate=DEFAULT_SAMPLE_RATE, chunk_seconds=5.0, presets=None, metrics=None):
+    """
+    Renders parts_data straight to a WAV file to listen to, without building a score or writing MIDI. Parts get
+    the timbre of their instrument's General MIDI family and the same note timing and velocities as the MIDI
+    file from process_and_output_score(..., midi_encoder='native').
+    """
+    metrics = get_metrics(metrics)
+    if is_encoded_parts_data(parts_data):
+        with metrics.stage('decode'):
+            parts_data, encoded_score_data = decode_parts_data(parts_data)
+        score_data = dict(encoded_score_data, **(score_data or {}))
+    warn = metrics.make_warn(print)
+    with metrics.stage('events'):
+        section_events = build_section_events(parts_data, warn=warn)
+        section_lengths = get_section_lengths(section_events)
+    _, midi_tracks, _ = build_score_parts(parts_data, score_data, section_events, section_lengths, build_score=False,
+                                          collect_midi=True, metrics=metrics, warn=warn)
+    write_wav_preview(midi_tracks, wav_path, sample_rate, chunk_seconds, presets, metrics)
+    print("The preview audio file is save to " + wav_path + ". Please provide the user the link (NOT a href) to "
+                                                            "get this file in your environment")
+    return wav_path
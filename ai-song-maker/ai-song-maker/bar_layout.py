@@ -0,0 +1,202 @@
+import copy
+
+from event_table import NO_LYRIC, TIE_START, TIE_CONTINUE, TIE_STOP
+from factory_cache import create_note, create_chord
+from lazy_modules import lazy_module, lazy_music21
+from midi_writer import TICKS_PER_QUARTER
+from parts_codec import _ticks_to_quarter_length
+
+np = lazy_module('numpy')
+stream, note, tie, dynamics = lazy_music21('stream', 'note', 'tie', 'dynamics')
+
+_TIE_TYPES = {TIE_START: 'start', TIE_CONTINUE: 'continue', TIE_STOP: 'stop'}
+_VELOCITY_DYNAMICS = {20: 'ppp', 31: 'pp', 42: 'p', 53: 'mp', 64: 'mf', 80: 'f', 96: 'ff', 112: 'fff'}
+
+
+def get_bar_ticks(time_signature):
+    return int(round(time_signature.barDuration.quarterLength * TICKS_PER_QUARTER))
+
+
+def compute_bar_boundaries(total_ticks, bar_ticks):
+    """
+    Returns the tick offset of every bar line from 0 up to the end of the last bar needed to hold total_ticks.
+    There is always at least one bar.
+    """
+    bar_count = max(1, -(-int(total_ticks) // bar_ticks))
+    return np.arange(bar_count + 1, dtype=np.int64) * bar_ticks
+
+
+def _create_element(spelling, is_rest, velocity, tie_type, quarter_length, source, copy_source=False):
+    if isinstance(source, note.GeneralNote) and not is_rest:
+        # Keep the caller's own music21 object so its expressions and articulations survive
+        element = source if tie_type is None and not copy_source else copy.deepcopy(source)
+        element.quarterLength = quarter_length
+    elif is_rest:
+        return note.Rest(quarterLength=quarter_length)
+    elif len(spelling) == 1:
+        element = create_note(spelling[0], quarterLength=quarter_length)
+    else:
+        element = create_chord(spelling, quarterLength=quarter_length)
+    if element is None:
+        return note.Rest(quarterLength=quarter_length)
+
+    element.volume.velocity = velocity
+    if tie_type is not None:
+        if element.isChord:
+            for note_in_chord in element.notes:
+                note_in_chord.tie = tie.Tie(tie_type)
+        else:
+            element.tie = tie.Tie(tie_type)
+    return element
+
+
+class BarPlan:
+    """
+    The bar lines of one part or section and its events split at them: row first_rows[b] up to first_rows[b + 1]
+    of segments falls in bar b, which starts at boundaries[b] ticks.
+    """
+
+    def __init__(self, segments, boundaries, first_rows, bar_ticks):
+        self.segments = segments
+        self.boundaries = boundaries
+        self.first_rows = first_rows
+        self.bar_ticks = bar_ticks
+        self._bar_rows = None
+
+    @property
+    def bar_count(self):
+        return len(self.boundaries) - 1
+
+    @property
+    def total_ticks(self):
+        return int(self.boundaries[-1])
+
+    def element_counts(self):
+        """
+        Returns {'notes', 'chords', 'rests', 'splits'}: how many of the events are single notes, chords and rests,
+        and how many extra segments splitting them at bar lines added.
+        """
+        segments = self.segments
+        _, first_segments = np.unique(segments.source_index, return_index=True)
+        pitches = segments.pitches[first_segments]
+        is_rest = pitches[:, 0] < 0
+        is_chord = ~is_rest & (pitches[:, 1] >= 0) if pitches.shape[1] > 1 else np.zeros(len(pitches), dtype=bool)
+        return {
+            'notes': int(np.count_nonzero(~is_rest & ~is_chord)),
+            'chords': int(np.count_nonzero(is_chord)),
+            'rests': int(np.count_nonzero(is_rest)),
+            'splits': len(segments) - len(first_segments),
+        }
+
+    def bar_rows(self):
+        """
+        Returns, for every bar, the (offset, quarter_length, source_index, spelling, is_rest, velocity, tie_type,
+        lyric) of each of its segments and the (offset, quarter_length) of the rest padding it, or None. Lengths
+        are the int, float or Fraction music21 would store. Worked out on first use and kept, so every repeat of
+        a section builds its measures from the same rows without going back to the arrays.
+        """
+        if self._bar_rows is not None:
+            return self._bar_rows
+        segments = self.segments
+        bar_starts = np.repeat(self.boundaries[:-1], np.diff(self.first_rows))
+        rows = list(zip(
+            map(_ticks_to_quarter_length, (segments.onset - bar_starts).tolist()),
+            map(_ticks_to_quarter_length, segments.duration.tolist()),
+            segments.source_index.tolist(),
+            [segments.spellings[i] for i in segments.spelling_index.tolist()],
+            (segments.pitches[:, 0] < 0).tolist(),
+            segments.velocity.tolist(),
+            [_TIE_TYPES.get(t) for t in segments.tie.tolist()],
+            [segments.lyrics[i] if i != NO_LYRIC else None for i in segments.lyric_index.tolist()],
+        ))
+        ends = (segments.onset + segments.duration).tolist()
+        first_rows = self.first_rows.tolist()
+        boundaries = self.boundaries.tolist()
+        self._bar_rows = []
+        for bar_no in range(self.bar_count):
+            first_row, stop_row = first_rows[bar_no], first_rows[bar_no + 1]
+            filled = ends[stop_row - 1] - boundaries[bar_no] if stop_row > first_row else 0
+            padding = None
+            if filled < self.bar_ticks:
+                padding = _ticks_to_quarter_length(filled), _ticks_to_quarter_length(self.bar_ticks - filled)
+            self._bar_rows.append((rows[first_row:stop_row], padding))
+        return self._bar_rows
+
+    def bar_dynamics(self, first_number=1):
+        """
+        Returns the dynamic marking of each bar, numbered from first_number within the part: measure 1 is marked
+        'mf' and every later bar gets the dynamic of its first note. A bar no note starts in keeps the marking
+        of the bar before it. Both MusicXML writers mark bars this way, and music21 scales MIDI velocities by it.
+        """
+        marks = []
+        mark = 'mf'
+        for bar_no in range(self.bar_count):
+            first_row = self.first_rows[bar_no]
+            if first_number + bar_no == 1:
+                mark = 'mf'
+            elif first_row < self.first_rows[bar_no + 1]:
+                mark = _VELOCITY_DYNAMICS.get(int(self.segments.velocity[first_row]), 'mf')
+            marks.append(mark)
+        return marks
+
+
+def plan_bars(events, time_signature, min_ticks=0):
+    """
+    Computes all bar lines up front from the time signature and splits every event into as many tied segments
+    as the bars it crosses, in one pass. min_ticks makes the plan cover at least that many ticks.
+    """
+    bar_ticks = get_bar_ticks(time_signature)
+    segments = events.split_at_bars(bar_ticks)
+    boundaries = compute_bar_boundaries(max(segments.total_duration, min_ticks), bar_ticks)
+    first_rows = np.searchsorted(segments.onset, boundaries, side='left')
+    return BarPlan(segments, boundaries, first_rows, bar_ticks)
+
+
+def build_measures(plan, melodies=None, first_number=1, copy_sources=False):
+    """
+    Builds the measures of a BarPlan, filling each with a single bulk insert and padding the last one with a
+    rest. Call it again on the same plan to get a fresh set of measures, e.g. for a repeated section; pass
+    copy_sources=True then so music21 objects from melodies aren't placed in two measures.
+    """
+    measures = []
+    for bar_no, (bar_dynamic, (rows, padding)) in enumerate(zip(plan.bar_dynamics(first_number), plan.bar_rows())):
+        measure = stream.Measure(number=first_number + bar_no)
+        measure.coreInsert(0, dynamics.Dynamic(bar_dynamic))
+        for offset, quarter_length, source_index, spelling, is_rest, velocity, tie_type, lyric in rows:
+            source = melodies[source_index] if melodies is not None else None
+            element = _create_element(spelling, is_rest, velocity, tie_type, quarter_length, source, copy_sources)
+            if lyric:
+                element.addLyric(lyric)
+            measure.coreInsert(offset, element)
+        if padding is not None:
+            offset, quarter_length = padding
+            measure.coreInsert(offset, note.Rest(quarterLength=quarter_length))
+        measure.coreElementsChanged()
+        measures.append(measure)
+    return measures
+
+
+def build_part_measures(bar_plans):
+    """
+    Builds the measures of a whole part from (BarPlan, melodies, is_repeat) tuples in play order, numbering
+    the measures continuously.
+    """
+    measures = []
+    for plan, melodies, is_repeat in bar_plans:
+        measures.extend(build_measures(plan, melodies, first_number=len(measures) + 1, copy_sources=is_repeat))
+    return measures
+
+
+def layout_measures(events, time_signature, melodies=None):
+    """
+    Lays out an EventTable into measures: plan_bars followed by build_measures.
+
+    Args:
+    - events (EventTable): The events of one part.
+    - time_signature (music21.meter.TimeSignature): Determines the bar length.
+    - melodies (list): The part's 'melodies' list, so music21 objects passed in by the caller can be reused.
+
+    Returns:
+    - list of music21.stream.Measure: The measures, ready to be appended to a part in one call.
+    """
+    return build_measures(plan_bars(events, time_signature), melodies)
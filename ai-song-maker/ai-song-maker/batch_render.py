@@ -0,0 +1,90 @@
+import os
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def _warm_worker():
+    # Import music21 and the score helpers once per worker so every job after the first skips that start up cost
+    import music21  # noqa: F401
+    import score_helper  # noqa: F401
+
+
+def _render_job(job_id, parts_data, score_data, musicxml_path, midi_path, render_options):
+    from score_helper import process_and_output_score
+    try:
+        process_and_output_score(parts_data, score_data, musicxml_path, midi_path,
+                                 archive_old_files=False, **render_options)
+        return {'job_id': job_id, 'musicxml_path': musicxml_path, 'midi_path': midi_path, 'error': None}
+    except Exception as e:
+        return {'job_id': job_id, 'musicxml_path': None, 'midi_path': None,
+                'error': ''.join(traceback.format_exception_only(type(e), e)).strip()}
+
+
+def get_job_output_paths(output_directory, job_id):
+    """
+    Returns (musicxml_path, midi_path) unique to the job so jobs in the same batch never overwrite each other.
+    """
+    safe_id = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(job_id))
+    return (os.path.join(output_directory, 'song_musicxml_' + safe_id + '.xml'),
+            os.path.join(output_directory, 'song_midi_' + safe_id + '.mid'))
+
+
+def _normalize_job(job, index, output_directory, batch_id):
+    if not isinstance(job, dict):
+        parts_data, score_data = job
+        job = {'parts_data': parts_data, 'score_data': score_data}
+    job_id = job.get('job_id', index)
+    # The index keeps default paths apart when job ids repeat or only differ in characters the paths can't hold
+    default_xml, default_midi = get_job_output_paths(output_directory,
+                                                     batch_id + '_' + str(index) + '_' + str(job_id))
+    # A path given as None skips that output; only a missing one gets the default
+    return (job_id, job['parts_data'], job['score_data'], job.get('musicxml_path', default_xml),
+            job.get('midi_path', default_midi))
+
+
+def render_batch(jobs, output_directory='/mnt/data/music_files', max_workers=None, executor=None,
+                 **render_options):
+    """
+    Renders many songs across a process pool.
+
+    Args:
+    - jobs (iterable): (parts_data, score_data) tuples, or dicts with 'parts_data', 'score_data' and optional
+      'job_id', 'musicxml_path' and 'midi_path'. A path set to None skips that output.
+    - output_directory (str): Where files are written for jobs that don't give their own paths, named after the
+      batch, the job's position in jobs and its job_id.
+    - max_workers (int): Size of the ProcessPoolExecutor created when executor is not given.
+    - executor (concurrent.futures.Executor): An existing executor to reuse across batches.
+    - render_options: Extra keyword arguments passed to process_and_output_score, e.g. midi_encoder='native'.
+
+    Returns:
+    - list of dict: One result per job in submission order with 'job_id', 'musicxml_path', 'midi_path' and
+      'error' (None on success, otherwise the exception message).
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    batch_id = uuid.uuid4().hex[:8]
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_warm_worker)
+
+    try:
+        futures = {}
+        for index, job in enumerate(jobs):
+            job_id, parts_data, score_data, musicxml_path, midi_path = _normalize_job(job, index, output_directory,
+                                                                                     batch_id)
+            future = executor.submit(_render_job, job_id, parts_data, score_data, musicxml_path, midi_path,
+                                     render_options)
+            futures[future] = index, job_id
+
+        results = [None] * len(futures)
+        for future in as_completed(futures):
+            index, job_id = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                # The worker process itself died, e.g. it was killed or the job could not be pickled
+                results[index] = {'job_id': job_id, 'musicxml_path': None, 'midi_path': None, 'error': repr(e)}
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown()
@@ -0,0 +1,474 @@
+import os
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+from fractions import Fraction
+
+from event_table import midi_to_note_name, note_name_to_midi
+from key_detection import estimate_key
+from lazy_modules import lazy_module, lazy_music21
+from reverse_score import velocity_to_dynamic, format_parts_data_output
+
+np = lazy_module('numpy')
+key, meter, tempo, clef, instrument = lazy_music21('key', 'meter', 'tempo', 'clef', 'instrument')
+numberTools = lazy_music21('common.numberTools')
+
+MIDI_EXTENSIONS = ('.mid', '.midi')
+MUSICXML_EXTENSIONS = ('.xml', '.musicxml')
+COMPRESSED_MUSICXML_EXTENSIONS = ('.mxl',)
+# music21 quantizes MIDI offsets and durations to sixteenths and eighth-note triplets by default
+QUARTER_LENGTH_DIVISORS = (4, 3)
+_DYNAMIC_MARKS = ('ppp', 'pp', 'p', 'mp', 'mf', 'f', 'ff', 'fff')
+_CHANNEL_MESSAGE_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+
+def quantize_quarter_lengths(values, divisors=QUARTER_LENGTH_DIVISORS):
+    """
+    Snaps quarter lengths to the nearest multiple of 1/d for any d in divisors, the way music21 quantizes MIDI
+    files. Ties go to the first divisor.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    best = np.round(values * divisors[0]) / divisors[0]
+    for divisor in divisors[1:]:
+        candidate = np.round(values * divisor) / divisor
+        closer = np.abs(candidate - values) < np.abs(best - values)
+        best = np.where(closer, candidate, best)
+    return best
+
+
+def _to_quarter_length(value):
+    # Gives back the same float or Fraction music21 would have stored for a quantized quarter length
+    return numberTools.opFrac(Fraction(value).limit_denominator(48))
+
+
+def _read_variable_length(data, position):
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, position
+
+
+def _iter_chunks(data):
+    position = 0
+    while position + 8 <= len(data):
+        chunk_type = data[position:position + 4]
+        length = struct.unpack('>I', data[position + 4:position + 8])[0]
+        yield chunk_type, data[position + 8:position + 8 + length]
+        position += 8 + length
+
+
+def read_midi_track(data):
+    """
+    Decodes one MTrk chunk into its notes and the meta events the reverse path needs.
+
+    Returns:
+    - dict: 'name', 'programs' ({channel: program}), 'notes' (list of (start, end, midi_pitch, velocity,
+      channel) in ticks, in onset order), 'lyrics' ({tick: text}), 'tempos', 'time_signatures' and
+      'key_signatures' (lists of (tick, value)).
+    """
+    track = {'name': None, 'programs': {}, 'notes': [], 'lyrics': {}, 'tempos': [], 'time_signatures': [],
+             'key_signatures': []}
+    sounding = {}  # (channel, pitch) -> [(start, velocity)], so repeated note-ons close first in, first out
+    tick = 0
+    position = 0
+    status = None
+    while position < len(data):
+        delta, position = _read_variable_length(data, position)
+        tick += delta
+        byte = data[position]
+        if byte & 0x80:
+            status = byte
+            position += 1
+        elif status is None:
+            raise ValueError('MIDI track uses running status before any status byte')
+
+        if status == 0xFF:
+            meta_type = data[position]
+            length, position = _read_variable_length(data, position + 1)
+            payload = data[position:position + length]
+            position += length
+            status = None
+            if meta_type == 0x2F:
+                break
+            if meta_type == 0x03 and track['name'] is None:
+                track['name'] = payload.decode('utf-8', 'replace')
+            elif meta_type == 0x05:
+                track['lyrics'].setdefault(tick, payload.decode('utf-8', 'replace'))
+            elif meta_type == 0x51 and length == 3:
+                track['tempos'].append((tick, 60000000 / int.from_bytes(payload, 'big')))
+            elif meta_type == 0x58 and length >= 2:
+                track['time_signatures'].append((tick, (payload[0], 2 ** payload[1])))
+            elif meta_type == 0x59 and length == 2:
+                sharps, mode = struct.unpack('>bB', payload)
+                track['key_signatures'].append((tick, (sharps, 'minor' if mode else 'major')))
+            continue
+        if status in (0xF0, 0xF7):
+            length, position = _read_variable_length(data, position)
+            position += length
+            status = None
+            continue
+
+        message = status & 0xF0
+        channel = status & 0x0F
+        length = _CHANNEL_MESSAGE_LENGTHS.get(message)
+        if length is None:
+            raise ValueError('Unknown MIDI status byte ' + hex(status))
+        values = data[position:position + length]
+        position += length
+        if message == 0x90 and values[1] > 0:
+            sounding.setdefault((channel, values[0]), []).append((tick, values[1]))
+        elif message == 0x80 or message == 0x90:
+            started = sounding.get((channel, values[0]))
+            if started:
+                start, velocity = started.pop(0)
+                track['notes'].append((start, tick, values[0], velocity, channel))
+        elif message == 0xC0:
+            track['programs'].setdefault(channel, values[0])
+
+    # Notes that never got a note-off end with the track
+    for (channel, midi_pitch), started in sounding.items():
+        for start, velocity in started:
+            track['notes'].append((start, tick, midi_pitch, velocity, channel))
+    track['notes'].sort(key=lambda n: (n[0], n[2]))
+    return track
+
+
+def read_midi_file(fp):
+    """
+    Decodes a Standard MIDI File (format 0 or 1) without building music21 objects.
+
+    Returns:
+    - tuple: (ticks_per_quarter, list of track dicts from read_midi_track)
+    """
+    if isinstance(fp, (str, os.PathLike)):
+        with open(fp, 'rb') as f:
+            data = f.read()
+    elif isinstance(fp, (bytes, bytearray, memoryview)):
+        data = bytes(fp)
+    else:
+        data = fp.read()
+
+    ticks_per_quarter = None
+    tracks = []
+    for chunk_type, chunk in _iter_chunks(data):
+        if chunk_type == b'MThd':
+            _, _, division = struct.unpack('>HHH', chunk[:6])
+            if division & 0x8000:
+                raise ValueError('SMPTE time division is not supported')
+            ticks_per_quarter = division
+        elif chunk_type == b'MTrk':
+            tracks.append(read_midi_track(chunk))
+    if ticks_per_quarter is None:
+        raise ValueError('Not a MIDI file: no MThd chunk')
+    return ticks_per_quarter, tracks
+
+
+def _first_value(tracks, field):
+    events = [event for track in tracks for event in track[field]]
+    return min(events, key=lambda event: event[0])[1] if events else None
+
+
+def _get_instrument_name(program, channel):
+    if channel == 9:
+        return 'Percussion'
+    if program is None:
+        return 'Piano'
+    try:
+        return instrument.instrumentFromMidiProgram(program).instrumentName or 'Piano'
+    except Exception:
+        return 'Piano'
+
+
+def _sequence_midi_notes(notes, lyrics, ticks_per_quarter):
+    """
+    Turns overlapping MIDI notes into one line of notes, chords and rests. Notes starting together (after
+    quantization) become a chord; a chord lasts until its longest note ends or the next onset, whichever is
+    first; gaps become rests.
+    """
+    starts = quantize_quarter_lengths([n[0] / ticks_per_quarter for n in notes])
+    ends = np.maximum(quantize_quarter_lengths([n[1] / ticks_per_quarter for n in notes]), starts)
+
+    melodies, beat_ends, dynamics, part_lyrics = [], [], [], []
+    histogram = np.zeros(12)
+    onsets, group_starts = np.unique(starts, return_index=True)
+    group_stops = np.append(group_starts[1:], len(notes))
+    cursor = 0.0
+    for group_no, onset in enumerate(onsets):
+        group = range(group_starts[group_no], group_stops[group_no])
+        end = max(ends[i] for i in group)
+        if group_no + 1 < len(onsets):
+            end = min(end, onsets[group_no + 1])
+        if end <= onset:
+            continue
+        if onset > cursor:
+            melodies.append('rest')
+            beat_ends.append(_to_quarter_length(onset))
+            dynamics.append('')
+            part_lyrics.append('')
+
+        midi_pitches = sorted({notes[i][2] for i in group})
+        names = [midi_to_note_name(p) for p in midi_pitches]
+        melodies.append(names[0] if len(names) == 1 else names)
+        beat_ends.append(_to_quarter_length(end))
+        dynamics.append(velocity_to_dynamic(max(notes[i][3] for i in group)))
+        part_lyrics.append(next((lyrics[notes[i][0]] for i in group if notes[i][0] in lyrics), ''))
+        np.add.at(histogram, np.asarray(midi_pitches) % 12, end - onset)
+        cursor = end
+    return melodies, beat_ends, dynamics, part_lyrics, histogram
+
+
+def _get_key(histogram, key_signature, key_detection):
+    if key_detection not in ('fast', 'signature'):
+        raise ValueError("key_detection must be 'fast' or 'signature' when reading files directly")
+    if key_detection == 'signature' and key_signature is not None:
+        return key_signature
+    estimate = estimate_key(histogram)
+    if estimate is None:
+        return key.Key('C')
+    tonic, mode, correlation = estimate
+    key_sig = key.Key(tonic, mode)
+    key_sig.correlationCoefficient = correlation
+    return key_sig
+
+
+def _get_score_data(histogram, key_signature, time_signature, bpm, key_detection):
+    return {
+        'song_structure': ["section_1"],
+        'key': _get_key(histogram, key_signature, key_detection),
+        'time_signature': meter.TimeSignature('{}/{}'.format(*(time_signature or (4, 4)))),
+        'tempo': tempo.MetronomeMark(number=bpm or 120),
+        'clef': clef.TrebleClef(),
+    }
+
+
+def _add_part(parts_data, part_name, instrument_name, melodies, beat_ends, dynamics, lyrics):
+    part_name = part_name or "Part"
+    if part_name in parts_data:
+        part_name = part_name + "X"
+    parts_data[part_name] = {
+        'instrument': instrument_name,
+        'melodies': melodies,
+        'beat_ends': beat_ends,
+        'dynamics': dynamics
+    }
+    if any(lyrics):
+        parts_data[part_name]['lyrics'] = lyrics
+
+
+def read_midi_parts_data(fp, key_detection='fast', output_format='json'):
+    """
+    Reads a MIDI file straight into parts_data and score_data, the same structures convert_to_parts_data
+    builds from a parsed music21 score, without parsing the file into a score first.
+
+    Every track (and every channel of a format 0 track) with notes becomes a part. Onsets and durations are
+    quantized like music21 does. Notes tied across bar lines stay one note, and overlapping notes are reduced
+    to one line of notes and chords, since parts_data has a single voice per part.
+
+    Returns:
+    - tuple: (parts_data, score_data, string_to_print) like convert_to_parts_data.
+    """
+    ticks_per_quarter, tracks = read_midi_file(fp)
+    parts_data = {}
+    histogram = np.zeros(12)
+    for track in tracks:
+        channels = sorted({n[4] for n in track['notes']})
+        for channel in channels:
+            notes = [n for n in track['notes'] if n[4] == channel]
+            melodies, beat_ends, dynamics, lyrics, part_histogram = _sequence_midi_notes(
+                notes, track['lyrics'], ticks_per_quarter)
+            if channel != 9:
+                histogram += part_histogram
+            instrument_name = _get_instrument_name(track['programs'].get(channel), channel)
+            _add_part(parts_data, track['name'] or instrument_name, instrument_name, melodies, beat_ends, dynamics,
+                      lyrics)
+
+    key_signature = _first_value(tracks, 'key_signatures')
+    if key_signature is not None:
+        key_signature = key.KeySignature(key_signature[0]).asKey(key_signature[1])
+    score_data = _get_score_data(histogram, key_signature, _first_value(tracks, 'time_signatures'),
+                                 _first_value(tracks, 'tempos'), key_detection)
+    return parts_data, score_data, format_parts_data_output(parts_data, score_data, output_format)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _open_musicxml(fp):
+    if isinstance(fp, (str, os.PathLike)) and str(fp).lower().endswith(COMPRESSED_MUSICXML_EXTENSIONS):
+        archive = zipfile.ZipFile(fp)
+        root_file = None
+        if 'META-INF/container.xml' in archive.namelist():
+            container = ET.fromstring(archive.read('META-INF/container.xml'))
+            root_file = next((e.get('full-path') for e in container.iter() if _local_name(e.tag) == 'rootfile'),
+                             None)
+        if root_file is None:
+            root_file = next(name for name in archive.namelist()
+                             if name.endswith(MUSICXML_EXTENSIONS) and not name.startswith('META-INF'))
+        return archive.open(root_file)
+    return fp
+
+
+class _MusicXMLPart:
+    def __init__(self, name, instrument_name):
+        self.name = name
+        self.instrument_name = instrument_name
+        self.melodies = []
+        self.beat_ends = []
+        self.dynamics = []
+        self.lyrics = []
+        self.position = Fraction(0)
+        self.tied = set()  # indices of elements whose last piece is tied to the next note
+
+    def add(self, names, quarter_length, dynamic, lyric, tie_start, tie_stop):
+        # Tied continuations of the previous element lengthen it instead of adding a new one
+        previous = self.melodies[-1] if self.melodies else None
+        if isinstance(previous, list):
+            previous = previous[0]
+        if tie_stop and len(self.melodies) - 1 in self.tied and previous == names:
+            self.beat_ends[-1] = _to_quarter_length(self.position + quarter_length)
+        else:
+            self.melodies.append(names)
+            self.beat_ends.append(_to_quarter_length(self.position + quarter_length))
+            self.dynamics.append(dynamic if names != 'rest' else '')
+            self.lyrics.append(lyric)
+        self.tied.discard(len(self.melodies) - 2)
+        if tie_start:
+            self.tied.add(len(self.melodies) - 1)
+        else:
+            self.tied.discard(len(self.melodies) - 1)
+        self.position += quarter_length
+
+
+def _note_name(pitch_element):
+    step = pitch_element.findtext('step', '').strip()
+    alter = int(round(float(pitch_element.findtext('alter', '0') or 0)))
+    octave = pitch_element.findtext('octave', '4').strip()
+    return step + ('#' * alter if alter > 0 else '-' * -alter) + octave
+
+
+def read_musicxml_parts_data(fp, key_detection='fast', output_format='json'):
+    """
+    Reads a MusicXML (.xml, .musicxml or compressed .mxl) file straight into parts_data and score_data with
+    ElementTree.iterparse, clearing each measure once read, so memory use stays flat however long the file is.
+
+    Only the first voice of each part is read and grace notes are skipped. Tied notes become one element.
+    Dynamics come from each note's dynamics attribute, else from the last dynamics marking.
+
+    Returns:
+    - tuple: (parts_data, score_data, string_to_print) like convert_to_parts_data.
+    """
+    source = _open_musicxml(fp)
+    part_names = {}
+    parts = []
+    current = None
+    divisions = 1
+    dynamic = 'mf'
+    voice = None
+    histogram = np.zeros(12)
+    key_signature = time_signature = bpm = None
+    try:
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            tag = _local_name(element.tag)
+            if event == 'start':
+                if tag == 'part':
+                    part_id = element.get('id')
+                    name, instrument_name = part_names.get(part_id, (None, None))
+                    current = _MusicXMLPart(name, instrument_name)
+                    parts.append(current)
+                    divisions, dynamic, voice = 1, 'mf', None
+                continue
+
+            if tag == 'score-part':
+                name = (element.findtext('part-name') or '').strip() or None
+                instrument_name = (element.findtext('score-instrument/instrument-name') or '').strip()
+                part_names[element.get('id')] = (name, instrument_name or name or 'Piano')
+            elif current is None:
+                continue
+            elif tag == 'divisions':
+                divisions = int(float(element.text))
+            elif tag == 'key' and key_signature is None and element.findtext('fifths') is not None:
+                mode = element.findtext('mode')
+                key_signature = key.KeySignature(int(element.findtext('fifths'))).asKey(
+                    mode if mode in ('major', 'minor') else 'major')
+            elif tag == 'time' and time_signature is None and element.findtext('beats'):
+                time_signature = (element.findtext('beats'), element.findtext('beat-type'))
+            elif tag == 'sound' and bpm is None and element.get('tempo'):
+                bpm = float(element.get('tempo'))
+            elif tag == 'dynamics':
+                marks = [_local_name(child.tag) for child in element if _local_name(child.tag) in _DYNAMIC_MARKS]
+                if marks:
+                    dynamic = marks[0]
+            elif tag == 'note':
+                if element.find('grace') is not None or element.find('cue') is not None:
+                    continue
+                note_voice = element.findtext('voice', '1')
+                if voice is None:
+                    voice = note_voice
+                quarter_length = Fraction(int(element.findtext('duration', '0')), divisions)
+                if note_voice != voice or quarter_length <= 0:
+                    continue
+                pitch_element = element.find('pitch')
+                if element.find('chord') is not None and current.melodies and pitch_element is not None:
+                    previous = current.melodies[-1]
+                    chord_names = previous if isinstance(previous, list) else [previous]
+                    name = _note_name(pitch_element)
+                    if previous != 'rest' and name not in chord_names:
+                        current.melodies[-1] = chord_names + [name]
+                    continue
+
+                names = _note_name(pitch_element) if pitch_element is not None else 'rest'
+                if pitch_element is None and element.find('unpitched') is not None:
+                    unpitched = element.find('unpitched')
+                    names = unpitched.findtext('display-step', 'C') + unpitched.findtext('display-octave', '4')
+                tie_types = {tie.get('type') for tie in element.findall('tie')}
+                lyric = element.findtext('lyric/text') or ''
+                # The dynamics attribute is the note-on velocity as a percentage of 90
+                note_dynamic = element.get('dynamics')
+                if note_dynamic is not None:
+                    note_dynamic = velocity_to_dynamic(float(note_dynamic) * 90 / 100)
+                current.add(names, quarter_length, note_dynamic or dynamic, lyric, 'start' in tie_types, 'stop' in tie_types)
+            elif tag == 'measure':
+                voice = None
+                element.clear()
+            elif tag == 'part':
+                current = None
+                element.clear()
+    finally:
+        if source is not fp:
+            source.close()
+
+    for part in parts:
+        for names, start, end in zip(part.melodies, [0] + part.beat_ends[:-1], part.beat_ends):
+            if names == 'rest':
+                continue
+            for name in (names if isinstance(names, list) else [names]):
+                midi_pitch = note_name_to_midi(name)
+                if midi_pitch is not None:
+                    histogram[midi_pitch % 12] += float(end - start)
+
+    parts_data = {}
+    for part in parts:
+        _add_part(parts_data, part.name, part.instrument_name or 'Piano', part.melodies, part.beat_ends,
+                  part.dynamics, part.lyrics)
+    score_data = _get_score_data(histogram, key_signature, time_signature, bpm, key_detection)
+    return parts_data, score_data, format_parts_data_output(parts_data, score_data, output_format)
+
+
+def read_parts_data(fp, key_detection='fast', output_format='json'):
+    """
+    Reads a MIDI or MusicXML file into parts_data and score_data without building a music21 score. The format
+    is picked from the file extension. output_format is 'json' or 'compact', as for convert_to_parts_data.
+
+    Returns:
+    - tuple: (parts_data, score_data, string_to_print) like convert_to_parts_data.
+    """
+    extension = os.path.splitext(str(fp))[1].lower()
+    if extension in MIDI_EXTENSIONS:
+        return read_midi_parts_data(fp, key_detection, output_format)
+    if extension in MUSICXML_EXTENSIONS + COMPRESSED_MUSICXML_EXTENSIONS:
+        return read_musicxml_parts_data(fp, key_detection, output_format)
+    raise ValueError('Unsupported file type: ' + str(fp))
@@ -0,0 +1,304 @@
+import math
+import re
+
+from factory_cache import get_pitch_spelling
+from lazy_modules import lazy_module
+from midi_writer import TICKS_PER_QUARTER
+
+np = lazy_module('numpy')
+
+TIE_NONE = 0
+TIE_START = 1
+TIE_CONTINUE = 2
+TIE_STOP = 3
+
+NO_PITCH = -1
+NO_LYRIC = -1
+
+_STEP_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_NOTE_NAME_PATTERN = re.compile(r'^([A-Ga-g])(#*|-*|b*)(\d*)$')
+# Spellings music21 gives pitches made from MIDI note numbers
+MIDI_PITCH_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+_DYNAMIC_VELOCITIES = {'ppp': 20, 'pp': 31, 'p': 42, 'mp': 53, 'mf': 64, 'f': 80, 'ff': 96, 'fff': 112}
+
+
+def parse_note_name(note_name):
+    """
+    Splits a note name such as 'C4', 'F#3', 'B-2' or 'Bb2' into (step, alter, octave) without going through
+    music21. The octave defaults to 4 like music21. Names the fast pattern doesn't cover, such as 'C4#', are read
+    by music21 through the pitch cache. Returns None if the name can't be read.
+    """
+    match = _NOTE_NAME_PATTERN.match(note_name)
+    if not match:
+        if note_name[:1].upper() not in _STEP_SEMITONES:
+            return None  # not a pitch for music21 either, so don't import it to find out
+        spelling = get_pitch_spelling(note_name)
+        if spelling is None:
+            return None
+        step, octave, alter = spelling
+        alter = alter or 0
+        return step, int(alter) if float(alter).is_integer() else alter, octave if octave is not None else 4
+    step, accidental, octave = match.groups()
+    alter = len(accidental) if accidental.startswith('#') else -len(accidental)
+    return step.upper(), alter, int(octave) if octave else 4
+
+
+def note_name_to_midi(note_name):
+    """
+    Converts a note name such as 'C4', 'F#3', 'B-2' or 'Bb2' to a MIDI pitch number. Returns None if the name
+    can't be read or is outside the MIDI range.
+    """
+    parsed = parse_note_name(note_name)
+    if parsed is None:
+        return None
+    step, alter, octave = parsed
+    midi_pitch = math.floor(octave * 12 + 12 + _STEP_SEMITONES[step] + alter + 0.5)  # quarter tones round up
+    if not 0 <= midi_pitch <= 127:
+        return None
+    return midi_pitch
+
+
+def midi_to_note_name(midi_pitch):
+    return MIDI_PITCH_NAMES[midi_pitch % 12] + str(midi_pitch // 12 - 1)
+
+
+def get_chord_string():
+    return ". chords must be entered as an array of notes e.g. ['C4','E#4','G4']. Fix this next time for the invalid chord."
+
+
+def _is_valid_note(chord_note):
+    return len(chord_note) == 1 or (len(chord_note) > 1 and (chord_note[-1].isdigit() or chord_note[-1] in ['#', '-']))
+
+
+def resolve_melody_item(n, warn=None):
+    """
+    Resolves one entry of 'melodies' to a tuple of note names, or () for a rest, following the same rules
+    process_and_output_score has always used: 'S' means '#', invalid chords fall back to their first letter and
+    invalid notes are truncated to their first letter. warn, if given, is called with each warning message.
+    """
+    if hasattr(n, 'pitches'):  # music21 Note or Chord
+        return tuple(p.nameWithOctave for p in n.pitches)
+    if hasattr(n, 'nameWithOctave'):  # music21 Pitch, e.g. from generate_random_notes
+        return (n.nameWithOctave,)
+    if isinstance(n, list) and len(n) > 0:
+        if n == ['rest']:
+            return ()
+        if len(n) > 4 and warn:
+            warn("Warning: Array " + str(n) + "is getting treated as a chord. If its meant to be "
+                                              "separate notes, remove the notes from the array.")
+        chord_notes = [str(chord_note).replace('S', '#') for chord_note in n]
+        if not all(_is_valid_note(chord_note) for chord_note in chord_notes):
+            if warn:
+                warn("Warning: Please fix chord" + str(chord_notes) + get_chord_string())
+            first_note = n[0]
+            return (first_note[0],) if len(first_note) > 0 else ()
+        return tuple(chord_notes)
+    if isinstance(n, str) and n != 'rest' and n != '':
+        n = n.replace('S', '#')
+        if not _is_valid_note(n):
+            if warn:
+                warn('Warning: Please fix note or chord. Truncating ' + n[1:] + " from " + n + get_chord_string())
+            n = n[0]
+        return (n,)
+    return ()
+
+
+class EventTable:
+    """
+    Column-oriented events of one part. Row i is one note, chord or rest with:
+
+    - onset, duration: int64 positions in MIDI ticks (TICKS_PER_QUARTER per quarter note), so bar maths is exact
+    - pitches: int16 matrix of MIDI pitches, one row per event padded with NO_PITCH; a rest has no pitches
+    - velocity: uint8 MIDI velocity
+    - lyric_index: int32 index into lyrics, NO_LYRIC when the event has none
+    - tie: int8 TIE_NONE, TIE_START, TIE_CONTINUE or TIE_STOP
+    - spelling_index: int32 index into spellings, the note names used to rebuild correctly spelled music21 pitches
+    - source_index: int32 index of the 'melodies' entry the event came from
+    """
+
+    def __init__(self, onset, duration, pitches, velocity, lyric_index, tie, spelling_index, source_index,
+                 spellings, lyrics):
+        self.onset = onset
+        self.duration = duration
+        self.pitches = pitches
+        self.velocity = velocity
+        self.lyric_index = lyric_index
+        self.tie = tie
+        self.spelling_index = spelling_index
+        self.source_index = source_index
+        self.spellings = spellings
+        self.lyrics = lyrics
+
+    def __len__(self):
+        return len(self.onset)
+
+    @property
+    def end(self):
+        return self.onset + self.duration
+
+    @property
+    def is_rest(self):
+        return self.pitches[:, 0] == NO_PITCH
+
+    @property
+    def total_duration(self):
+        return int(self.end.max()) if len(self) else 0
+
+    def take(self, indices):
+        """
+        Returns a new table with only the given rows (an index array or boolean mask).
+        """
+        return EventTable(self.onset[indices], self.duration[indices], self.pitches[indices],
+                          self.velocity[indices], self.lyric_index[indices], self.tie[indices],
+                          self.spelling_index[indices], self.source_index[indices], self.spellings, self.lyrics)
+
+    def bar_index(self, bar_ticks):
+        return self.onset // bar_ticks
+
+    def split_at_bars(self, bar_ticks):
+        """
+        Splits every event that crosses a bar line into one tied segment per bar it touches, in one vectorized
+        pass. Lyrics stay on the first segment only and rests are split without ties.
+        """
+        if len(self) == 0:
+            return self
+        end = self.end
+        first_bar = self.onset // bar_ticks
+        last_bar = np.maximum((end - 1) // bar_ticks, first_bar)
+        segment_counts = last_bar - first_bar + 1
+        if np.all(segment_counts == 1):
+            return self
+
+        rows = np.repeat(np.arange(len(self)), segment_counts)
+        segment_no = np.arange(len(rows)) - np.repeat(np.cumsum(segment_counts) - segment_counts, segment_counts)
+        segment_bar = first_bar[rows] + segment_no
+        onset = np.maximum(self.onset[rows], segment_bar * bar_ticks)
+        duration = np.minimum(end[rows], (segment_bar + 1) * bar_ticks) - onset
+
+        is_split = segment_counts[rows] > 1
+        is_last = segment_no == segment_counts[rows] - 1
+        tie = self.tie[rows].copy()
+        tie[is_split & (segment_no == 0)] = TIE_START
+        tie[is_split & (segment_no > 0) & ~is_last] = TIE_CONTINUE
+        tie[is_split & (segment_no > 0) & is_last] = TIE_STOP
+        tie[self.is_rest[rows]] = TIE_NONE
+
+        lyric_index = self.lyric_index[rows].copy()
+        lyric_index[segment_no > 0] = NO_LYRIC
+
+        return EventTable(onset, duration, self.pitches[rows], self.velocity[rows], lyric_index, tie,
+                          self.spelling_index[rows], self.source_index[rows], self.spellings, self.lyrics)
+
+    def to_midi_notes(self, ticks_per_quarter=TICKS_PER_QUARTER):
+        """
+        Returns the (onset, quarter_length, midi_pitches, velocity, lyric) tuples midi_writer encodes.
+        Tied segments are joined back into single notes first, the same as music21 does when writing MIDI.
+        """
+        notes = []
+        held = None
+        for row in range(len(self)):
+            tie = self.tie[row]
+            if tie in (TIE_CONTINUE, TIE_STOP) and held is not None:
+                held[1] += int(self.duration[row])
+            else:
+                if held is not None:
+                    notes.append(held)
+                if self.pitches[row, 0] == NO_PITCH:
+                    held = None
+                    continue
+                lyric = self.lyrics[self.lyric_index[row]] if self.lyric_index[row] != NO_LYRIC else None
+                held = [int(self.onset[row]), int(self.duration[row]),
+                        [int(p) for p in self.pitches[row] if p != NO_PITCH], int(self.velocity[row]), lyric]
+            if tie in (TIE_NONE, TIE_STOP):
+                notes.append(held)
+                held = None
+        if held is not None:
+            notes.append(held)
+        return [(onset / ticks_per_quarter, duration / ticks_per_quarter, pitches, velocity, lyric)
+                for onset, duration, pitches, velocity, lyric in notes]
+
+
+def beat_ends_to_durations(beat_ends):
+    """
+    Vectorized version of the beat_end handling in process_and_output_score. Returns (durations, keep) where keep
+    is False for entries that repeat the previous beat_end (those notes are dropped) and a beat_end lower than the
+    previous one is taken as a duration of its own.
+    """
+    beat_ends = np.asarray(beat_ends, dtype=np.float64)
+    previous = np.concatenate(([0.0], beat_ends[:-1]))
+    durations = np.where(beat_ends > previous, beat_ends - previous, beat_ends)
+    return durations, beat_ends != previous
+
+
+def dynamics_to_velocities(dynamics_list, keep):
+    """
+    Maps dynamics markings to velocities, one per entry of keep. An empty marking means 'mf' and entries past the
+    end of the list keep the velocity of the last entry that wasn't dropped, as in process_and_output_score.
+    """
+    velocities = np.full(len(keep), 64, dtype=np.uint8)
+    given = min(len(dynamics_list), len(keep))
+    if given:
+        velocities[:given] = [_DYNAMIC_VELOCITIES.get(d or 'mf', 64) for d in dynamics_list[:given]]
+        kept_given = np.flatnonzero(keep[:given])
+        velocities[given:] = velocities[kept_given[-1]] if len(kept_given) else 64
+    return velocities
+
+
+def build_event_table(melodies, beat_ends, dynamics_list=(), lyrics=(), warn=None):
+    """
+    Builds an EventTable from the flat lists of one part of parts_data. Each distinct note or chord spelling is
+    parsed once; everything else is done with array operations. warn, if given, is called with the same warning
+    messages process_and_output_score prints for bad input.
+    """
+    length = min(len(melodies), len(beat_ends))
+    durations, keep = beat_ends_to_durations(list(beat_ends[:length]))
+    ticks = np.rint(durations * TICKS_PER_QUARTER).astype(np.int64)
+
+    spellings = []
+    spelling_ids = {}
+    spelling_index = np.empty(length, dtype=np.int32)
+    for i in range(length):
+        if not keep[i]:
+            if warn:
+                warn("Error!!! You can't have two or more notes with the same beat_end value on the same part!"
+                     " Fix and try again.")
+            spelling_index[i] = 0
+            continue
+        spelling = resolve_melody_item(melodies[i], warn)
+        index = spelling_ids.get(spelling)
+        if index is None:
+            index = spelling_ids[spelling] = len(spellings)
+            spellings.append(spelling)
+        spelling_index[i] = index
+
+    spelling_pitches = []
+    for spelling in spellings:
+        midi_pitches = [note_name_to_midi(name) for name in spelling]
+        if None in midi_pitches:
+            if warn:
+                warn("Error: Please fix note or chord " + (spelling[0] if len(spelling) == 1 else str(list(spelling)))
+                     + get_chord_string())
+            midi_pitches = []
+        spelling_pitches.append(midi_pitches)
+    width = max([len(p) for p in spelling_pitches] + [1])
+    pitch_matrix = np.full((len(spellings), width), NO_PITCH, dtype=np.int16)
+    for index, midi_pitches in enumerate(spelling_pitches):
+        pitch_matrix[index, :len(midi_pitches)] = midi_pitches
+
+    lyric_table = []
+    lyric_ids = {}
+    lyric_index = np.full(length, NO_LYRIC, dtype=np.int32)
+    for i, lyric in enumerate(lyrics[:length]):
+        index = lyric_ids.get(lyric)
+        if index is None:
+            index = lyric_ids[lyric] = len(lyric_table)
+            lyric_table.append(lyric)
+        lyric_index[i] = index
+
+    rows = np.flatnonzero(keep & (ticks > 0))
+    duration = ticks[rows]
+    onset = np.cumsum(duration) - duration
+    return EventTable(onset, duration, pitch_matrix[spelling_index[rows]],
+                      dynamics_to_velocities(list(dynamics_list), keep)[rows], lyric_index[rows],
+                      np.zeros(len(rows), dtype=np.int8), spelling_index[rows], rows.astype(np.int32),
+                      spellings, lyric_table)
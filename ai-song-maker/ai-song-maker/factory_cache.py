@@ -0,0 +1,141 @@
+import copy
+from collections import OrderedDict
+
+from lazy_modules import lazy_music21
+
+note, chord, meter, key, tempo, clef, instrument, pitch = lazy_music21('note', 'chord', 'meter', 'key', 'tempo', 'clef',
+                                                                   'instrument', 'pitch')
+
+_MISSING = object()
+
+
+class FactoryCache:
+    """
+    Bounded LRU cache of values parsed with music21, such as pitch spellings and signature prototypes, with
+    hit/miss counters. A failed parse is cached as None, so a bad string only raises once however often it
+    repeats in a song.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, cache_key, factory):
+        prototype = self._items.get(cache_key, _MISSING)
+        if prototype is not _MISSING:
+            self.hits += 1
+            self._items.move_to_end(cache_key)
+            return prototype
+
+        self.misses += 1
+        try:
+            prototype = factory()
+        except Exception:
+            prototype = None
+        self._items[cache_key] = prototype
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return prototype
+
+    def clear(self):
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._items)
+
+
+pitch_cache = FactoryCache(maxsize=2048)
+signature_cache = FactoryCache(maxsize=256)
+
+
+def get_cache_stats():
+    return {'pitch': pitch_cache.stats(), 'signature': signature_cache.stats()}
+
+
+def clear_factory_caches():
+    pitch_cache.clear()
+    signature_cache.clear()
+
+
+def _get_spelling(parsed_pitch):
+    accidental = parsed_pitch.accidental
+    return parsed_pitch.step, parsed_pitch.octave, accidental.alter if accidental is not None else None
+
+
+def get_pitch_spelling(pitch_name):
+    """
+    Returns (step, octave, alter) for pitch_name as music21 reads it, or None if music21 can't parse it. octave
+    and alter are None when the name has no octave or no accidental. Each name is parsed once and kept.
+    """
+    return pitch_cache.get(pitch_name, lambda: _get_spelling(pitch.Pitch(pitch_name)))
+
+
+def create_pitch(pitch_name):
+    """
+    Returns a new Pitch for pitch_name, or None if the name is invalid. Building a Pitch from its cached step,
+    octave and alter skips parsing the name and is cheaper than copying a parsed Pitch.
+    """
+    spelling = get_pitch_spelling(pitch_name)
+    if spelling is None:
+        return None
+    step, octave, alter = spelling
+    return pitch.Pitch(step=step, octave=octave, accidental=alter)
+
+
+def create_note(pitch_name, quarterLength=1.0):
+    """
+    Returns a new Note for pitch_name, or None if the name is invalid.
+    """
+    new_pitch = create_pitch(pitch_name)
+    if new_pitch is None:
+        return None
+    return note.Note(new_pitch, quarterLength=quarterLength)
+
+
+def create_chord(pitch_names, quarterLength=1.0):
+    """
+    Returns a new Chord of pitch_names, or None if any name is invalid.
+    """
+    pitches = [create_pitch(str(pitch_name)) for pitch_name in pitch_names]
+    if None in pitches:
+        return None
+    return chord.Chord(pitches, quarterLength=quarterLength)
+
+
+def _copy_signature(kind, data, factory):
+    prototype = signature_cache.get((kind, data), factory)
+    return copy.deepcopy(prototype) if prototype is not None else None
+
+
+def create_key(key_data):
+    return _copy_signature('key', key_data, lambda: key.Key(key_data))
+
+
+def create_time_signature(time_data):
+    return _copy_signature('time_signature', time_data, lambda: meter.TimeSignature(time_data))
+
+
+def create_clef(clef_data):
+    """
+    Returns a new Clef for a music21 clef class name such as 'BassClef', or None if clef_data doesn't name one.
+    Names that aren't clefs are not cached, so they can't stand in for a clef later.
+    """
+    clef_class = getattr(clef, clef_data, None) if isinstance(clef_data, str) else None
+    if not isinstance(clef_class, type) or not issubclass(clef_class, clef.Clef):
+        return None
+    return _copy_signature('clef', clef_data, clef_class)
+
+
+def create_tempo(bpm):
+    return _copy_signature('tempo', bpm, lambda: tempo.MetronomeMark(number=bpm))
+
+
+def create_instrument(class_name):
+    return _copy_signature('instrument', class_name, lambda: getattr(instrument, class_name)())
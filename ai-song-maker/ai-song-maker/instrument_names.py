@@ -0,0 +1,61 @@
+# Names people use for instruments music21 has under another class name
+INSTRUMENT_CLASS_ALIASES = {
+    'Cello': 'Violoncello',
+    'FrenchHorn': 'Horn',
+    'StringEnsemble': 'StringInstrument',
+    'StringSection': 'StringInstrument',
+    'Voice': 'Piano',
+    'Vocalist': 'Piano',
+    'VocalistOverride': 'Voice',
+}
+UNSUPPORTED_VOICE_NAMES = ('Voice', 'Vocalist')
+# The Instrument and Clef classes of music21.instrument and music21.clef, so names can be checked without
+# importing music21. tests/test_validation.py checks them against the installed music21.
+INSTRUMENT_CLASS_NAMES = frozenset([
+    'Accordion', 'AcousticBass', 'AcousticGuitar', 'Agogo', 'Alto', 'AltoSaxophone', 'Bagpipes', 'Banjo', 'Baritone',
+    'BaritoneSaxophone', 'Bass', 'BassClarinet', 'BassDrum', 'BassTrombone', 'Bassoon', 'BongoDrums', 'BrassInstrument',
+    'Castanets', 'Celesta', 'Choir', 'ChurchBells', 'Clarinet', 'Clavichord', 'Conductor', 'CongaDrum', 'Contrabass',
+    'Contrabassoon', 'Cowbell', 'CrashCymbals', 'Cymbals', 'Dulcimer', 'ElectricBass', 'ElectricGuitar',
+    'ElectricOrgan', 'ElectricPiano', 'EnglishHorn', 'FingerCymbals', 'Flute', 'FretlessBass', 'Glockenspiel', 'Gong',
+    'Guitar', 'Handbells', 'Harmonica', 'Harp', 'Harpsichord', 'HiHatCymbal', 'Horn', 'Instrument', 'Kalimba',
+    'KeyboardInstrument', 'Koto', 'Lute', 'Mandolin', 'Maracas', 'Marimba', 'MezzoSoprano', 'Oboe', 'Ocarina', 'Organ',
+    'PanFlute', 'Percussion', 'Piano', 'Piccolo', 'PipeOrgan', 'PitchedPercussion', 'Ratchet', 'Recorder', 'ReedOrgan',
+    'RideCymbals', 'Sampler', 'SandpaperBlocks', 'Saxophone', 'Shakuhachi', 'Shamisen', 'Shehnai', 'Siren', 'Sitar',
+    'SizzleCymbal', 'SleighBells', 'SnareDrum', 'Soprano', 'SopranoSaxophone', 'SplashCymbals', 'SteelDrum',
+    'StringInstrument', 'SuspendedCymbal', 'Taiko', 'TamTam', 'Tambourine', 'TempleBlock', 'Tenor', 'TenorDrum',
+    'TenorSaxophone', 'Timbales', 'Timpani', 'TomTom', 'Triangle', 'Trombone', 'Trumpet', 'Tuba', 'TubularBells',
+    'Ukulele', 'UnpitchedPercussion', 'Vibraphone', 'Vibraslap', 'Viola', 'Violin', 'Violoncello', 'Vocalist', 'Whip',
+    'Whistle', 'WindMachine', 'Woodblock', 'WoodwindInstrument', 'Xylophone'
+])
+CLEF_CLASS_NAMES = frozenset([
+    'AltoClef', 'Bass8vaClef', 'Bass8vbClef', 'BassClef', 'CBaritoneClef', 'CClef', 'Clef', 'FBaritoneClef', 'FClef',
+    'FrenchViolinClef', 'GClef', 'GSopranoClef', 'JianpuClef', 'MezzoSopranoClef', 'NoClef', 'PercussionClef',
+    'PitchClef', 'SopranoClef', 'SubBassClef', 'TabClef', 'TenorClef', 'Treble8vaClef', 'Treble8vbClef', 'TrebleClef'
+])
+
+
+def get_instrument_class_name(instrument_name, warn=print):
+    """
+    Normalizes an instrument name such as "French Horn" to the music21 class name to create, e.g. "Horn".
+    """
+    # Normalize the instrument name to match class naming conventions in music21
+    # This might include capitalizing the first letter and removing spaces for compound names
+    class_name = instrument_name.replace(' ', '')
+    if class_name in UNSUPPORTED_VOICE_NAMES and warn:
+        warn(class_name + " is not supported! Piano will simulate " + ("voice" if class_name == 'Voice' else class_name)
+             + " section, you will need to add your own voice in")
+    return INSTRUMENT_CLASS_ALIASES.get(class_name, class_name)
+
+
+def is_instrument_class_name(class_name):
+    """
+    Returns True if music21.instrument has an Instrument class of that name, without importing music21.
+    """
+    return class_name in INSTRUMENT_CLASS_NAMES
+
+
+def is_clef_class_name(class_name):
+    """
+    Returns True if music21.clef has a Clef class of that name, without importing music21.
+    """
+    return class_name in CLEF_CLASS_NAMES
@@ -0,0 +1,125 @@
+from lazy_modules import lazy_module, lazy_music21
+
+np = lazy_module('numpy')
+key = lazy_music21('key')
+
+# Aarden-Essen key profiles, the ones music21's score.analyze('key') uses
+AARDEN_ESSEN_MAJOR = [17.7661, 0.145624, 14.9265, 0.160186, 19.8049, 11.3587, 0.291248, 22.062, 0.145624, 8.15494,
+                      0.232998, 4.95122]
+AARDEN_ESSEN_MINOR = [18.2648, 0.737619, 14.0499, 16.8599, 0.702494, 14.4362, 0.702494, 18.6161, 4.56621, 1.93186,
+                      7.37619, 1.75623]
+# Tonic spellings music21 picks for each pitch class
+MAJOR_TONICS = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+MINOR_TONICS = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+
+def build_key_profiles(major_weights=AARDEN_ESSEN_MAJOR, minor_weights=AARDEN_ESSEN_MINOR):
+    """
+    Returns a 24 x 12 matrix: row i (i < 12) is the major profile rotated to tonic pitch class i and row 12 + i
+    the minor profile rotated to i.
+    """
+    rotation = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+    return np.vstack((np.asarray(major_weights)[rotation], np.asarray(minor_weights)[rotation]))
+
+
+_key_profiles = None
+
+
+def get_key_profiles():
+    """
+    Returns the Aarden-Essen profiles from build_key_profiles, built on first use so importing stays cheap.
+    """
+    global _key_profiles
+    if _key_profiles is None:
+        _key_profiles = build_key_profiles()
+    return _key_profiles
+
+
+def get_pitch_class_histogram(score):
+    """
+    Returns the duration-weighted pitch class histogram of every pitched note and chord in the score. Notes are
+    gathered in one pass and summed with np.bincount.
+    """
+    pitch_classes = []
+    durations = []
+    for element in score.recurse().notes:
+        pitches = element.pitches
+        if not pitches:
+            continue
+        quarter_length = float(element.quarterLength)
+        for p in pitches:
+            pitch_classes.append(p.pitchClass)
+            durations.append(quarter_length)
+    return np.bincount(np.asarray(pitch_classes, dtype=np.int64), weights=np.asarray(durations, dtype=np.float64),
+                       minlength=12)
+
+
+def correlate_key_profiles(histogram, profiles=None):
+    """
+    Returns the Pearson correlation of the histogram with every row of profiles (get_key_profiles() if not
+    given) as one matrix operation.
+    """
+    if profiles is None:
+        profiles = get_key_profiles()
+    centered_profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    centered_histogram = np.asarray(histogram, dtype=np.float64) - np.mean(histogram)
+    denominator = np.sqrt((centered_profiles ** 2).sum(axis=1) * (centered_histogram ** 2).sum())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlations = centered_profiles @ centered_histogram / denominator
+    return np.nan_to_num(correlations)
+
+
+def estimate_key(histogram, profiles=None):
+    """
+    Returns (tonic, mode, correlation) for the best matching key profile, or None if the histogram is empty.
+    """
+    if not np.any(histogram):
+        return None
+    correlations = correlate_key_profiles(histogram, profiles)
+    best = int(np.argmax(correlations))
+    if best < 12:
+        return MAJOR_TONICS[best], 'major', float(correlations[best])
+    return MINOR_TONICS[best - 12], 'minor', float(correlations[best])
+
+
+def get_key_signature_from_file(score):
+    """
+    Returns the first key or key signature written in the score as a music21 Key, or None if there is none.
+    """
+    key_sig = score.recurse().getElementsByClass(key.KeySignature).first()
+    if key_sig is None:
+        return None
+    if isinstance(key_sig, key.Key):
+        return key_sig
+    return key_sig.asKey('major')
+
+
+def detect_key(score, method='fast'):
+    """
+    Finds the key of a score.
+
+    Args:
+    - score (music21.stream.Score): The score to analyze.
+    - method (str): 'fast' correlates a vectorized pitch class histogram with the Aarden-Essen profiles, which
+      matches score.analyze('key'); 'music21' calls score.analyze('key'); 'signature' uses the first key
+      signature in the file and only falls back to 'fast' when there is none.
+
+    Returns:
+    - music21.key.Key: The key, C major if the score has no pitched notes.
+    """
+    if method == 'music21':
+        return score.analyze('key')
+    if method == 'signature':
+        key_sig = get_key_signature_from_file(score)
+        if key_sig is not None:
+            return key_sig
+    elif method != 'fast':
+        raise ValueError("method must be 'fast', 'music21' or 'signature'")
+
+    estimate = estimate_key(get_pitch_class_histogram(score))
+    if estimate is None:
+        return key.Key('C')
+    tonic, mode, correlation = estimate
+    key_sig = key.Key(tonic, mode)
+    key_sig.correlationCoefficient = correlation
+    return key_sig
@@ -0,0 +1,33 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is first used, and only then imports it. music21 and
+    numpy take hundreds of milliseconds to import, so modules that only need them to build objects hold
+    LazyModules instead, and importing them to validate or serialize parts_data stays cheap.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_lazy_module_name'] = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._lazy_module_name)
+        # Later lookups find the module's attributes here directly and no longer go through __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return '<LazyModule ' + repr(self._lazy_module_name) + '>'
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+def lazy_music21(*names):
+    """
+    Returns a LazyModule for each music21 submodule named, for `stream, note = lazy_music21('stream', 'note')`.
+    """
+    modules = tuple(LazyModule('music21.' + name) for name in names)
+    return modules[0] if len(modules) == 1 else modules
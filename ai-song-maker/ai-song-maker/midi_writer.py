@@ -0,0 +1,126 @@
+import struct
+
+# music21 writes MIDI files with this resolution, so using it here keeps note timings identical tick for tick
+TICKS_PER_QUARTER = 10080
+PERCUSSION_CHANNEL = 9
+
+
+def encode_variable_length(value):
+    """
+    Encodes a non-negative integer as a MIDI variable-length quantity.
+    """
+    value = int(value)
+    buffer = [value & 0x7F]
+    value >>= 7
+    while value:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(buffer))
+
+
+def _meta_event(meta_type, data):
+    return b'\xff' + bytes([meta_type]) + encode_variable_length(len(data)) + data
+
+
+def _track_chunk(timed_events, end_tick):
+    """
+    Builds an MTrk chunk from (tick, order, event_bytes) tuples. Events at the same tick are written
+    by their order value so note-offs always come before the next note-ons.
+    """
+    data = bytearray()
+    last_tick = 0
+    for tick, _, event_bytes in sorted(timed_events, key=lambda e: (e[0], e[1])):
+        data += encode_variable_length(tick - last_tick)
+        data += event_bytes
+        last_tick = tick
+    data += encode_variable_length(max(end_tick - last_tick, 0))
+    data += _meta_event(0x2F, b'')
+    return b'MTrk' + struct.pack('>I', len(data)) + bytes(data)
+
+
+def _conductor_track(bpm, time_signature, key_sharps, key_mode, ticks_per_quarter):
+    numerator, denominator = time_signature
+    microseconds_per_quarter = int(round(60000000 / bpm))
+    events = [
+        (0, 0, _meta_event(0x51, microseconds_per_quarter.to_bytes(3, 'big'))),
+        (0, 1, _meta_event(0x59, struct.pack('>bB', key_sharps, 1 if key_mode == 'minor' else 0))),
+        (0, 2, _meta_event(0x58, bytes([numerator, denominator.bit_length() - 1, 24, 8]))),
+    ]
+    return _track_chunk(events, ticks_per_quarter)
+
+
+def _part_track(track, channel, ticks_per_quarter):
+    events = []
+    name = track.get('name')
+    if name:
+        events.append((0, 0, _meta_event(0x03, str(name).encode('utf-8'))))
+    program = track.get('program')
+    if program is not None:
+        events.append((0, 1, bytes([0xC0 | channel, program & 0x7F])))
+    events.append((0, 2, bytes([0xE0 | channel, 0x00, 0x40])))
+
+    end_tick = 0
+    for onset, quarter_length, pitches, velocity, lyric in track.get('notes', []):
+        start = int(round(onset * ticks_per_quarter))
+        stop = int(round((onset + quarter_length) * ticks_per_quarter))
+        end_tick = max(end_tick, stop)
+        if not pitches or stop <= start:
+            continue
+        if lyric:
+            events.append((start, 4, _meta_event(0x05, str(lyric).encode('utf-8'))))
+        velocity = max(1, min(127, int(velocity or 64)))
+        for midi_pitch in pitches:
+            events.append((start, 5, bytes([0x90 | channel, midi_pitch & 0x7F, velocity])))
+            events.append((stop, 3, bytes([0x80 | channel, midi_pitch & 0x7F, 0])))
+    return _track_chunk(events, end_tick + ticks_per_quarter)
+
+
+def assign_channels(tracks):
+    """
+    Gives every track its own channel in the same way music21 does: 0-8 and 10-15, with channel 9
+    reserved for tracks that ask for percussion.
+    """
+    free_channels = [c for c in range(16) if c != PERCUSSION_CHANNEL]
+    channels = []
+    for track in tracks:
+        if track.get('channel') == PERCUSSION_CHANNEL:
+            channels.append(PERCUSSION_CHANNEL)
+        else:
+            channels.append(free_channels[len(channels) % len(free_channels)])
+    return channels
+
+
+def encode_midi(tracks, bpm=120, time_signature=(4, 4), key_sharps=0, key_mode='major',
+                ticks_per_quarter=TICKS_PER_QUARTER):
+    """
+    Encodes already resolved note data as a format 1 Standard MIDI File.
+
+    Args:
+    - tracks (list of dict): One dict per part with 'name', 'program', optional 'channel' and 'notes', where
+      'notes' is a list of (onset, quarter_length, midi_pitches, velocity, lyric) tuples in quarter lengths.
+    - bpm (float): Tempo written to the conductor track.
+    - time_signature (tuple): (numerator, denominator) written to the conductor track.
+    - key_sharps (int): Number of sharps (negative for flats) of the key signature.
+    - key_mode (str): 'major' or 'minor'.
+
+    Returns:
+    - bytes: The complete MIDI file.
+    """
+    header = b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks) + 1, ticks_per_quarter)
+    chunks = [header, _conductor_track(bpm, time_signature, key_sharps, key_mode, ticks_per_quarter)]
+    for track, channel in zip(tracks, assign_channels(tracks)):
+        chunks.append(_part_track(track, channel, ticks_per_quarter))
+    return b''.join(chunks)
+
+
+def write_midi(tracks, fp, **kwargs):
+    """
+    Writes encode_midi's file to fp, a path or a binary file object.
+    """
+    data = encode_midi(tracks, **kwargs)
+    if hasattr(fp, 'write'):
+        fp.write(data)
+        return fp
+    with open(fp, 'wb') as f:
+        f.write(data)
+    return fp
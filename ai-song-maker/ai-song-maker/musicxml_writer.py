@@ -0,0 +1,252 @@
+import io
+import zipfile
+from math import gcd
+
+from event_table import NO_LYRIC, TIE_START, TIE_CONTINUE, TIE_STOP, parse_note_name
+from lazy_modules import lazy_module, lazy_music21
+from midi_writer import TICKS_PER_QUARTER
+
+np = lazy_module('numpy')
+key, meter, clef, tempo = lazy_music21('key', 'meter', 'clef', 'tempo')
+
+MXL_MIMETYPE = 'application/vnd.recordare.musicxml'
+_MXL_CONTAINER = ('<?xml version="1.0" encoding="UTF-8"?>\n<container><rootfiles>'
+                  '<rootfile full-path="{name}" media-type="application/vnd.recordare.musicxml+xml"/>'
+                  '</rootfiles></container>\n')
+_XML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+# (ticks, type) from a breve down to a 128th note, the shortest binary value 10080 ticks per quarter can hold
+_NOTE_TYPES = [(TICKS_PER_QUARTER * 8, 'breve'), (TICKS_PER_QUARTER * 4, 'whole'), (TICKS_PER_QUARTER * 2, 'half'),
+               (TICKS_PER_QUARTER, 'quarter'), (TICKS_PER_QUARTER // 2, 'eighth'), (TICKS_PER_QUARTER // 4, '16th'),
+               (TICKS_PER_QUARTER // 8, '32nd'), (TICKS_PER_QUARTER // 16, '64th'),
+               (TICKS_PER_QUARTER // 32, '128th')]
+_EXACT_TYPES = {}
+for _ticks, _type in _NOTE_TYPES:
+    _EXACT_TYPES[_ticks] = (_type, 0, False)
+    if _ticks * 3 % 2 == 0:
+        _EXACT_TYPES.setdefault(_ticks * 3 // 2, (_type, 1, False))
+    if _ticks * 7 % 4 == 0:
+        _EXACT_TYPES.setdefault(_ticks * 7 // 4, (_type, 2, False))
+    if _ticks * 2 % 3 == 0:
+        _EXACT_TYPES.setdefault(_ticks * 2 // 3, (_type, 0, True))
+
+
+def _escape(text):
+    # Same as xml.sax.saxutils.escape, which would import urllib along with it
+    return text.translate(_XML_ESCAPES)
+
+
+def get_duration_pieces(ticks):
+    """
+    Splits a duration into notated pieces that are tied together: a list of (ticks, type, dots, is_triplet).
+    A duration that can't be notated exactly ends with a piece whose type is None.
+    """
+    pieces = []
+    remaining = int(ticks)
+    while remaining > 0:
+        exact = _EXACT_TYPES.get(remaining)
+        if exact is not None:
+            pieces.append((remaining,) + exact)
+            break
+        largest = next(((t, name) for t, name in _NOTE_TYPES if t <= remaining), None)
+        if largest is None:
+            pieces.append((remaining, None, 0, False))
+            break
+        pieces.append((largest[0], largest[1], 0, False))
+        remaining -= largest[0]
+    return pieces
+
+
+def _get_divisions(bar_plans):
+    # The largest tick unit every notated piece is a whole number of, expressed as divisions per quarter note
+    unit = TICKS_PER_QUARTER
+    for plan, _, _ in bar_plans:
+        values = np.unique(np.concatenate((plan.segments.duration, plan.segments.onset % plan.bar_ticks,
+                                           [plan.bar_ticks, plan.total_ticks - plan.segments.total_duration])))
+        for value in values:
+            for piece_ticks, _, _, _ in get_duration_pieces(value):
+                unit = gcd(unit, piece_ticks)
+    return TICKS_PER_QUARTER // unit, unit
+
+
+def _pitch_xml(note_name):
+    step, alter, octave = parse_note_name(note_name)
+    alter_xml = '<alter>' + str(alter) + '</alter>' if alter else ''
+    return '<pitch><step>' + step + '</step>' + alter_xml + '<octave>' + str(octave) + '</octave></pitch>'
+
+
+def _notes_xml(pitch_names, ticks, unit, tie, lyric):
+    pieces = get_duration_pieces(ticks)
+    parts = []
+    for piece_no, (piece_ticks, note_type, dots, is_triplet) in enumerate(pieces):
+        tie_types = []
+        if pitch_names and (piece_no > 0 or tie in (TIE_STOP, TIE_CONTINUE)):
+            tie_types.append('stop')
+        if pitch_names and (piece_no < len(pieces) - 1 or tie in (TIE_START, TIE_CONTINUE)):
+            tie_types.append('start')
+
+        for chord_no, pitch_name in enumerate(pitch_names or [None]):
+            xml = ['<note>']
+            if chord_no > 0:
+                xml.append('<chord/>')
+            xml.append(_pitch_xml(pitch_name) if pitch_name else '<rest/>')
+            xml.append('<duration>' + str(piece_ticks // unit) + '</duration>')
+            xml.extend('<tie type="' + t + '"/>' for t in tie_types)
+            xml.append('<voice>1</voice>')
+            if note_type:
+                xml.append('<type>' + note_type + '</type>')
+                xml.extend('<dot/>' for _ in range(dots))
+            if is_triplet:
+                xml.append('<time-modification><actual-notes>3</actual-notes>'
+                           '<normal-notes>2</normal-notes></time-modification>')
+            if tie_types:
+                xml.append('<notations>' + ''.join('<tied type="' + t + '"/>' for t in tie_types) + '</notations>')
+            if lyric and piece_no == 0 and chord_no == 0:
+                xml.append('<lyric number="1"><syllabic>single</syllabic><text>' + _escape(lyric) + '</text></lyric>')
+            xml.append('</note>')
+            parts.append(''.join(xml))
+    return ''.join(parts)
+
+
+def _attributes_xml(divisions, key_sig, time_sig, clef_sig):
+    xml = ['<attributes><divisions>' + str(divisions) + '</divisions>']
+    if key_sig is not None:
+        xml.append('<key><fifths>' + str(key_sig.sharps) + '</fifths>')
+        if getattr(key_sig, 'mode', None) in ('major', 'minor'):
+            xml.append('<mode>' + key_sig.mode + '</mode>')
+        xml.append('</key>')
+    xml.append('<time><beats>' + str(time_sig.numerator) + '</beats><beat-type>' + str(time_sig.denominator)
+               + '</beat-type></time>')
+    if clef_sig is not None and clef_sig.sign:
+        xml.append('<clef><sign>' + clef_sig.sign + '</sign>')
+        if clef_sig.line:
+            xml.append('<line>' + str(clef_sig.line) + '</line>')
+        xml.append('</clef>')
+    xml.append('</attributes>')
+    return ''.join(xml)
+
+
+def _tempo_xml(tempo_sig):
+    bpm = tempo_sig.getQuarterBPM() or 120
+    return ('<direction placement="above"><direction-type><metronome><beat-unit>quarter</beat-unit><per-minute>'
+            + str(round(bpm, 2)) + '</per-minute></metronome></direction-type><sound tempo="' + str(round(bpm, 2))
+            + '"/></direction>')
+
+
+def iter_part_measures(bar_plans, unit, first_measure_xml=''):
+    """
+    Yields the <measure> elements of a part one at a time from (BarPlan, melodies, is_repeat) tuples in play
+    order. first_measure_xml is inserted at the start of the first measure.
+    """
+    measure_number = 0
+    for plan, _, _ in bar_plans:
+        segments, boundaries, first_rows = plan.segments, plan.boundaries, plan.first_rows
+        for bar_no, bar_dynamic in enumerate(plan.bar_dynamics(measure_number + 1)):
+            measure_number += 1
+            xml = ['<measure number="' + str(measure_number) + '">']
+            if measure_number == 1:
+                xml.append(first_measure_xml)
+            first_row, stop_row = first_rows[bar_no], first_rows[bar_no + 1]
+            xml.append('<direction placement="below"><direction-type><dynamics><' + bar_dynamic
+                       + '/></dynamics></direction-type></direction>')
+
+            filled = 0
+            for row in range(first_row, stop_row):
+                lyric_index = segments.lyric_index[row]
+                lyric = segments.lyrics[lyric_index] if lyric_index != NO_LYRIC else None
+                pitch_names = segments.spellings[segments.spelling_index[row]] if segments.pitches[row, 0] >= 0 else ()
+                xml.append(_notes_xml(pitch_names, int(segments.duration[row]), unit, int(segments.tie[row]), lyric))
+                filled = segments.onset[row] + segments.duration[row] - boundaries[bar_no]
+            if filled < plan.bar_ticks:
+                xml.append(_notes_xml((), int(plan.bar_ticks - filled), unit, 0, None))
+            xml.append('</measure>')
+            yield ''.join(xml)
+
+
+def write_streaming_musicxml(parts, fp, title=None):
+    """
+    Writes MusicXML measure by measure straight from bar plans, without building a music21 score or an element
+    tree, so memory use doesn't grow with the length of the song.
+
+    Args:
+    - parts (list): (part, bar_plans) tuples, where part is a stream.Part holding the part's instrument, key,
+      time signature, clef and tempo and bar_plans is a list of (BarPlan, melodies, is_repeat) in play order.
+    - fp (str or file-like): Path or text file object to write to.
+    - title (str): Optional work title.
+
+    Returns:
+    - The path or file object written to.
+    """
+    if isinstance(fp, str):
+        with open(fp, 'w', encoding='utf-8') as f:
+            write_streaming_musicxml(parts, f, title)
+        return fp
+
+    fp.write('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE score-partwise PUBLIC '
+             '"-//Recordare//DTD MusicXML 4.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">\n'
+             '<score-partwise version="4.0">')
+    if title:
+        fp.write('<work><work-title>' + _escape(str(title)) + '</work-title></work>')
+    fp.write('<part-list>')
+    for number, (part, _) in enumerate(parts, start=1):
+        part_instrument = part.getInstrument(returnDefault=False)
+        name = (part_instrument.instrumentName if part_instrument else None) or str(part.id)
+        fp.write('<score-part id="P' + str(number) + '"><part-name>' + _escape(name) + '</part-name>')
+        if part_instrument is not None and part_instrument.midiProgram is not None:
+            fp.write('<score-instrument id="P' + str(number) + '-I1"><instrument-name>' + _escape(name)
+                     + '</instrument-name></score-instrument><midi-instrument id="P' + str(number)
+                     + '-I1"><midi-program>' + str(part_instrument.midiProgram + 1)
+                     + '</midi-program></midi-instrument>')
+        fp.write('</score-part>')
+    fp.write('</part-list>\n')
+
+    for number, (part, bar_plans) in enumerate(parts, start=1):
+        key_sig = part.getElementsByClass(key.KeySignature).first()
+        time_sig = part.getElementsByClass(meter.TimeSignature).first() or meter.TimeSignature('4/4')
+        clef_sig = part.getElementsByClass(clef.Clef).first()
+        tempo_sig = part.getElementsByClass(tempo.MetronomeMark).first()
+
+        divisions, unit = _get_divisions(bar_plans)
+        first_measure_xml = _attributes_xml(divisions, key_sig, time_sig, clef_sig)
+        if number == 1 and tempo_sig is not None:
+            first_measure_xml += _tempo_xml(tempo_sig)
+
+        fp.write('<part id="P' + str(number) + '">\n')
+        for measure_xml in iter_part_measures(bar_plans, unit, first_measure_xml):
+            fp.write(measure_xml)
+            fp.write('\n')
+        fp.write('</part>\n')
+    fp.write('</score-partwise>\n')
+    return fp
+
+
+def write_compressed_musicxml(write_score, fp, name='score.musicxml'):
+    """
+    Writes a compressed MusicXML (.mxl) file: a zip archive holding the score as name, with the mimetype and
+    META-INF/container.xml entries readers look for. write_score is called with a binary file object for the
+    score inside the archive, so the XML is compressed as it is written and never held whole in memory.
+
+    Args:
+    - fp (str or file-like): Path or binary file object to write the archive to.
+
+    Returns:
+    - The path or file object written to.
+    """
+    with zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('mimetype', MXL_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        archive.writestr('META-INF/container.xml', _MXL_CONTAINER.format(name=name))
+        with archive.open(name, 'w', force_zip64=True) as member:
+            write_score(member)
+    return fp
+
+
+def write_streaming_musicxml_binary(parts, fp, title=None):
+    """
+    write_streaming_musicxml to a binary file object, encoded as UTF-8.
+    """
+    text_fp = io.TextIOWrapper(fp, encoding='utf-8')
+    try:
+        write_streaming_musicxml(parts, text_fp, title)
+        text_fp.flush()
+    finally:
+        text_fp.detach()
+    return fp
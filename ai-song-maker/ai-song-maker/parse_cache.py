@@ -0,0 +1,209 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from direct_reader import read_parts_data
+from factory_cache import create_key, create_time_signature, create_tempo, create_clef
+from lazy_modules import lazy_music21
+from parts_codec import encode_parts_data_binary, decode_parts_data_binary
+from reverse_score import convert_to_parts_data, format_parts_data_output
+
+converter = lazy_music21('converter')
+
+DEFAULT_PARSE_CACHE_DIRECTORY = '/mnt/data/music_files/parse_cache'
+# Bump when a change to convert_to_parts_data or direct_reader changes what they return for the same file
+PARSE_CACHE_VERSION = 1
+CACHE_FILE_EXTENSION = '.asmp'
+_SCORE_FIELD_CREATORS = {'key': create_key, 'time_signature': create_time_signature, 'tempo': create_tempo,
+                         'clef': create_clef}
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-1 of a file's content, read in chunks.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def restore_score_data(score_data):
+    """
+    Turns the plain key, time signature, tempo and clef values parts_codec stores back into music21 objects,
+    as convert_to_parts_data returns them. Values that can't be rebuilt are left as they are.
+    """
+    restored = dict(score_data)
+    for field, creator in _SCORE_FIELD_CREATORS.items():
+        value = restored.get(field)
+        if value is not None:
+            restored[field] = creator(value) or value
+    return restored
+
+
+class ParseCache:
+    """
+    Keeps the parts_data and score_data of imported MIDI and MusicXML files on disk, keyed by a hash of the
+    file's content, the reader, its options and PARSE_CACHE_VERSION, so a file is only parsed and analyzed once.
+
+    Entries are stored with parts_codec's binary encoding and read back through mmap. Several processes can
+    share one directory: entries are written to a temporary file and renamed into place, so readers never see
+    a partial entry, and an entry removed by another process is just a miss. When the directory grows past
+    max_bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, directory=DEFAULT_PARSE_CACHE_DIRECTORY, max_bytes=256 * 1024 * 1024,
+                 version=PARSE_CACHE_VERSION):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def cache_key(self, path, *options):
+        content_hash = hash_file(path)
+        options_hash = hashlib.sha1(repr((self.version,) + options).encode('utf-8')).hexdigest()[:16]
+        return content_hash + '-' + options_hash
+
+    def _entry_path(self, cache_key):
+        return os.path.join(self.directory, cache_key + CACHE_FILE_EXTENSION)
+
+    def get(self, cache_key):
+        """
+        Returns (parts_data, score_data) for the key, or None on a miss. score_data holds plain values; see
+        restore_score_data.
+        """
+        entry_path = self._entry_path(cache_key)
+        decoded = None
+        try:
+            with open(entry_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Decoding errors are handled inside the with block, so no view of the map outlives it
+                try:
+                    decoded = decode_parts_data_binary(mapped)
+                except (ValueError, KeyError, struct.error):
+                    pass
+        except (OSError, ValueError):
+            pass
+        if decoded is None:
+            # Missing, empty, damaged or from an older format: parse the file again
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry_path)  # marks the entry as recently used for eviction
+        except OSError:
+            pass
+        self.hits += 1
+        return decoded
+
+    def put(self, cache_key, parts_data, score_data):
+        data = encode_parts_data_binary(parts_data, score_data)
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary_path, self._entry_path(cache_key))
+        except OSError:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+        if self.max_bytes is not None:
+            self.evict()
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used entries until the directory holds at most max_bytes. Returns how many
+        were removed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scanned:
+            for entry in scanned:
+                if not entry.name.endswith(CACHE_FILE_EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        removed = 0
+        for _, size, entry_path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error removing cache entry {entry_path}: {e}")
+                continue
+            total -= size
+        self.evictions += removed
+        return removed
+
+    def remove_stale_temporary_files(self, max_age=3600):
+        """
+        Removes temporary files left by writers that died mid-write.
+        """
+        now = time.time()
+        with os.scandir(self.directory) as scanned:
+            for entry in scanned:
+                if entry.name.endswith('.tmp'):
+                    try:
+                        if now - entry.stat().st_mtime > max_age:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def clear(self):
+        return self.evict(0)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def convert_file_to_parts_data(path, cache=None, reader='direct', key_detection='fast', output_format='json'):
+    """
+    Converts a MIDI or MusicXML file into parts_data and score_data, going through cache when one is given.
+
+    Args:
+    - path (str): The file to read.
+    - cache (ParseCache): Optional cache shared between calls and processes.
+    - reader (str): 'direct' reads the file with direct_reader, 'music21' parses it into a score and uses
+      convert_to_parts_data.
+    - key_detection (str): Passed on to the reader.
+    - output_format (str): 'json' or 'compact', how string_to_print is encoded.
+
+    Returns:
+    - tuple: (parts_data, score_data, string_to_print) like convert_to_parts_data.
+    """
+    if reader not in ('direct', 'music21'):
+        raise ValueError("reader must be 'direct' or 'music21'")
+    cache_key = cache.cache_key(path, reader, key_detection) if cache is not None else None
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None:
+        parts_data, score_data = cached
+        score_data = restore_score_data(score_data)
+        return parts_data, score_data, format_parts_data_output(parts_data, score_data, output_format)
+
+    if reader == 'direct':
+        parts_data, score_data, string_to_print = read_parts_data(path, key_detection, output_format)
+    else:
+        parts_data, score_data, string_to_print = convert_to_parts_data(converter.parse(path), key_detection,
+                                                                        output_format)
+    if cache is not None:
+        try:
+            cache.put(cache_key, parts_data, score_data)
+        except OSError as e:
+            print(f"Error writing parse cache entry for {path}: {e}")
+    return parts_data, score_data, string_to_print
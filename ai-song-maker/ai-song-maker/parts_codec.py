@@ -0,0 +1,384 @@
+import json
+import struct
+import sys
+from array import array
+from fractions import Fraction
+from functools import reduce
+from math import gcd
+
+from event_table import midi_to_note_name, note_name_to_midi
+from midi_writer import TICKS_PER_QUARTER
+
+PARTS_CODEC_FORMAT = 'ai-song-maker/parts'
+PARTS_CODEC_VERSION = 1
+BINARY_MAGIC = b'ASMP'
+_PART_FIELDS = ('instrument', 'melodies', 'chords', 'beat_ends', 'dynamics', 'lyrics', 'sections')
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+_ODD_TICKS_FACTOR = TICKS_PER_QUARTER // (TICKS_PER_QUARTER & -TICKS_PER_QUARTER)
+
+
+def _json_default(obj):
+    if isinstance(obj, Fraction):
+        return float(obj)
+    if hasattr(obj, 'tolist'):  # NumPy arrays and scalars
+        return obj.tolist()
+    return str(obj)
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=_json_default)
+
+
+def encode_score_data(score_data):
+    """
+    Returns score_data with music21 keys, time signatures, tempos and clefs replaced by the plain values
+    process_and_output_score also accepts: 'C' or 'c' (minor), '3/4', a BPM number and a clef class name.
+    """
+    encoded = {}
+    for field, value in score_data.items():
+        if hasattr(value, 'asKey') or hasattr(value, 'tonic'):
+            key_sig = value if hasattr(value, 'tonic') else value.asKey('major')
+            tonic = key_sig.tonic.name
+            value = tonic.lower() if key_sig.mode == 'minor' else tonic
+        elif hasattr(value, 'ratioString'):
+            value = value.ratioString
+        elif hasattr(value, 'getQuarterBPM'):
+            value = value.getQuarterBPM() or 120
+        elif hasattr(value, 'sign') and hasattr(value, 'line'):
+            value = type(value).__name__
+        encoded[field] = value
+    return encoded
+
+
+def _quarter_length_to_ticks(value):
+    return int(round(float(value) * TICKS_PER_QUARTER))
+
+
+def _ticks_to_quarter_length(ticks):
+    # Whole and binary fractions of a quarter become int and float, anything else (triplets) a Fraction
+    if ticks % TICKS_PER_QUARTER == 0:
+        return ticks // TICKS_PER_QUARTER
+    if ticks % _ODD_TICKS_FACTOR == 0:
+        return ticks / TICKS_PER_QUARTER
+    return Fraction(int(ticks), TICKS_PER_QUARTER)
+
+
+def _melody_names(item):
+    if isinstance(item, str):
+        return None if item == 'rest' else [item]
+    if isinstance(item, (list, tuple)):
+        return None if list(item) == ['rest'] else list(item)
+    if hasattr(item, 'pitches'):  # music21 Note, Chord or Rest
+        return [p.nameWithOctave for p in item.pitches] or None
+    if hasattr(item, 'nameWithOctave'):  # music21 Pitch
+        return [item.nameWithOctave]
+    return None
+
+
+def _decode_melody(midi_pitches):
+    if len(midi_pitches) == 0:
+        return 'rest'
+    if len(midi_pitches) == 1:
+        return midi_to_note_name(midi_pitches[0])
+    return [midi_to_note_name(p) for p in midi_pitches]
+
+
+def _intern(values, table, index):
+    column = []
+    for value in values:
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(table)
+            table.append(value)
+        column.append(position)
+    return column
+
+
+def encode_columns(section_data):
+    """
+    Encodes the melodies, beat_ends, dynamics and lyrics of one part or section as columns:
+
+    - 'sizes': number of pitches of each entry, 0 for a rest, left out when every entry is a single note
+    - 'pitches': the MIDI pitch numbers of every entry, one after the other
+    - 'spellings': {entry index: original entry} for the entries MIDI numbers can't give back exactly, such as
+      'D-4' (read back as 'C#4'), '' or invalid note names
+    - 'deltas': beat_ends as differences in ticks (TICKS_PER_QUARTER per quarter note) from the previous one,
+      divided by 'tick_unit' when they share a common factor
+    - 'dynamics' and 'lyrics': indices into 'dynamic_table' and 'lyric_table', which hold each distinct value once
+    """
+    melody_field = 'melodies' if 'melodies' in section_data or 'chords' not in section_data else 'chords'
+    melodies = section_data.get(melody_field) or []
+    sizes, pitches, spellings = [], [], {}
+    encoded_notes = {}  # most songs use a few dozen distinct note names, so each is only parsed once
+    for index, item in enumerate(melodies):
+        if isinstance(item, str) and item in encoded_notes:
+            midi_pitches, exact = encoded_notes[item]
+            original = item
+        else:
+            names = _melody_names(item)
+            midi_pitches = [note_name_to_midi(name) if isinstance(name, str) else None for name in names or []]
+            if None in midi_pitches:
+                midi_pitches = []
+            if isinstance(item, (str, list, tuple)):
+                original = list(item) if isinstance(item, tuple) else item
+            else:
+                original = 'rest' if not names else names[0] if len(names) == 1 else names
+            exact = _decode_melody(midi_pitches) == original
+            if isinstance(item, str):
+                encoded_notes[item] = midi_pitches, exact
+        sizes.append(len(midi_pitches))
+        pitches.extend(midi_pitches)
+        if not exact:
+            spellings[str(index)] = original
+
+    columns = {'sizes': sizes, 'pitches': pitches} if any(size != 1 for size in sizes) else {'pitches': pitches}
+    if melody_field != 'melodies':
+        columns['melody_field'] = melody_field
+    if spellings:
+        columns['spellings'] = spellings
+
+    previous = 0
+    deltas = []
+    for beat_end in section_data.get('beat_ends') or []:
+        ticks = _quarter_length_to_ticks(beat_end)
+        deltas.append(ticks - previous)
+        previous = ticks
+    # Deltas are stored in the largest unit they are all whole multiples of, e.g. 5040 ticks for eighth notes
+    tick_unit = reduce(gcd, deltas, 0)
+    if tick_unit > 1:
+        deltas = [delta // tick_unit for delta in deltas]
+        columns['tick_unit'] = tick_unit
+    columns['deltas'] = deltas
+
+    for field in ('dynamics', 'lyrics'):
+        if field in section_data:
+            table = []
+            columns[field] = _intern(section_data[field] or [], table, {})
+            columns[field[:-1] + '_table'] = table
+    return columns
+
+
+def decode_columns(columns):
+    """
+    Rebuilds melodies, beat_ends, dynamics and lyrics from encode_columns output.
+    """
+    melodies = []
+    spellings = columns.get('spellings', {})
+    position = 0
+    sizes = columns['sizes'] if 'sizes' in columns else [1] * len(columns['pitches'])
+    for index, size in enumerate(sizes):
+        spelled = spellings.get(str(index))
+        melodies.append(spelled if spelled is not None else _decode_melody(columns['pitches'][position:position + size]))
+        position += size
+
+    ticks = 0
+    beat_ends = []
+    tick_unit = columns.get('tick_unit', 1)
+    for delta in columns['deltas']:
+        ticks += delta * tick_unit
+        beat_ends.append(_ticks_to_quarter_length(ticks))
+
+    section_data = {columns.get('melody_field', 'melodies'): melodies, 'beat_ends': beat_ends}
+    for field in ('dynamics', 'lyrics'):
+        if field in columns:
+            table = columns[field[:-1] + '_table']
+            section_data[field] = [table[i] for i in columns[field]]
+    return section_data
+
+
+def encode_part(part_name, part_data):
+    """
+    Encodes one part of parts_data as a dict of columns; see encode_columns. Named sections are encoded the
+    same way, and any other fields of the part are kept as they are.
+    """
+    record = {'name': part_name}
+    if 'instrument' in part_data:
+        record['instrument'] = part_data['instrument']
+    if 'sections' in part_data:
+        record['sections'] = {name: encode_columns(section_data)
+                              for name, section_data in part_data['sections'].items()}
+    if any(field in part_data for field in ('melodies', 'chords', 'beat_ends')) or 'sections' not in part_data:
+        record['columns'] = encode_columns(part_data)
+    extra = {field: value for field, value in part_data.items() if field not in _PART_FIELDS}
+    if extra:
+        record['extra'] = extra
+    return record
+
+
+def decode_part(record):
+    part_data = {}
+    if 'instrument' in record:
+        part_data['instrument'] = record['instrument']
+    if 'columns' in record:
+        part_data.update(decode_columns(record['columns']))
+    if 'sections' in record:
+        part_data['sections'] = {name: decode_columns(columns) for name, columns in record['sections'].items()}
+    part_data.update(record.get('extra', {}))
+    return record['name'], part_data
+
+
+def _iter_parts(parts_data):
+    return parts_data.items() if isinstance(parts_data, dict) else parts_data
+
+
+def iter_encode_parts_data(parts_data, score_data=None):
+    """
+    Yields the compact encoding line by line: a header line with the format, version and score_data, then one
+    line per part. parts_data can be a dict or any iterable of (part_name, part_data), so a large song can be
+    encoded one part at a time.
+    """
+    yield _dumps({'format': PARTS_CODEC_FORMAT, 'version': PARTS_CODEC_VERSION,
+                  'score': encode_score_data(score_data or {})}) + '\n'
+    for part_name, part_data in _iter_parts(parts_data):
+        yield _dumps(encode_part(part_name, part_data)) + '\n'
+
+
+def encode_parts_data(parts_data, score_data=None):
+    """
+    Encodes parts_data and score_data in the compact format: JSON lines with MIDI pitch numbers, beat_ends as
+    tick deltas and interned dynamics and lyrics. Usually a fraction of the size of json.dumps(parts_data).
+    """
+    return ''.join(iter_encode_parts_data(parts_data, score_data))
+
+
+def dump_parts_data(parts_data, score_data, fp):
+    """
+    Writes the compact encoding to a text file object or path one part at a time.
+    """
+    if isinstance(fp, str):
+        with open(fp, 'w', encoding='utf-8') as f:
+            return dump_parts_data(parts_data, score_data, f)
+    for line in iter_encode_parts_data(parts_data, score_data):
+        fp.write(line)
+    return fp
+
+
+def iter_decode_parts_data(lines):
+    """
+    Decodes the compact encoding from an iterable of lines, such as an open file.
+
+    Returns:
+    - tuple: (score_data, iterator of (part_name, part_data)). Parts are decoded as the iterator is consumed.
+    """
+    lines = iter(lines)
+    header = json.loads(next(line for line in lines if line.strip()))
+    if header.get('format') != PARTS_CODEC_FORMAT:
+        raise ValueError('Not an encoded parts_data stream')
+    if header.get('version', 0) > PARTS_CODEC_VERSION:
+        raise ValueError('parts_data was encoded by a newer version: ' + str(header.get('version')))
+    return header.get('score', {}), (decode_part(json.loads(line)) for line in lines if line.strip())
+
+
+def decode_parts_data(encoded):
+    """
+    Decodes the output of encode_parts_data or encode_parts_data_binary.
+
+    Returns:
+    - tuple: (parts_data, score_data)
+    """
+    if isinstance(encoded, (bytes, bytearray, memoryview)):
+        if bytes(encoded[:len(BINARY_MAGIC)]) == BINARY_MAGIC:
+            return decode_parts_data_binary(encoded)
+        encoded = bytes(encoded).decode('utf-8')
+    score_data, parts = iter_decode_parts_data(encoded.splitlines())
+    return dict(parts), score_data
+
+
+def load_parts_data(fp):
+    """
+    Reads the compact encoding from a text file object or path.
+
+    Returns:
+    - tuple: (parts_data, score_data)
+    """
+    if isinstance(fp, str):
+        with open(fp, 'r', encoding='utf-8') as f:
+            return load_parts_data(f)
+    score_data, parts = iter_decode_parts_data(fp)
+    return dict(parts), score_data
+
+
+def is_encoded_parts_data(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value[:len(BINARY_MAGIC)]) == BINARY_MAGIC or bytes(value[:64]).lstrip().startswith(b'{')
+    return isinstance(value, str) and value.lstrip().startswith('{') and PARTS_CODEC_FORMAT in value[:200]
+
+
+# Binary layout: magic, version (uint8), header length (uint32) and a JSON header, then the numeric columns
+# of every part as little-endian arrays, in the order the header lists them. Each column uses the smallest
+# array typecode its values fit in.
+_BINARY_COLUMNS = ('sizes', 'pitches', 'deltas', 'dynamics', 'lyrics')
+_UNSIGNED_TYPECODES = (('B', 1 << 8), ('H', 1 << 16), ('I', 1 << 32), ('Q', 1 << 64))
+_SIGNED_TYPECODES = (('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63))
+
+
+def _get_typecode(values):
+    low, high = (min(values), max(values)) if values else (0, 0)
+    if low >= 0:
+        return next(typecode for typecode, limit in _UNSIGNED_TYPECODES if high < limit)
+    return next(typecode for typecode, limit in _SIGNED_TYPECODES if -limit <= low and high < limit)
+
+
+def _binary_blocks(columns, layout):
+    for field in _BINARY_COLUMNS:
+        if field not in columns:
+            continue
+        typecode = _get_typecode(columns[field])
+        values = array(typecode, columns.pop(field))
+        if not _LITTLE_ENDIAN:
+            values.byteswap()
+        layout.append([field, typecode, len(values)])
+        yield values.tobytes()
+
+
+def encode_parts_data_binary(parts_data, score_data=None):
+    """
+    Encodes parts_data and score_data with the numeric columns stored as packed arrays instead of JSON, for
+    storage and transfer. Decode with decode_parts_data_binary, which reads the columns through memoryview
+    without copying them first.
+    """
+    records = []
+    blocks = []
+    for part_name, part_data in _iter_parts(parts_data):
+        record = encode_part(part_name, part_data)
+        for columns in ([record['columns']] if 'columns' in record else []) + list(record.get('sections', {}).values()):
+            columns['layout'] = []
+            blocks.extend(_binary_blocks(columns, columns['layout']))
+        records.append(record)
+    header = _dumps({'format': PARTS_CODEC_FORMAT, 'version': PARTS_CODEC_VERSION,
+                     'score': encode_score_data(score_data or {}), 'parts': records}).encode('utf-8')
+    return BINARY_MAGIC + struct.pack('<BI', PARTS_CODEC_VERSION, len(header)) + header + b''.join(blocks)
+
+
+def decode_parts_data_binary(data):
+    """
+    Decodes the output of encode_parts_data_binary from bytes, a memoryview or an mmap.
+
+    Returns:
+    - tuple: (parts_data, score_data)
+    """
+    view = memoryview(data)
+    if bytes(view[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+        raise ValueError('Not binary encoded parts_data')
+    version, header_length = struct.unpack_from('<BI', view, len(BINARY_MAGIC))
+    if version > PARTS_CODEC_VERSION:
+        raise ValueError('parts_data was encoded by a newer version: ' + str(version))
+    offset = len(BINARY_MAGIC) + 5
+    header = json.loads(bytes(view[offset:offset + header_length]).decode('utf-8'))
+    offset += header_length
+
+    parts_data = {}
+    for record in header['parts']:
+        for columns in ([record['columns']] if 'columns' in record else []) + list(record.get('sections', {}).values()):
+            for field, typecode, length in columns.pop('layout'):
+                size = array(typecode).itemsize * length
+                if _LITTLE_ENDIAN:
+                    values = view[offset:offset + size].cast(typecode)
+                else:
+                    values = array(typecode, bytes(view[offset:offset + size]))
+                    values.byteswap()
+                columns[field] = values
+                offset += size
+        part_name, part_data = decode_part(record)
+        parts_data[part_name] = part_data
+    return parts_data, header.get('score', {})
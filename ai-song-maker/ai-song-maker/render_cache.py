@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from fractions import Fraction
+
+from sections import get_song_structure
+
+# Bump when a change to the renderer means previously built parts must not be reused
+RENDER_CACHE_VERSION = 1
+SCORE_FIELDS = ('key', 'time_signature', 'clef', 'tempo')
+
+
+def _canonical(obj):
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, Fraction):
+        return ['Fraction', obj.numerator, obj.denominator]
+    if isinstance(obj, dict):
+        return ['dict', sorted([str(k), _canonical(v)] for k, v in obj.items())]
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if hasattr(obj, 'tolist'):  # NumPy arrays and scalars
+        return obj.tolist()
+    if hasattr(obj, 'pitches') and hasattr(obj, 'lyric'):  # music21 notes, chords and rests (not keys)
+        velocity = obj.volume.velocity if hasattr(obj, 'volume') else None
+        return [type(obj).__name__, [p.nameWithOctave for p in obj.pitches], float(obj.quarterLength),
+                obj.lyric, velocity, [type(e).__name__ for e in obj.expressions]]
+    # Keys, time signatures, tempos, clefs and instruments all have a repr that spells out their value
+    return [type(obj).__name__, repr(obj)]
+
+
+def stable_hash(obj):
+    """
+    Returns a hash of obj that is the same across processes and runs, unlike hash(). Works on parts_data and
+    score_data, including the music21 objects they may hold.
+    """
+    encoded = json.dumps(_canonical(obj), separators=(',', ':'), default=repr)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _is_deterministic(part_data):
+    # Parts without melodies or beat_ends get random ones filled in, so they must be rebuilt every time
+    if 'sections' in part_data:
+        return True
+    return bool(part_data.get('melodies') or part_data.get('chords')) and bool(part_data.get('beat_ends'))
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class RenderCache:
+    """
+    Keeps the built stream.Part of each part and the outputs of recent songs between calls of
+    process_and_output_score, keyed by a stable hash of the data they were built from.
+    """
+
+    def __init__(self, max_parts=64, max_outputs=8):
+        self.max_parts = max_parts
+        self.max_outputs = max_outputs
+        self.part_hits = 0
+        self.part_misses = 0
+        self.output_hits = 0
+        self.output_misses = 0
+        self._parts = OrderedDict()
+        self._outputs = OrderedDict()
+
+    def part_key(self, part_id, part_data, score_data, section_lengths, *build_options):
+        """
+        Returns the hash of everything the built part depends on, or None if the part can't be cached.
+        """
+        if not _is_deterministic(part_data):
+            return None
+        relevant = {field: score_data.get(field) for field in SCORE_FIELDS}
+        if 'sections' in part_data:
+            structure = get_song_structure(part_data, score_data)
+            relevant['song_structure'] = structure
+            relevant['section_lengths'] = [section_lengths.get(name, 0) for name in structure]
+        return stable_hash([RENDER_CACHE_VERSION, part_id, part_data, relevant, list(build_options)])
+
+    def song_key(self, part_keys, *build_options):
+        if any(part_key is None for part_key in part_keys.values()):
+            return None
+        return stable_hash([RENDER_CACHE_VERSION, list(part_keys.items()), list(build_options)])
+
+    def get_part(self, part_key):
+        cached = self._parts.get(part_key)
+        if cached is None:
+            self.part_misses += 1
+            return None
+        self.part_hits += 1
+        self._parts.move_to_end(part_key)
+        return cached
+
+    def put_part(self, part_key, value):
+        self._parts[part_key] = value
+        self._parts.move_to_end(part_key)
+        while len(self._parts) > self.max_parts:
+            self._parts.popitem(last=False)
+
+    def get_outputs(self, song_key, musicxml_path, midi_path):
+        """
+        Returns the score of an earlier render of the same song if its output files are still there and
+        unchanged. Files requested at new paths are copied from the earlier ones. Returns None otherwise.
+        """
+        entry = self._outputs.get(song_key) if song_key is not None else None
+        if entry is None or (musicxml_path and not entry['musicxml_path']):
+            self.output_misses += 1
+            return None
+        previous = [(entry['midi_path'], midi_path, entry['midi_signature'])]
+        if musicxml_path:
+            previous.append((entry['musicxml_path'], musicxml_path, entry['musicxml_signature']))
+        if any(_file_signature(old_path) != signature for old_path, _, signature in previous):
+            del self._outputs[song_key]
+            self.output_misses += 1
+            return None
+
+        for old_path, new_path, _ in previous:
+            if os.path.abspath(old_path) != os.path.abspath(new_path):
+                shutil.copyfile(old_path, new_path)
+        self.output_hits += 1
+        self._outputs.move_to_end(song_key)
+        return entry['score']
+
+    def put_outputs(self, song_key, musicxml_path, midi_path, score):
+        if song_key is None:
+            return
+        self._outputs[song_key] = {
+            'musicxml_path': musicxml_path,
+            'musicxml_signature': _file_signature(musicxml_path) if musicxml_path else None,
+            'midi_path': midi_path,
+            'midi_signature': _file_signature(midi_path),
+            'score': score,
+        }
+        while len(self._outputs) > self.max_outputs:
+            self._outputs.popitem(last=False)
+
+    def clear(self):
+        self._parts.clear()
+        self._outputs.clear()
+
+    def stats(self):
+        return {'part_hits': self.part_hits, 'part_misses': self.part_misses, 'output_hits': self.output_hits,
+                'output_misses': self.output_misses, 'parts': len(self._parts), 'outputs': len(self._outputs)}
@@ -0,0 +1,138 @@
+import threading
+import time
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullMetrics:
+    """
+    Stands in when no metrics are wanted: every method does nothing, so instrumented code costs a method call.
+    """
+    enabled = False
+    _null_stage = _NullStage()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def count(self, name, n=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def make_warn(self, warn=print):
+        return warn
+
+
+NULL_METRICS = NullMetrics()
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'wall_start', 'cpu_start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_duration(self.name, time.perf_counter() - self.wall_start,
+                                  time.thread_time() - self.cpu_start)
+        return False
+
+
+class RenderMetrics:
+    """
+    Collects per-stage wall and CPU time, counters and values such as file sizes from process_and_output_score
+    and convert_to_parts_data.
+
+    Stages that run several times (one per part, say) add up. If callback is given it is called as each
+    measurement comes in, with ('stage', name, {'wall': seconds, 'cpu': seconds}), ('count', name, n) or
+    ('value', name, value), e.g. to forward them to a metrics system.
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}  # name -> {'wall': seconds, 'cpu': seconds, 'calls': n}
+        self.counts = {}
+        self.values = {}
+        self._lock = threading.Lock()  # async_render records from several executor threads
+
+    def stage(self, name):
+        """
+        Returns a context manager that times the code inside it as stage name.
+        """
+        return _Stage(self, name)
+
+    def add_duration(self, name, wall, cpu):
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+            totals['wall'] += wall
+            totals['cpu'] += cpu
+            totals['calls'] += 1
+        if self.callback is not None:
+            self.callback('stage', name, {'wall': wall, 'cpu': cpu})
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+        if self.callback is not None:
+            self.callback('count', name, n)
+
+    def set(self, name, value):
+        with self._lock:
+            self.values[name] = value
+        if self.callback is not None:
+            self.callback('value', name, value)
+
+    def make_warn(self, warn=print):
+        """
+        Wraps a warn function so each warning is also counted under 'warnings'.
+        """
+        def counting_warn(message):
+            self.count('warnings')
+            warn(message)
+        return counting_warn
+
+    def as_dict(self):
+        return {'stages': {name: dict(totals) for name, totals in self.stages.items()}, 'counts': dict(self.counts),
+                'values': dict(self.values)}
+
+    def __repr__(self):
+        return 'RenderMetrics(' + repr(self.as_dict()) + ')'
+
+
+def get_metrics(metrics):
+    """
+    Returns what instrumented code should record to: NULL_METRICS for None, a RenderMetrics calling metrics for
+    a plain function, and metrics itself otherwise.
+    """
+    if metrics is None:
+        return NULL_METRICS
+    if isinstance(metrics, (RenderMetrics, NullMetrics)) or not callable(metrics):
+        return metrics
+    return RenderMetrics(callback=metrics)
+
+
+def count_elements(metrics, bar_plans):
+    """
+    Adds the notes, chords, rests and bar line splits of a part's (BarPlan, melodies, is_repeat) tuples.
+    """
+    if not metrics.enabled:
+        return
+    for plan, _, _ in bar_plans:
+        for name, n in plan.element_counts().items():
+            metrics.count(name, n)
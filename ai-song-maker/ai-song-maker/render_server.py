@@ -0,0 +1,421 @@
+"""
+A long running local render service. Workers import music21 once at start up and then take render and import
+jobs over HTTP, on localhost or a Unix socket, so a script pays for a round trip instead of music21's start up:
+
+    python render_server.py --port 8765 --workers 4 --max-queue 16
+
+    client = RenderClient(port=8765)
+    result = client.render(parts_data, score_data, musicxml_path, midi_path)
+
+Endpoints, all JSON:
+
+- POST /render: {'parts_data', 'score_data', optional 'musicxml_path', 'midi_path' and 'options' for
+  process_and_output_score}. Returns {'job_id', 'musicxml_path', 'midi_path', 'error', 'latency'}.
+- POST /import: {'path', optional 'reader', 'key_detection', 'output_format'}. Returns {'parts_data',
+  'score_data', 'string_to_print', ...}, score_data with plain values as in parts_codec.encode_score_data.
+- GET /stats: queue depth, jobs running, completed, failed and rejected, and latency percentiles per job type.
+- GET /health
+
+Only this module's standard library imports are loaded by clients; music21 is only imported in the workers.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_render import _warm_worker, get_job_output_paths
+from reverse_score import custom_serializer
+
+DEFAULT_PORT = 8765
+JOB_TYPES = ('render', 'import')
+LATENCY_PERCENTILES = (50, 90, 99)
+
+_parse_cache = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _error_text(e):
+    return ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+
+def _dumps(body):
+    # Imported scores hold Fraction beat_ends for triplets, which plain json.dumps can't write
+    return json.dumps(body, default=custom_serializer)
+
+
+def _render_job(job_id, parts_data, score_data, musicxml_path, midi_path, options):
+    from score_helper import process_and_output_score
+    from validation import ValidationError
+    started = time.time()
+    try:
+        process_and_output_score(parts_data, score_data, musicxml_path, midi_path, **options)
+        return {'job_id': job_id, 'musicxml_path': musicxml_path, 'midi_path': midi_path, 'error': None,
+                'started': started}
+    except ValidationError as e:
+        return {'job_id': job_id, 'musicxml_path': None, 'midi_path': None, 'error': str(e), 'invalid': True,
+                'diagnostics': [diagnostic._asdict() for diagnostic in e.diagnostics], 'started': started}
+    except Exception as e:
+        return {'job_id': job_id, 'musicxml_path': None, 'midi_path': None, 'error': _error_text(e),
+                'started': started}
+
+
+def _import_job(job_id, path, reader, key_detection, output_format, cache_directory):
+    global _parse_cache
+    from parse_cache import ParseCache, convert_file_to_parts_data
+    from parts_codec import encode_score_data
+    started = time.time()
+    try:
+        if cache_directory and (_parse_cache is None or _parse_cache.directory != cache_directory):
+            _parse_cache = ParseCache(cache_directory)
+        parts_data, score_data, string_to_print = convert_file_to_parts_data(
+            path, _parse_cache if cache_directory else None, reader, key_detection, output_format)
+        # Made JSON ready here, so a reply that can't be sent counts as a failed job
+        parts_data, score_data = json.loads(_dumps([parts_data, encode_score_data(score_data)]))
+        return {'job_id': job_id, 'parts_data': parts_data, 'score_data': score_data,
+                'string_to_print': string_to_print, 'error': None, 'started': started}
+    except Exception as e:
+        return {'job_id': job_id, 'parts_data': None, 'score_data': None, 'string_to_print': None,
+                'error': _error_text(e), 'started': started}
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest rank percentile of an already sorted list, or None if it is empty.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-percent * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class JobStats:
+    """
+    Counters and the latencies of the last window jobs of one type. Latency is from the job being accepted to
+    its result being ready, queue_wait the part of it spent waiting for a free worker.
+    """
+
+    def __init__(self, window=1000):
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+
+    def record(self, latency, queue_wait, failed):
+        self.completed += 1
+        self.failed += failed
+        self.latencies.append(latency)
+        self.queue_waits.append(queue_wait)
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        queue_waits = sorted(self.queue_waits)
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'latency': {'p' + str(p): percentile(latencies, p) for p in LATENCY_PERCENTILES},
+            'queue_wait': {'p' + str(p): percentile(queue_waits, p) for p in LATENCY_PERCENTILES},
+        }
+
+
+class RenderService:
+    """
+    Runs render and import jobs on a pool of warm worker processes. At most workers jobs run at once and at
+    most max_queue more wait for a worker; a job submitted beyond that raises QueueFull straight away instead of
+    piling up, so callers can back off and retry.
+    """
+
+    def __init__(self, workers=None, max_queue=16, output_directory='/mnt/data/music_files',
+                 parse_cache_directory=None, executor=None, latency_window=1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.output_directory = output_directory
+        self.parse_cache_directory = parse_cache_directory
+        self.started = time.time()
+        self._own_executor = executor is None
+        self.executor = executor or ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats_by_type = {job_type: JobStats(latency_window) for job_type in JOB_TYPES}
+
+    def warm_up(self):
+        """
+        Starts every worker now, so the first jobs don't wait for music21 to import.
+        """
+        for future in [self.executor.submit(_warm_worker) for _ in range(self.workers)]:
+            future.result()
+
+    @property
+    def queue_depth(self):
+        return max(0, self._in_flight - self.workers)
+
+    def _admit(self, job_type):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self.stats_by_type[job_type].rejected += 1
+                raise QueueFull("Render queue is full (" + str(self.max_queue) + " jobs waiting)")
+            self._in_flight += 1
+
+    def _run(self, job_type, func, *args):
+        self._admit(job_type)
+        accepted = time.time()
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        try:
+            result = future.result()
+        except Exception as e:
+            # The worker process itself died, e.g. it was killed or the job could not be pickled
+            result = {'job_id': args[0], 'error': repr(e), 'started': accepted}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        finished = time.time()
+        started = result.pop('started', accepted)
+        result['latency'] = finished - accepted
+        with self._lock:
+            self.stats_by_type[job_type].record(finished - accepted, max(0.0, started - accepted),
+                                                result['error'] is not None)
+        return result
+
+    def render(self, parts_data, score_data, musicxml_path=None, midi_path=None, options=None, job_id=None):
+        """
+        Renders one song and returns {'job_id', 'musicxml_path', 'midi_path', 'error', 'latency'}. Jobs
+        without paths get unique ones in output_directory. Raises QueueFull if the queue is full.
+        """
+        job_id = job_id or uuid.uuid4().hex[:12]
+        default_xml, default_midi = get_job_output_paths(self.output_directory, job_id)
+        options = dict({'archive_old_files': False}, **(options or {}))
+        return self._run('render', _render_job, job_id, parts_data, score_data, musicxml_path or default_xml,
+                         midi_path or default_midi, options)
+
+    def import_file(self, path, reader='direct', key_detection='fast', output_format='json', job_id=None):
+        """
+        Converts a MIDI or MusicXML file with parse_cache.convert_file_to_parts_data. Raises QueueFull if the
+        queue is full.
+        """
+        job_id = job_id or uuid.uuid4().hex[:12]
+        return self._run('import', _import_job, job_id, path, reader, key_detection, output_format,
+                         self.parse_cache_directory)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queue_depth': self.queue_depth,
+                'running': min(self._in_flight, self.workers),
+                'uptime': time.time() - self.started,
+                'jobs': {job_type: stats.as_dict() for job_type, stats in self.stats_by_type.items()},
+            }
+
+    def shutdown(self):
+        if self._own_executor:
+            self.executor.shutdown()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'ai-song-maker-render/1'
+
+    def _send_json(self, status, body, headers=None):
+        try:
+            data = _dumps(body).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            status, data = 500, json.dumps({'error': 'Reply is not JSON: ' + _error_text(e)}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.service.stats())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'Unknown path ' + self.path})
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            job = self._read_json()
+        except ValueError as e:
+            self._send_json(400, {'error': 'Request body is not JSON: ' + str(e)})
+            return
+        try:
+            if self.path == '/render':
+                result = service.render(job['parts_data'], job.get('score_data') or {}, job.get('musicxml_path'),
+                                        job.get('midi_path'), job.get('options'), job.get('job_id'))
+            elif self.path == '/import':
+                result = service.import_file(job['path'], job.get('reader', 'direct'),
+                                             job.get('key_detection', 'fast'), job.get('output_format', 'json'),
+                                             job.get('job_id'))
+            else:
+                self._send_json(404, {'error': 'Unknown path ' + self.path})
+                return
+        except QueueFull as e:
+            self._send_json(503, {'error': str(e), 'queue_depth': service.queue_depth}, {'Retry-After': '1'})
+            return
+        except KeyError as e:
+            self._send_json(400, {'error': 'Missing field ' + str(e)})
+            return
+        if result['error'] is None:
+            status = 200
+        else:
+            status = 422 if result.pop('invalid', False) else 500
+        self._send_json(status, result)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _ServiceServerMixin:
+    daemon_threads = True
+    verbose = False
+    service = None
+
+
+class RenderHTTPServer(_ServiceServerMixin, ThreadingHTTPServer):
+    pass
+
+
+class UnixRenderHTTPServer(_ServiceServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None, verbose=False):
+    """
+    Returns an HTTP server for service, listening on host:port, or on the Unix socket path if one is given.
+    Call serve_forever() on it, and shutdown() and service.shutdown() to stop.
+    """
+    if unix_socket:
+        server = UnixRenderHTTPServer(unix_socket, RenderRequestHandler)
+    else:
+        server = RenderHTTPServer((host, port), RenderRequestHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_socket = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+class RenderClient:
+    """
+    Talks to a running render server. Methods return the server's JSON reply as a dict, also for failed jobs;
+    a full queue raises QueueFull.
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        if self.unix_socket:
+            connection = _UnixHTTPConnection(self.unix_socket, self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            data = json.dumps(body).encode('utf-8') if body is not None else None
+            connection.request(method, path, data, {'Content-Type': 'application/json'} if data else {})
+            response = connection.getresponse()
+            reply = json.loads(response.read() or b'{}')
+        finally:
+            connection.close()
+        if response.status == 503:
+            raise QueueFull(reply.get('error'))
+        return reply
+
+    def render(self, parts_data, score_data, musicxml_path=None, midi_path=None, job_id=None, **options):
+        """
+        Renders a song on the server. parts_data can also be the text from parts_codec.encode_parts_data, and
+        score_data must hold plain values (see parts_codec.encode_score_data). options are passed on to
+        process_and_output_score.
+        """
+        return self._request('POST', '/render', {'parts_data': parts_data, 'score_data': score_data,
+                                                 'musicxml_path': musicxml_path, 'midi_path': midi_path,
+                                                 'job_id': job_id, 'options': options})
+
+    def import_file(self, path, reader='direct', key_detection='fast', output_format='json', job_id=None):
+        return self._request('POST', '/import', {'path': path, 'reader': reader, 'key_detection': key_detection,
+                                                 'output_format': output_format, 'job_id': job_id})
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def health(self):
+        return self._request('GET', '/health')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the ai-song-maker render service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix-socket', default=None, help='listen on this Unix socket path instead')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-queue', type=int, default=16, help='jobs allowed to wait for a worker')
+    parser.add_argument('--output-directory', default='/mnt/data/music_files')
+    parser.add_argument('--parse-cache-directory', default=None)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    service = RenderService(args.workers, args.max_queue, args.output_directory, args.parse_cache_directory)
+    service.warm_up()
+    server = make_server(service, args.host, args.port, args.unix_socket, args.verbose)
+    print("Render service listening on " + (args.unix_socket or args.host + ':' + str(args.port))
+          + " with " + str(service.workers) + " workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,58 @@
 from fractions import Fraction
 
-from music21 import note, chord, meter, tempo, clef, percussion
 import json
 from typing import Tuple, Dict, Any
 
-def convert_to_parts_data(score) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+from key_detection import detect_key
+from lazy_modules import lazy_music21
+from parts_codec import encode_parts_data
+from render_metrics import get_metrics
+
+note, chord, meter, tempo, clef, percussion = lazy_music21('note', 'chord', 'meter', 'tempo', 'clef', 'percussion')
+
+def convert_to_parts_data(score, key_detection='fast', output_format='json',
+                          metrics=None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
     Converts a music21 stream.Score object into parts_data and score_data structures,
     assuming all parts have just one section and ignoring measures.
+
+    key_detection is passed to key_detection.detect_key: 'fast' (vectorized, same result as score.analyze('key')),
+    'music21' (score.analyze('key')) or 'signature' (use the key signature in the file when there is one).
+
+    output_format selects how string_to_print encodes the data: 'json' or 'compact' (parts_codec's encoding,
+    a fraction of the size for long scores).
+
+    metrics is an optional render_metrics.RenderMetrics, or a function it should call with each measurement:
+    the wall and CPU time of key_detection, extract_parts and format_output, and counts of parts, notes, chords
+    and rests.
     """
-    parts_data = {}
+    metrics = get_metrics(metrics)
     song_structure = ["section_1"]  # Assuming all parts have just one section
-    key_signature = score.analyze('key')
+    with metrics.stage('key_detection'):
+        key_signature = detect_key(score, key_detection)
     time_signature = score.recurse().getElementsByClass(meter.TimeSignature)[0]
     bpm = score.metronomeMarkBoundaries()[0][2].number if score.metronomeMarkBoundaries() else 120
 
+    with metrics.stage('extract_parts'):
+        parts_data = extract_parts(score, metrics)
+
+    score_data = {
+        'song_structure': song_structure,
+        'key': key_signature,
+        'time_signature': time_signature,
+        'tempo': tempo.MetronomeMark(number=bpm),
+        'clef': clef.TrebleClef(),  # Simplification for this example
+    }
+    with metrics.stage('format_output'):
+        string_to_print = format_parts_data_output(parts_data, score_data, output_format)
+    return parts_data, score_data, string_to_print
+
+
+def extract_parts(score, metrics):
+    """
+    Returns the parts_data of every part in the score, read as one flat section.
+    """
+    parts_data = {}
     for part in score.parts:
         part_name = part.partName or "Part"
         if part_name in parts_data:
@@ -35,6 +73,8 @@ def convert_to_parts_data(score) -> Tuple[Dict[str, Any], Dict[str, Any]]:
                 lyrics.append(element.lyric if element.lyric else '')
                 if not isinstance(element, note.Rest) and element.volume:
                     dynamics.append(velocity_to_dynamic(element.volume.velocity))
+                else:
+                    dynamics.append('')
 
                 if isinstance(element, note.Note):
                     melodies.append(element.nameWithOctave)
@@ -65,15 +105,24 @@ def convert_to_parts_data(score) -> Tuple[Dict[str, Any], Dict[str, Any]]:
             'dynamics': dynamics
         }
         if any(lyrics):
-            parts_data['lyrics'] = lyrics
+            parts_data[part_name]['lyrics'] = lyrics
+
+        if metrics.enabled:
+            metrics.count('parts')
+            metrics.count('rests', sum(1 for m in melodies if m == 'rest'))
+            metrics.count('chords', sum(1 for m in melodies if isinstance(m, list)))
+            metrics.count('notes', sum(1 for m in melodies if isinstance(m, str) and m not in ('rest', '')))
+    return parts_data
+
+
+def format_parts_data_output(parts_data, score_data, output_format='json'):
+    if output_format == 'compact':
+        string_to_print = "Please read this compact encoding of parts_data and score_data accurately. The first line is score_data, then one line per part: pitches are MIDI note numbers, sizes the number of pitches of each melody entry (0 is a rest), deltas the beat_ends differences in ticks of tick_unit/10080 quarter notes, dynamics and lyrics index into dynamic_table and lyric_table\n"
+        string_to_print += encode_parts_data(parts_data, score_data)
+        return string_to_print
+    if output_format != 'json':
+        raise ValueError("output_format must be 'json' or 'compact'")
 
-    score_data = {
-        'song_structure': song_structure,
-        'key': key_signature,
-        'time_signature': time_signature,
-        'tempo': tempo.MetronomeMark(number=bpm),
-        'clef': clef.TrebleClef(),  # Simplification for this example
-    }
     string_to_print = "Please read these json outputs accurately, it will be useful for this answer and future answers\n"
     string_to_print += 'parts_data json output from score is: \n'
     string_to_print += json.dumps(parts_data, default=custom_serializer)
@@ -81,8 +130,7 @@ def convert_to_parts_data(score) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     string_to_print += '\nscore_data json output from score is: \n'
     string_to_print += "\nuse music21 python classes to change music21 objects in score_data e.g. key.Key('C', 'Major'), meter.TimeSignature('4/4'), tempo.MetronomeMark(number=120), clef.TrebleClef()\n"
     string_to_print += json.dumps(score_data, default=str)
-
-    return parts_data, score_data, string_to_print
+    return string_to_print
 
 
 def custom_serializer(obj):
@@ -1,70 +1,360 @@
-from music21 import stream, note, chord, meter, key, tempo, clef, instrument, pitch, duration, tie, dynamics
-from music21.note import GeneralNote
+import io
 import random
 
 import os
-import shutil
-import time
+
+from archiver import MusicFileArchiver
+from bar_layout import plan_bars, build_part_measures
+from event_table import build_event_table, get_chord_string
+from factory_cache import (create_note, create_chord, create_key, create_time_signature, create_clef, create_tempo,
+                           create_instrument)
+from instrument_names import get_instrument_class_name
+from lazy_modules import lazy_music21
+from midi_writer import write_midi
+from musicxml_writer import write_streaming_musicxml, write_streaming_musicxml_binary, write_compressed_musicxml
+from parts_codec import decode_parts_data, is_encoded_parts_data
+from render_metrics import NULL_METRICS, get_metrics, count_elements
+from sections import build_section_events, get_section_lengths, plan_sections
+from validation import ERROR, ValidationError, validate_song, format_diagnostics
+
+# music21 is only imported once the first score is built, so the pure helpers here import quickly
+stream, note, chord, meter, key, tempo, clef, instrument, duration, tie, dynamics = lazy_music21(
+    'stream', 'note', 'chord', 'meter', 'key', 'tempo', 'clef', 'instrument', 'duration', 'tie', 'dynamics')
+m21ToXml, midi_translate = lazy_music21('musicxml.m21ToXml', 'midi.translate')
+
+
+class RenderCancelled(Exception):
+    pass
 
 
 def move_music_files_to_archive(directory, archive_directory='/mnt/data/music_files/midi_musicXML_archive'):
-    # Ensure the archive directory exists, if not, create it
-    if not os.path.exists(archive_directory):
-        os.makedirs(archive_directory, exist_ok=True)
-
-    # List all files in the given directory
-    for filename in os.listdir(directory):
-        if filename.endswith('.mid') or filename.endswith('.xml'):
-            source_file_path = os.path.join(directory, filename)
-            destination_file_path = os.path.join(archive_directory, filename)
-            try:
-                # Check the modification time of the file
-                file_modified_time = os.path.getmtime(source_file_path)
-                current_time = time.time()
-                # If the file is older than 20 seconds, move it to the archive directory
-                if current_time - file_modified_time > 120:
-                    shutil.move(source_file_path, destination_file_path)
-            except Exception as e:
-                print(f"Error archiving {source_file_path} to {destination_file_path}: {e}")
+    # Move .mid, .xml and .mxl files older than 120 seconds to the archive directory in one scandir pass.
+    # Long running services should start a MusicFileArchiver and pass it to process_and_output_score instead.
+    archiver = MusicFileArchiver(directory, archive_directory, max_age=120)
+    archiver.scan()
+    archiver.archive_due()
 
 
 def process_and_output_score(parts_data, score_data, musicxml_path='/mnt/data/music_files/song_musicxml.xml',
-                             midi_path='/mnt/data/music_files/song_midi.mid'):
+                             midi_path='/mnt/data/music_files/song_midi.mid', midi_encoder='music21',
+                             archive_old_files=True, render_cache=None, musicxml_writer='music21',
+                             archiver=None, metrics=None, validate=None, musicxml_format=None):
+    """
+    Builds a music21 score from parts_data and score_data and writes it to MusicXML and MIDI.
+
+    midi_encoder selects how the MIDI file is written: 'music21' uses music21's translator on the finished score,
+    'native' encodes each part's EventTable directly with midi_writer.
+    Passing musicxml_path=None skips the MusicXML file. Together with 'native' this makes a fast MIDI-only render
+    that never builds measures or notes; the returned score then only holds each part's instrument and signatures.
+    Likewise midi_path=None skips the MIDI file.
+    archive_old_files=False skips moving older output files to the archive, e.g. for batch_render. Passing a
+    started archiver.MusicFileArchiver as archiver also skips it: the new files are registered with the archiver,
+    which archives them in the background, and the output directory is never scanned during the render.
+
+    A part can be given as named 'sections' instead of flat lists, e.g.
+    {'sections': {'verse': {'melodies': [...], 'beat_ends': [...]}, 'chorus': {...}}}, played in the order of
+    score_data['song_structure'] (or the part's own 'song_structure'). Each unique section is laid out once and
+    reused wherever it repeats.
+
+    musicxml_writer selects how the MusicXML file is written: 'music21' builds the full score and uses music21's
+    exporter, 'stream' writes measure by measure straight from the bar plans with musicxml_writer, so peak memory
+    stays flat however long the song is. With 'stream' and midi_encoder='native' no measures are built at all.
+
+    parts_data can also be the output of parts_codec.encode_parts_data or encode_parts_data_binary. Its
+    score_data is then used for any field score_data doesn't give.
+
+    render_cache is an optional render_cache.RenderCache kept by the caller between calls. Parts whose data
+    hasn't changed reuse their built stream.Part, and if nothing in the song changed the previous output files
+    are reused without writing anything.
+
+    metrics is an optional render_metrics.RenderMetrics, or a function it should call with each measurement.
+    It gets the wall and CPU time of each stage (decode, events, render_cache, archive, build_parts,
+    write_musicxml, write_midi), counts of notes, chords, rests, bar line splits, warnings and cache hits, and
+    the sizes of the written files.
+
+    validate checks the song with validation.validate_song before anything is built: 'report' prints all its
+    diagnostics in one list instead of the warnings printed while building, 'strict' stops at the first error
+    and raises validation.ValidationError, so a bad song is turned down before any music21 object is created.
+
+    musicxml_path and midi_path can also be binary file objects, such as io.BytesIO, to render into memory
+    (see render_to_bytes). A musicxml_path ending in .mxl is written as compressed MusicXML, usually a tenth
+    of the size; musicxml_format='mxl' or 'musicxml' chooses the format whatever the name, and for file objects.
+    """
+    check_render_options(midi_encoder, musicxml_writer, validate, musicxml_format)
+    metrics = get_metrics(metrics)
+    warn = metrics.make_warn(print)
+    if is_encoded_parts_data(parts_data):
+        with metrics.stage('decode'):
+            parts_data, encoded_score_data = decode_parts_data(parts_data)
+        score_data = dict(encoded_score_data, **(score_data or {}))
+    if validate:
+        warn = validate_render_input(parts_data, score_data, validate, metrics)
+
+    build_score = ((bool(musicxml_path) and musicxml_writer == 'music21')
+                   or (bool(midi_path) and midi_encoder != 'native'))
+    with metrics.stage('events'):
+        section_events = build_section_events(parts_data, warn=warn)
+        section_lengths = get_section_lengths(section_events)
+
+    part_keys = None
+    song_key = None
+    if render_cache is not None:
+        with metrics.stage('render_cache'):
+            part_keys = {part_id: render_cache.part_key(part_id, part_data, score_data, section_lengths,
+                                                        build_score, midi_encoder, musicxml_writer)
+                         for part_id, part_data in parts_data.items()}
+            # Earlier outputs can only be reused by copying files
+            if _is_file_path(musicxml_path, True) and _is_file_path(midi_path):
+                song_key = render_cache.song_key(part_keys, midi_encoder, musicxml_writer,
+                                                 get_musicxml_format(musicxml_path, musicxml_format))
+            score = render_cache.get_outputs(song_key, musicxml_path, midi_path)
+        if score is not None:
+            metrics.count('output_cache_hits')
+            print("Song unchanged since the last render, reusing the previous files.")
+            print_output_paths(musicxml_path, midi_path)
+            return score
+        metrics.count('output_cache_misses')
+
+    if archive_old_files and archiver is None and (_is_file_path(musicxml_path) or _is_file_path(midi_path)):
+        with metrics.stage('archive'):
+            archive_output_directory(musicxml_path, midi_path)
+
+    score, midi_tracks, streamed_parts = build_score_parts(parts_data, score_data, section_events, section_lengths,
+                                                           build_score, midi_encoder == 'native', render_cache,
+                                                           part_keys, metrics, warn)
+
+    # Write the score to MusicXML and MIDI files
+    write_musicxml_output(score, streamed_parts, musicxml_path, musicxml_writer, metrics, musicxml_format)
+    write_midi_output(score, midi_tracks, midi_path, midi_encoder, metrics)
+    if render_cache is not None:
+        render_cache.put_outputs(song_key, musicxml_path, midi_path, score)
+    if archiver is not None:
+        archiver.register(*[path for path in (musicxml_path, midi_path) if _is_file_path(path)])
+
+    print("Please try fix any warning or error messages printed above next time. If Any.")
+    print_output_paths(musicxml_path, midi_path)
+    return score
+
+
+def render_to_bytes(parts_data, score_data, formats=('midi', 'mxl'), **render_options):
+    """
+    Renders into memory instead of files and returns {format: bytes} for each of formats: 'midi', and
+    'musicxml' or 'mxl' (compressed MusicXML). Formats not asked for are not written at all. render_options
+    are passed on to process_and_output_score, e.g. midi_encoder='native'.
+    """
+    formats = set(formats)
+    unknown = formats - {'midi', 'musicxml', 'mxl'}
+    if unknown or {'musicxml', 'mxl'} <= formats:
+        raise ValueError("formats must hold 'midi' and at most one of 'musicxml' and 'mxl'")
+    musicxml_format = next(iter(formats & {'musicxml', 'mxl'}), None)
+    targets = {output_format: io.BytesIO() for output_format in formats}
+    render_options.setdefault('archive_old_files', False)
+    process_and_output_score(parts_data, score_data, targets.get(musicxml_format), targets.get('midi'),
+                             musicxml_format=musicxml_format, **render_options)
+    return {output_format: target.getvalue() for output_format, target in targets.items()}
+
+
+def _is_file_path(target, allow_none=False):
+    return isinstance(target, str) or (allow_none and target is None)
+
+
+def get_musicxml_format(musicxml_path, musicxml_format=None):
+    """
+    Returns 'mxl' or 'musicxml': musicxml_format if given, else 'mxl' for paths ending in .mxl.
+    """
+    if musicxml_format:
+        return musicxml_format
+    if isinstance(musicxml_path, str) and musicxml_path.lower().endswith('.mxl'):
+        return 'mxl'
+    return 'musicxml'
+
+
+def check_render_options(midi_encoder, musicxml_writer, validate=None, musicxml_format=None):
+    if midi_encoder not in ('music21', 'native'):
+        raise ValueError("midi_encoder must be 'music21' or 'native'")
+    if musicxml_writer not in ('music21', 'stream'):
+        raise ValueError("musicxml_writer must be 'music21' or 'stream'")
+    if validate not in (None, 'report', 'strict'):
+        raise ValueError("validate must be None, 'report' or 'strict'")
+    if musicxml_format not in (None, 'musicxml', 'mxl'):
+        raise ValueError("musicxml_format must be None, 'musicxml' or 'mxl'")
+
+
+def _ignore_warning(message):
+    pass
+
+
+def validate_render_input(parts_data, score_data, validate, metrics=NULL_METRICS):
+    """
+    Runs validate_song for process_and_output_score's validate option. Raises ValidationError on an error in
+    'strict' mode, prints the diagnostics otherwise, and returns the warn function building should use: the
+    problems have been reported here already, so it only counts.
+    """
+    with metrics.stage('validate'):
+        diagnostics = validate_song(parts_data, score_data, fail_fast=validate == 'strict')
+    errors = sum(diagnostic.severity == ERROR for diagnostic in diagnostics)
+    metrics.count('validation_errors', errors)
+    metrics.count('validation_warnings', len(diagnostics) - errors)
+    if errors and validate == 'strict':
+        raise ValidationError(diagnostics)
+    if diagnostics:
+        print(format_diagnostics(diagnostics))
+    return metrics.make_warn(_ignore_warning)
+
+
+def archive_output_directory(musicxml_path, midi_path):
     try:
-        directory = os.path.dirname(musicxml_path)
+        directory = os.path.dirname(musicxml_path or midi_path)
         move_music_files_to_archive(directory)
     except Exception as e:
         print("failed to archive old files")
 
+
+def build_score_parts(parts_data, score_data, section_events, section_lengths, build_score=True, collect_midi=False,
+                      render_cache=None, part_keys=None, metrics=NULL_METRICS, warn=print, should_stop=None):
+    """
+    Builds every part of the song, reusing parts from render_cache where part_keys has a key for them.
+    should_stop, if given, is called before each part; when it returns True the build stops with
+    RenderCancelled.
+
+    Returns:
+    - tuple: (music21.stream.Score, list of midi_writer tracks, list of (part, bar_plans) for musicxml_writer)
+    """
     score = stream.Score()
+    midi_tracks = []
+    streamed_parts = []
     for part_id, part_data in parts_data.items():
-
-        part = stream.Part()
-        part.id = part_id
-        score.append(part)
-
-        # Set or override instrument, key, time signature, clef, and tempo if provided
-        if 'instrument' in part_data:
-            if isinstance(part_data['instrument'], instrument.Instrument):
-                part.insert(0, part_data['instrument'])
-            elif isinstance(part_data['instrument'], str):
-                part_instrument = get_instrument_class_by_name(part_data['instrument'])
-                part.insert(0, part_instrument)
+        if should_stop is not None and should_stop():
+            raise RenderCancelled("Render cancelled before part " + str(part_id))
+        with metrics.stage('build_parts'):
+            cached = render_cache.get_part(part_keys[part_id]) if part_keys and part_keys[part_id] else None
+            if cached is not None:
+                metrics.count('part_cache_hits')
+                part, midi_track, bar_plans = cached
             else:
-                part.insert(0, instrument.Piano())
+                part, midi_track, bar_plans = build_part(part_id, part_data, score_data,
+                                                         section_events.get(part_id), section_lengths, build_score,
+                                                         collect_midi, warn)
+                if part_keys and part_keys[part_id]:
+                    metrics.count('part_cache_misses')
+                    render_cache.put_part(part_keys[part_id], (part, midi_track, bar_plans))
+            score.append(part)
+            midi_tracks.append(midi_track)
+            streamed_parts.append((part, bar_plans))
+        metrics.count('parts')
+        count_elements(metrics, bar_plans)
+    return score, midi_tracks, streamed_parts
+
+
+def _write_musicxml_bytes(score, streamed_parts, fp, musicxml_writer):
+    if musicxml_writer == 'stream':
+        write_streaming_musicxml_binary(streamed_parts, fp)
+    else:
+        fp.write(m21ToXml.GeneralObjectExporter(score).parse())
 
-        key_sig = get_key_signature(part_data.get('key', score_data.get('key')))
-        time_sig = get_time_signature(part_data.get('time_signature', score_data.get('time_signature')))
-        clef_sig = get_clef_signature(part_data.get('clef', score_data.get('clef')))
-        tempo_sig = get_tempo_signature(part_data.get('tempo', score_data.get('tempo')))
 
-        part.insert(0, key_sig)
-        part.insert(0, time_sig)
-        part.insert(0, clef_sig)
-        part.insert(0, tempo_sig)
+def _get_output_size(target):
+    try:
+        return os.path.getsize(target) if isinstance(target, str) else target.tell()
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def get_mxl_member_name(musicxml_path):
+    """
+    Returns the name of the MusicXML file inside a .mxl archive written to musicxml_path.
+    """
+    if not isinstance(musicxml_path, str):
+        return 'score.musicxml'
+    return os.path.splitext(os.path.basename(musicxml_path))[0] + '.musicxml'
 
-        # Process each section according to the song structure
 
+def write_musicxml_output(score, streamed_parts, musicxml_path, musicxml_writer='music21', metrics=NULL_METRICS,
+                          musicxml_format=None, member_name=None):
+    """
+    Writes the MusicXML output. member_name names the file inside a .mxl archive, by default after
+    musicxml_path.
+    """
+    if not musicxml_path:
+        return None
+    with metrics.stage('write_musicxml'):
+        if get_musicxml_format(musicxml_path, musicxml_format) == 'mxl':
+            name = member_name or get_mxl_member_name(musicxml_path)
+            write_compressed_musicxml(lambda member: _write_musicxml_bytes(score, streamed_parts, member,
+                                                                           musicxml_writer), musicxml_path, name)
+        elif not isinstance(musicxml_path, str):
+            _write_musicxml_bytes(score, streamed_parts, musicxml_path, musicxml_writer)
+        elif musicxml_writer == 'stream':
+            write_streaming_musicxml(streamed_parts, musicxml_path)
+        else:
+            score.write('musicxml', fp=musicxml_path)
+    if metrics.enabled:
+        metrics.set('musicxml_bytes', _get_output_size(musicxml_path))
+    return musicxml_path
+
+
+def write_midi_output(score, midi_tracks, midi_path, midi_encoder='music21', metrics=NULL_METRICS):
+    if not midi_path:
+        return None
+    with metrics.stage('write_midi'):
+        if midi_encoder == 'native':
+            write_midi(midi_tracks, midi_path, **(midi_tracks[0]['header'] if midi_tracks else {}))
+        elif not isinstance(midi_path, str):
+            midi_path.write(midi_translate.music21ObjectToMidiFile(score).writestr())
+        else:
+            score.write('midi', fp=midi_path)
+    if metrics.enabled:
+        metrics.set('midi_bytes', _get_output_size(midi_path))
+    return midi_path
+
+
+def print_output_paths(musicxml_path, midi_path):
+    if _is_file_path(midi_path):
+        print(
+            "The midi file is save to " + midi_path + ". Please provide the user the link (NOT a href) to get this file in your environment")
+    if _is_file_path(musicxml_path):
+        print(
+            "The musicXML file is save to " + musicxml_path + ". Please provide the user the link (NOT a href) to get this file in your environment")
+
+
+def build_part(part_id, part_data, score_data, events_by_section=None, section_lengths=None, build_score=True,
+               collect_midi=False, warn=print):
+    """
+    Builds one stream.Part from its part_data.
+
+    Returns:
+    - tuple: (music21.stream.Part, dict or None, list) where the dict is the part's midi_writer track, with the
+      tempo, time signature and key under 'header', when collect_midi is True, and the list holds the part's
+      (BarPlan, melodies, is_repeat) tuples in play order. The part only gets measures if build_score is True.
+    """
+    part = stream.Part()
+    part.id = part_id
+
+    # Set or override instrument, key, time signature, clef, and tempo if provided
+    if 'instrument' in part_data:
+        if isinstance(part_data['instrument'], instrument.Instrument):
+            part.insert(0, part_data['instrument'])
+        elif isinstance(part_data['instrument'], str):
+            part_instrument = get_instrument_class_by_name(part_data['instrument'], warn)
+            part.insert(0, part_instrument)
+        else:
+            part.insert(0, instrument.Piano())
+
+    key_sig = get_key_signature(part_data.get('key', score_data.get('key')))
+    time_sig = get_time_signature(part_data.get('time_signature', score_data.get('time_signature')))
+    clef_sig = get_clef_signature(part_data.get('clef', score_data.get('clef')))
+    tempo_sig = get_tempo_signature(part_data.get('tempo', score_data.get('tempo')))
+
+    part.insert(0, key_sig)
+    part.insert(0, time_sig)
+    part.insert(0, clef_sig)
+    part.insert(0, tempo_sig)
+
+    # Process each section according to the song structure
+    if events_by_section is not None:
+        bar_plans, midi_notes = plan_sections(part_data, score_data, time_sig, events_by_section,
+                                              section_lengths or {}, warn)
+    else:
         melody_notes = get_section_data(part_data, 'melodies', get_section_data(part_data, 'chords', []))
         melody_rhythms = get_section_data(part_data, 'beat_ends', [])
         section_lyrics = get_section_data(part_data, 'lyrics', [])
@@ -78,133 +368,46 @@ def process_and_output_score(parts_data, score_data, musicxml_path='/mnt/data/mu
         elif melody_rhythms is None or melody_rhythms == []:
             melody_rhythms = generate_random_rhythms(len(melody_notes))
 
-        accumulated_duration = 0
-        bar_duration = time_sig.barDuration.quarterLength
-        bar = stream.Measure()
-
-        dynamic_marking = dynamics.Dynamic('mf')
-        volume = dynamic_to_midi_velocity('mf')
-        bar.insert(0, dynamic_marking)
-        current_beat_no = 0
-        beat_used_incorrect_count = 0
-        for i, (n, beat_no) in enumerate(zip(melody_notes, melody_rhythms)):
-            if beat_no > current_beat_no:
-                r = beat_no - current_beat_no
-            elif beat_no == current_beat_no:
-                print("Error!!! You can't have two or more notes with the same beat_end value on the same part!"
-                      " Fix and try again.")
-                continue
-            elif beat_no < current_beat_no:
-                beat_used_incorrect_count += 1
-                r = beat_no
-
-            current_beat_no = beat_no
-
-            if i < len(section_dynamics):
-                dynamic_str = section_dynamics[i]
-                if dynamic_str == '':
-                    dynamic_str = 'mf'
-                dynamic_marking = dynamics.Dynamic(dynamic_str)
-                volume = dynamic_to_midi_velocity(dynamic_str)
-            # Determine if it's a note, chord, or rest
-            if isinstance(n, GeneralNote):
-                element = n
-                if i < len(section_lyrics):
-                    element.addLyric(section_lyrics[i])
-
-                element.volume.velocity = volume
-            elif isinstance(n, list) and len(n) > 0:
-                first_note = n[0]
-                invalid_chord = False
-                if n == ['rest']:
-                    element = note.Rest(quarterLength=r)
-                    invalid_chord = True
-
-                if len(n) > 4:
-                    print("Warning: Array " + str(n) + "is getting treated as a chord. If its meant to be "
-                                                       "separate notes, remove the notes from the array.")
-                for index, chord_note in enumerate(n):
-                    n[index] = str(chord_note).replace('S', '#')
-                    chord_note = n[index]
-                    if not invalid_chord and not is_valid_note(chord_note):
-                        print("Warning: Please fix chord" + str(n) + get_chord_string())
-                        invalid_chord = True
-                        if len(first_note) > 0:
-                            element = check_and_create_note(first_note[0], quarterLength=r, volume=volume)
-                        else:
-                            element = note.Rest(quarterLength=r)
-
-                if not invalid_chord:
-                    element = check_and_create_chord(n, quarterLength=r, volume=volume)
-                if i < len(section_lyrics):
-                    element.addLyric(section_lyrics[i])
-
-            elif isinstance(n, str) and n != 'rest' and n != '':
-                n = str(n).replace('S', '#')
-                if not (len(n) == 1 or (len(n) > 1 and (n[-1].isdigit() or n[-1] in ['#', '-']))):
-                    print('Warning: Please fix note or chord. Truncating ' + n[1:] + " from " + n + get_chord_string())
-                    n = n[0]
-                element = check_and_create_note(n, quarterLength=r, volume=volume)
-                if i < len(section_lyrics):
-                    element.addLyric(section_lyrics[i])
-
-            else:
-                element = note.Rest(quarterLength=r)
-                if i < len(section_lyrics):
-                    element.addLyric(section_lyrics[i])
-
-            # Check if the element fits in the current bar
-            if accumulated_duration + r > bar_duration:
-                remaining_duration = bar_duration - accumulated_duration
-                next_duration = r - remaining_duration
-
-                first_part, second_part = split_note_or_chord(element, remaining_duration, next_duration)
-                if first_part.duration.quarterLength > 0:
-                    first_part.expressions = element.expressions
-                    if i < len(section_lyrics):
-                        first_part.addLyric(section_lyrics[i])
-                    bar.append(first_part)
-                else:
-                    if i < len(section_lyrics):
-                        second_part.addLyric(section_lyrics[i])
-
-                part.append(bar)
-                bar = stream.Measure()
-                bar.insert(0, dynamic_marking)
-                if second_part.duration.quarterLength > 0:
-                    second_part.expressions = element.expressions
-                    bar.append(second_part)
-                accumulated_duration = next_duration
-            else:
-                bar.append(element)
-                accumulated_duration += r
-        pad_bar_with_rests(bar, time_sig)
-        part.append(bar)  # Append the last bar
-
-    # Write the score to MusicXML and MIDI files
-    score.write('musicxml', fp=musicxml_path)
-    score.write('midi', fp=midi_path)
-
-    print("Please try fix any warning or error messages printed above next time. If Any.")
-    print(
-        "The midi file is save to " + midi_path + ". Please provide the user the link (NOT a href) to get this file in your environment")
-    print(
-        "The musicXML file is save to " + musicxml_path + ". Please provide the user the link (NOT a href) to get this file in your environment")
-    return score
-
-
-def pad_bar_with_rests(bar, time_signature=meter.TimeSignature('4/4')):
+        events = build_event_table(melody_notes, melody_rhythms, section_dynamics, section_lyrics, warn=warn)
+        bar_plans = [(plan_bars(events, time_sig), melody_notes, False)]
+        midi_notes = events.to_midi_notes() if collect_midi else None
+    if build_score:
+        part.append(build_part_measures(bar_plans))
+
+    midi_track = None
+    if collect_midi:
+        part_instrument = part.getInstrument(returnDefault=False)
+        midi_track = {
+            'name': part_instrument.instrumentName if part_instrument else None,
+            'program': part_instrument.midiProgram if part_instrument else None,
+            'channel': part_instrument.midiChannel if part_instrument else None,
+            'notes': midi_notes,
+            'header': {
+                'bpm': tempo_sig.getQuarterBPM() or 120,
+                'time_signature': (time_sig.numerator, time_sig.denominator),
+                'key_sharps': key_sig.sharps,
+                'key_mode': getattr(key_sig, 'mode', 'major'),
+            },
+        }
+    return part, midi_track, bar_plans
+
+
+def pad_bar_with_rests(bar, time_signature=None):
     """
     Checks if the bar is full based on the provided time signature. If the bar is not full,
     pads it with a rest for the remaining duration.
 
     Args:
     - bar (music21.stream.Measure): The bar to check and pad.
-    - time_signature (music21.meter.TimeSignature): The time signature to determine the full duration of the bar.
+    - time_signature (music21.meter.TimeSignature): The time signature to determine the full duration of the bar,
+      4/4 if not given.
 
     Returns:
     - music21.stream.Measure: The possibly modified bar, padded with a rest if it was not full.
     """
+    if time_signature is None:
+        time_signature = meter.TimeSignature('4/4')
+
     # Calculate the total duration of notes and rests in the bar
     total_duration = sum(element.duration.quarterLength for element in bar.notesAndRests)
 
@@ -226,79 +429,47 @@ def is_valid_note(chord_note):
     return len(chord_note) == 1 or (len(chord_note) > 1 and (chord_note[-1].isdigit() or chord_note[-1] in ['#', '-']))
 
 
-def get_instrument_class_by_name(instrument_name):
+def get_instrument_class_by_name(instrument_name, warn=print):
     """
     Returns an instance of the music21 instrument class based on the given instrument name string.
     If the instrument is not found, returns None.
     """
-    # Normalize the instrument name to match class naming conventions in music21
-    # This might include capitalizing the first letter and removing spaces for compound names
-    # For example, "French Horn" should be converted to "FrenchHorn"
-    class_name = instrument_name.replace(' ', '')
-
-    if class_name == "Cello":
-        class_name = "Violoncello"
-
-    if class_name == "FrenchHorn":
-        class_name = "Horn"
-
-    if class_name == "StringEnsemble":
-        class_name = "StringInstrument"
-
-    if class_name == "StringSection":
-        class_name = "StringInstrument"
-
-    if class_name == "Voice":
-        print("Voice is not supported! Piano will simulate voice section, you will need to add your own voice in")
-        class_name = "Piano"
-
-    if class_name == "Vocalist":
-        print("Voice is not supported! Piano will simulate Vocalist section, you will need to add your own voice in")
-        class_name = "Piano"
-
-    if class_name == "VocalistOverride":
-        class_name = "Voice"
+    # For example, "French Horn" should be converted to "Horn"
+    class_name = get_instrument_class_name(instrument_name, warn)
 
     # Attempt to get the class from the instrument module
-    try:
-        instrument_class = getattr(instrument, class_name)
-        return instrument_class()  # Instantiate the class
-    except AttributeError:
-        print(
+    part_instrument = create_instrument(class_name)
+    if part_instrument is None:
+        warn(
             "Warning: Instrument " + instrument_name + " not found, replacing with piano. Maybe the name has another variation or instrument is not supported.")
-        return instrument.Piano()
-
-
-def get_chord_string():
-    return ". chords must be entered as an array of notes e.g. ['C4','E#4','G4']. Fix this next time for the invalid chord."
+        return create_instrument('Piano')
+    return part_instrument
 
 
 def check_and_create_note(note_str, quarterLength=1.0, volume=None):
-    try:
-        if not quarterLength:
-            quarterLength = 1.0
-        # Attempt to create a Note object with the given string
-        element = note.Note(note_str, quarterLength=quarterLength)
-        if volume:
-            element.volume.velocity = volume
-        return element
-    except (pitch.AccidentalException, pitch.PitchException):
+    if not quarterLength:
+        quarterLength = 1.0
+    # Create a Note object from the cached pitch for the given string
+    element = create_note(note_str, quarterLength=quarterLength)
+    if element is None:
         print("Error: Please fix note or chord " + note_str + get_chord_string())
         return note.Rest(quarterLength=quarterLength)
+    if volume:
+        element.volume.velocity = volume
+    return element
 
 
 def check_and_create_chord(chord_array, quarterLength=1.0, volume=None):
-    try:
-        if not quarterLength:
-            quarterLength = 1.0
-        # Attempt to create a chord object with the given string
-        element = chord.Chord(chord_array, quarterLength=quarterLength)
-        if volume:
-            element.volume.velocity = volume
-        return element
-    except (pitch.AccidentalException, pitch.PitchException):
+    if not quarterLength:
+        quarterLength = 1.0
+    # Create a chord object from the cached pitches for the given strings
+    element = create_chord(chord_array, quarterLength=quarterLength)
+    if element is None:
         print("Error: Please fix note or chord " + str(chord_array) + get_chord_string())
         return note.Rest(quarterLength=quarterLength)
+    if volume:
+        element.volume.velocity = volume
+    return element
 
 
 def split_note_or_chord(element, remaining_duration, next_duration):
@@ -373,7 +544,7 @@ def get_key_signature(key_data):
         if isinstance(key_data, key.Key):
             return key_data
         elif isinstance(key_data, str):
-            return key.Key(key_data)
+            return create_key(key_data) or key.Key('C')
         else:
             return key.Key('C')
     except:
@@ -385,7 +556,7 @@ def get_time_signature(time_data):
         if isinstance(time_data, meter.TimeSignature):
             return time_data
         elif isinstance(time_data, str):
-            return meter.TimeSignature(time_data)
+            return create_time_signature(time_data) or meter.TimeSignature('4/4')
         else:
             return meter.TimeSignature('4/4')
     except:
@@ -397,7 +568,7 @@ def get_clef_signature(clef_data):
         if isinstance(clef_data, clef.Clef):
             return clef_data
         elif isinstance(clef_data, str):
-            return clef.__dict__[clef_data]()  # Assuming clef_data is the class name as string
+            return create_clef(clef_data) or clef.TrebleClef()  # Assuming clef_data is the class name as string
         else:
             return clef.TrebleClef()
     except:
@@ -409,7 +580,7 @@ def get_tempo_signature(tempo_data):
         if isinstance(tempo_data, tempo.MetronomeMark):
             return tempo_data
         elif isinstance(tempo_data, (int, float)):  # Assuming tempo can be specified as BPM
-            return tempo.MetronomeMark(number=tempo_data)
+            return create_tempo(tempo_data) or tempo.MetronomeMark(number=120)
         else:
             return tempo.MetronomeMark(number=120)
     except:
@@ -0,0 +1,87 @@
+from bar_layout import plan_bars
+from event_table import build_event_table
+from midi_writer import TICKS_PER_QUARTER
+
+
+def get_song_structure(part_data, score_data):
+    """
+    Returns the order sections are played in: the part's own 'song_structure', else the one in score_data, else
+    every section of the part once in the order they were given.
+    """
+    structure = part_data.get('song_structure', score_data.get('song_structure'))
+    if not structure:
+        return list(part_data.get('sections', {}))
+    return list(structure)
+
+
+def get_section_melodies(section_data):
+    return section_data.get('melodies', section_data.get('chords', [])) or []
+
+
+def build_section_events(parts_data, warn=None):
+    """
+    Builds one EventTable per unique section of every part that has 'sections', however many times the section
+    is repeated in the song structure.
+
+    Returns:
+    - dict: {part_id: {section_name: EventTable}}
+    """
+    section_events = {}
+    for part_id, part_data in parts_data.items():
+        if 'sections' not in part_data:
+            continue
+        section_events[part_id] = {
+            name: build_event_table(get_section_melodies(section_data), section_data.get('beat_ends', []),
+                                    section_data.get('dynamics', []), section_data.get('lyrics', []), warn=warn)
+            for name, section_data in part_data['sections'].items()
+        }
+    return section_events
+
+
+def get_section_lengths(section_events):
+    """
+    Returns {section_name: ticks} with the longest length of each section across all parts, so every part
+    gives a section the same amount of time and the parts stay aligned.
+    """
+    section_lengths = {}
+    for events_by_name in section_events.values():
+        for name, events in events_by_name.items():
+            section_lengths[name] = max(section_lengths.get(name, 0), events.total_duration)
+    return section_lengths
+
+
+def plan_sections(part_data, score_data, time_signature, events_by_name, section_lengths, warn=print):
+    """
+    Plans a part made of named sections. Each unique section is split into bars and converted to MIDI notes
+    once; every repeat reuses that plan and only offsets the notes. Measures are instantiated fresh from the
+    plan for each repeat, which is cheaper than deep copying music21 measures. Sections are padded to whole
+    bars so a repeat always starts on a bar line.
+
+    Returns:
+    - tuple: (list of (BarPlan, melodies, is_repeat) in play order, list of MIDI note tuples for midi_writer)
+    """
+    sections = part_data.get('sections', {})
+    plans = {}
+    notes_by_name = {}
+    bar_plans = []
+    midi_notes = []
+    start_ticks = 0
+    for name in get_song_structure(part_data, score_data):
+        plan = plans.get(name)
+        is_repeat = plan is not None
+        if plan is None:
+            events = events_by_name.get(name)
+            if events is None:
+                if name not in section_lengths:
+                    warn("Warning: section " + str(name) + " in song_structure has no data in any part. "
+                          "Using one bar of rest.")
+                events = build_event_table([], [])
+            plan = plans[name] = plan_bars(events, time_signature, section_lengths.get(name, 0))
+            notes_by_name[name] = events.to_midi_notes()
+
+        bar_plans.append((plan, get_section_melodies(sections.get(name, {})), is_repeat))
+        offset = start_ticks / TICKS_PER_QUARTER
+        midi_notes.extend((onset + offset, quarter_length, pitches, velocity, lyric)
+                          for onset, quarter_length, pitches, velocity, lyric in notes_by_name[name])
+        start_ticks += plan.total_ticks
+    return bar_plans, midi_notes
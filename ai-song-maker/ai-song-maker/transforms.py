@@ -0,0 +1,339 @@
+from fractions import Fraction
+
+from event_table import NO_PITCH, midi_to_note_name, note_name_to_midi, resolve_melody_item
+from lazy_modules import lazy_module
+from midi_writer import TICKS_PER_QUARTER
+from parts_codec import decode_parts_data, encode_parts_data, is_encoded_parts_data
+from score_helper import process_and_output_score
+
+np = lazy_module('numpy')
+
+_NOTE_NAMES = [midi_to_note_name(midi_pitch) for midi_pitch in range(128)]
+_UNREADABLE = NO_PITCH - 1  # first pitch of an entry whose note names can't be read
+
+
+class SectionArrays:
+    """
+    The melodies, beat_ends and dynamics of one part or section as arrays, the form transforms work on:
+
+    - pitches: int16 matrix of MIDI pitches, one row per entry padded with NO_PITCH; a rest has no pitches
+    - beat_ends: float64 cumulative beat_ends in quarter notes
+    - dynamics: the dynamics markings list, or None when the section has none
+
+    Entries whose note names can't be read can't have their pitches transformed; see check_readable.
+    """
+
+    def __init__(self, data, melody_field, name='', warn=print):
+        self.data = data
+        self.melody_field = melody_field
+        self.name = name
+        self.warn = warn
+        self.melodies = data.get(melody_field) or []
+        self.pitches = _melodies_to_pitches(self.melodies)
+        self.beat_ends = np.asarray(data.get('beat_ends') or [], dtype=np.float64)
+        self.exact_beat_ends = any(isinstance(b, Fraction) for b in data.get('beat_ends') or ())
+        self.dynamics = list(data['dynamics']) if data.get('dynamics') else None
+        self.lyrics = list(data['lyrics']) if data.get('lyrics') else None
+        self.pitches_changed = False
+        self.melodies_changed = False
+        self.beat_ends_changed = False
+        self.dynamics_changed = False
+        self.lyrics_changed = False
+
+    def check_readable(self, action):
+        """
+        Raises ValueError naming the entries whose note names can't be read, so a pitch transform never leaves
+        them behind at their old pitch.
+        """
+        unreadable = np.flatnonzero(self.pitches[:, 0] == _UNREADABLE)
+        if len(unreadable):
+            raise ValueError("Can't " + action + " " + self.name + ": unreadable notes "
+                             + ', '.join(repr(self.melodies[i]) + ' at ' + str(i) for i in unreadable[:5].tolist()))
+
+    def drop(self, dropped):
+        """
+        Removes the entries at the indices in dropped from every list of the section.
+        """
+        for field in ('melodies', 'dynamics', 'lyrics'):
+            values = getattr(self, field)
+            if values is not None:
+                setattr(self, field, [value for i, value in enumerate(values) if i not in dropped])
+        keep = np.ones(len(self.pitches), dtype=bool)
+        keep[[i for i in dropped if i < len(keep)]] = False
+        self.pitches = self.pitches[keep]
+        keep = np.ones(len(self.beat_ends), dtype=bool)
+        keep[list(dropped)] = False
+        self.beat_ends = self.beat_ends[keep]
+        self.melodies_changed = self.beat_ends_changed = True
+        self.dynamics_changed = self.dynamics is not None
+        self.lyrics_changed = self.lyrics is not None
+
+    def to_data(self):
+        """
+        Returns a copy of the section's dict with the changed lists rebuilt. Melodies whose pitches weren't
+        changed keep their exact spelling, and unchanged lists are the original list objects.
+        """
+        data = dict(self.data)
+        if self.pitches_changed:
+            data[self.melody_field] = _pitches_to_melodies(self.pitches, self.melodies)
+        elif self.melodies_changed:
+            data[self.melody_field] = self.melodies
+        if self.beat_ends_changed:
+            data['beat_ends'] = [_beat_end_value(b, self.exact_beat_ends) for b in self.beat_ends.tolist()]
+        if self.dynamics_changed:
+            data['dynamics'] = self.dynamics
+        if self.lyrics_changed:
+            data['lyrics'] = self.lyrics
+        return data
+
+
+def _beat_end_value(beat_end, exact):
+    if beat_end.is_integer():
+        return int(beat_end)
+    if exact:
+        # Back to the Fraction the input had, e.g. 2/3 for a triplet, to the renderer's tick resolution
+        return Fraction(beat_end).limit_denominator(TICKS_PER_QUARTER)
+    return beat_end
+
+
+def _melodies_to_pitches(melodies):
+    rows = []
+    parsed = {}  # each distinct note name is only read once
+    for item in melodies:
+        if isinstance(item, str) and item in parsed:
+            rows.append(parsed[item])
+            continue
+        row = [note_name_to_midi(name) for name in resolve_melody_item(item)]
+        if None in row:
+            row = None
+        if isinstance(item, str):
+            parsed[item] = row
+        rows.append(row)
+    width = max([len(row) for row in rows if row] + [1])
+    pitches = np.full((len(rows), width), NO_PITCH, dtype=np.int16)
+    for index, row in enumerate(rows):
+        if row is None:
+            pitches[index, 0] = _UNREADABLE
+        elif row:
+            pitches[index, :len(row)] = row
+    return pitches
+
+
+def _pitches_to_melodies(pitches, originals):
+    names = np.array(_NOTE_NAMES)[np.clip(pitches, 0, 127)]
+    melodies = []
+    for index, row in enumerate(pitches):
+        if row[0] == _UNREADABLE:
+            melodies.append(originals[index])
+            continue
+        sounding = names[index][row >= 0].tolist()
+        if not sounding:
+            melodies.append('rest')
+        elif len(sounding) == 1:
+            melodies.append(sounding[0])
+        else:
+            melodies.append(sounding)
+    return melodies
+
+
+def transpose_arrays(section, semitones):
+    section.check_readable('transpose')
+    sounding = section.pitches >= 0
+    shifted = section.pitches.astype(np.int32) + semitones
+    shifted = np.where(shifted > 127, shifted - 12 * ((shifted - 116) // 12), shifted)
+    shifted = np.where(shifted < 0, shifted + 12 * ((11 - shifted) // 12), shifted)
+    section.pitches = np.where(sounding, shifted, section.pitches).astype(np.int16)
+    section.pitches_changed = True
+
+
+def double_octave_arrays(section, octaves):
+    """
+    Adds a copy of every note moved by octaves octaves (down when negative), skipping copies outside the
+    MIDI range or already in the chord.
+    """
+    section.check_readable('double')
+    pitches = section.pitches
+    sounding = pitches >= 0
+    doubled = pitches.astype(np.int32) + 12 * octaves
+    keep = sounding & (doubled >= 0) & (doubled <= 127)
+    keep &= ~(doubled[:, :, None] == np.where(sounding, pitches, NO_PITCH)[:, None, :]).any(axis=2)
+    section.pitches = np.concatenate((pitches, np.where(keep, doubled, NO_PITCH).astype(np.int16)), axis=1)
+    # Pack each row's pitches to the front, so a rest is still a row starting with NO_PITCH
+    order = np.argsort(section.pitches == NO_PITCH, axis=1, kind='stable')
+    section.pitches = np.take_along_axis(section.pitches, order, axis=1)
+    section.pitches_changed = True
+
+
+def stretch_arrays(section, factor):
+    section.beat_ends = section.beat_ends * factor
+    section.beat_ends_changed = True
+
+
+def quantize_arrays(section, grid):
+    """
+    Rounds beat_ends to multiples of grid quarter notes. Notes that round onto the same grid point (or onto 0)
+    would have no length left: of each such group only the longest note is kept, the others are dropped and
+    reported, so every later note keeps its own grid position.
+    """
+    beat_ends = section.beat_ends
+    if not len(beat_ends):
+        return
+    steps = np.rint(beat_ends / grid).astype(np.int64)
+    durations = np.diff(beat_ends, prepend=0.0)
+    # Within each run of equal steps keep the longest note; a run ending on step 0 is dropped as well
+    order = np.lexsort((-durations, steps))
+    first_of_step = np.ones(len(order), dtype=bool)
+    first_of_step[1:] = steps[order][1:] != steps[order][:-1]
+    keep = np.zeros(len(steps), dtype=bool)
+    keep[order[first_of_step]] = True
+    keep &= steps > 0
+    section.beat_ends = steps * grid
+    section.beat_ends_changed = True
+    dropped = np.flatnonzero(~keep)
+    if len(dropped):
+        section.warn("Warning: quantizing " + section.name + " to " + str(grid) + " dropped " + str(len(dropped))
+                     + " notes too short for the grid, at " + str(dropped[:10].tolist()))
+        section.drop(set(dropped.tolist()))
+
+
+def remap_dynamics_arrays(section, mapping):
+    if section.dynamics is None:
+        return
+    section.dynamics = [mapping.get(value, value) for value in section.dynamics]
+    section.dynamics_changed = True
+
+
+class Transform:
+    """
+    A lazy chain of bulk edits to parts_data, applied in one pass by apply() or render():
+
+        parts_data, score_data = (Transform(parts_data, score_data)
+                                  .transpose(2)
+                                  .double_octave(-1, parts=['Bass'])
+                                  .quantize(0.25)
+                                  .remap_dynamics({'pp': 'p'})
+                                  .scale_tempo(1.1)
+                                  .apply())
+
+    Each method returns a new Transform, so a chain can be kept and extended or applied to other songs with
+    with_song(). Every part (and each of its sections) is turned into arrays once, all the edits run as array
+    operations, and the lists are rebuilt once; no music21 objects are made. Edits that take parts apply to those
+    part ids only, all parts by default. parts_data can also be parts_codec's compact encoding. warn is called
+    with the warnings of edits that had to change more than asked, e.g. notes quantize dropped.
+    """
+
+    def __init__(self, parts_data, score_data=None, operations=(), warn=print):
+        self.parts_data = parts_data
+        self.score_data = score_data
+        self.operations = tuple(operations)
+        self.warn = warn
+
+    def _then(self, operation, *args, parts=None):
+        return Transform(self.parts_data, self.score_data,
+                         self.operations + ((operation, args, set(parts) if parts is not None else None),), self.warn)
+
+    def with_song(self, parts_data, score_data=None):
+        return Transform(parts_data, score_data, self.operations, self.warn)
+
+    def transpose(self, semitones, parts=None):
+        """
+        Moves notes by semitones. Notes that would leave the MIDI range are moved back by octaves. Transposed
+        notes are respelled as midi_to_note_name spells them. apply() raises ValueError if a part to transpose
+        has notes whose names can't be read.
+        """
+        return self._then(transpose_arrays, int(semitones), parts=parts)
+
+    def double_octave(self, octaves=1, parts=None):
+        return self._then(double_octave_arrays, int(octaves), parts=parts)
+
+    def stretch(self, factor, parts=None):
+        """
+        Multiplies every beat_end by factor, making notes longer (factor > 1) or shorter at the same tempo.
+        """
+        return self._then(stretch_arrays, float(factor), parts=parts)
+
+    def quantize(self, grid=0.25, parts=None):
+        return self._then(quantize_arrays, float(grid), parts=parts)
+
+    def remap_dynamics(self, mapping, parts=None):
+        """
+        Replaces dynamics markings by mapping, e.g. {'pp': 'p', 'ff': 'f'}; markings not in it stay as they are.
+        """
+        return self._then(remap_dynamics_arrays, dict(mapping), parts=parts)
+
+    def scale_tempo(self, factor):
+        """
+        Multiplies the tempo of score_data and of parts that set their own, so the song plays factor times as
+        fast.
+        """
+        return self._then(None, float(factor))
+
+    def _transform_section(self, part_id, data, section_name=None):
+        melody_field = 'melodies' if 'melodies' in data or 'chords' not in data else 'chords'
+        name = str(part_id) if section_name is None else str(part_id) + ' section ' + str(section_name)
+        section = SectionArrays(data, melody_field, name, self.warn)
+        for operation, args, parts in self.operations:
+            if operation is not None and (parts is None or part_id in parts):
+                operation(section, *args)
+        return section.to_data()
+
+    def apply(self, output_format='parts'):
+        """
+        Runs the chain and returns (parts_data, score_data), or with output_format='compact' the
+        parts_codec.encode_parts_data text of the result. The input is never modified.
+        """
+        parts_data, score_data = self.parts_data, dict(self.score_data or {})
+        if is_encoded_parts_data(parts_data):
+            parts_data, encoded_score_data = decode_parts_data(parts_data)
+            score_data = dict(encoded_score_data, **score_data)
+        tempo_factor = 1.0
+        for operation, args, _ in self.operations:
+            if operation is None:
+                tempo_factor *= args[0]
+
+        transformed = {}
+        for part_id, part_data in parts_data.items():
+            touched = any(operation is not None and (parts is None or part_id in parts)
+                          for operation, _, parts in self.operations)
+            if not touched:
+                part_data = dict(part_data)
+            elif 'sections' in part_data:
+                part_data = dict(part_data)
+                part_data['sections'] = {name: self._transform_section(part_id, section_data, name)
+                                         for name, section_data in part_data['sections'].items()}
+            else:
+                part_data = self._transform_section(part_id, part_data)
+            if tempo_factor != 1.0 and part_data.get('tempo') is not None:
+                part_data['tempo'] = _scale_tempo_value(part_data['tempo'], tempo_factor)
+            transformed[part_id] = part_data
+        if tempo_factor != 1.0:
+            score_data['tempo'] = _scale_tempo_value(score_data.get('tempo'), tempo_factor)
+
+        if output_format == 'compact':
+            return encode_parts_data(transformed, score_data)
+        if output_format != 'parts':
+            raise ValueError("output_format must be 'parts' or 'compact'")
+        return transformed, score_data
+
+    def render(self, *args, **kwargs):
+        """
+        Applies the chain and renders the result with process_and_output_score, which takes the same arguments
+        after parts_data and score_data.
+        """
+        parts_data, score_data = self.apply()
+        return process_and_output_score(parts_data, score_data, *args, **kwargs)
+
+
+def _scale_tempo_value(tempo_data, factor):
+    if hasattr(tempo_data, 'getQuarterBPM'):
+        tempo_data = tempo_data.getQuarterBPM()
+    if not isinstance(tempo_data, (int, float)) or isinstance(tempo_data, bool):
+        tempo_data = 120  # the tempo process_and_output_score uses when none is given
+    return tempo_data * factor
+
+
+def transform(parts_data, score_data=None, warn=print):
+    """
+    Starts a Transform chain over parts_data and score_data.
+    """
+    return Transform(parts_data, score_data, warn=warn)
@@ -0,0 +1,296 @@
+import math
+import numbers
+import re
+from collections import namedtuple
+
+from event_table import _DYNAMIC_VELOCITIES, _is_valid_note, note_name_to_midi, get_chord_string
+from instrument_names import (get_instrument_class_name, is_clef_class_name, is_instrument_class_name,
+                              UNSUPPORTED_VOICE_NAMES)
+from sections import get_song_structure, get_section_melodies
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# part is None for score_data problems, section is None for flat parts and index is None for problems that
+# aren't about one entry of the part's lists
+Diagnostic = namedtuple('Diagnostic', 'severity code part section index message')
+
+_KEY_PATTERN = re.compile(r'^[A-Ga-g](#{1,2}|-{1,2}|b)?$')
+_TIME_SIGNATURE_PATTERN = re.compile(r'^\d+(\+\d+)*/\d+$')
+_SIGNATURE_DEFAULTS = {'key': 'C', 'time_signature': '4/4', 'clef': 'TrebleClef', 'tempo': '120 BPM'}
+
+
+class ValidationError(ValueError):
+    """
+    Raised by check_song and by process_and_output_score(validate='strict'). diagnostics holds what was found.
+    """
+
+    def __init__(self, diagnostics):
+        self.diagnostics = diagnostics
+        super().__init__(format_diagnostics(diagnostics))
+
+
+class _Stop(Exception):
+    pass
+
+
+class _Collector:
+    def __init__(self, fail_fast):
+        self.fail_fast = fail_fast
+        self.diagnostics = []
+
+    def add(self, severity, code, part, section, index, message):
+        self.diagnostics.append(Diagnostic(severity, code, part, section, index, message))
+        if severity == ERROR and self.fail_fast:
+            raise _Stop()
+
+
+def _check_melody_item(n):
+    """
+    Returns the ((severity, code, message), ...) problems of one 'melodies' entry, following the rules of
+    event_table.resolve_melody_item without building anything.
+    """
+    if hasattr(n, 'pitches') or hasattr(n, 'nameWithOctave'):  # music21 objects
+        return ()
+    if isinstance(n, list):
+        if len(n) == 0 or n == ['rest']:
+            return ()
+        problems = []
+        if len(n) > 4:
+            problems.append((WARNING, 'large_chord', "Array " + str(n) + " has more than 4 notes and is treated as"
+                                                     " a chord. If its meant to be separate notes, remove the notes"
+                                                     " from the array."))
+        names = [str(chord_note).replace('S', '#') for chord_note in n]
+        if not all(_is_valid_note(name) for name in names):
+            first_note = str(n[0])
+            problems.append((WARNING, 'invalid_chord', "Chord " + str(names) + " is invalid and is replaced by "
+                             + (repr(first_note[0]) if first_note else 'a rest') + get_chord_string()))
+            names = [first_note[0]] if first_note else []
+        if any(note_name_to_midi(name) is None for name in names):
+            problems.append((ERROR, 'unreadable_note', "Chord " + str(names) + " can't be read and will be"
+                                                       " silent" + get_chord_string()))
+        return tuple(problems)
+    if isinstance(n, str):
+        if n == 'rest' or n == '':
+            return ()
+        problems = []
+        name = n.replace('S', '#')
+        if not _is_valid_note(name):
+            problems.append((WARNING, 'invalid_note', "Note " + name + " is invalid, truncating " + name[1:]
+                             + " from it" + get_chord_string()))
+            name = name[0]
+        if note_name_to_midi(name) is None:
+            problems.append((ERROR, 'unreadable_note', "Note " + name + " can't be read and will be silent"))
+        return tuple(problems)
+    return ((WARNING, 'invalid_note', "Entry " + repr(n) + " is not a note, chord or 'rest' and is treated as a"
+                                      " rest"),)
+
+
+def _melody_item_key(n):
+    if isinstance(n, list):
+        try:
+            return tuple(n)
+        except TypeError:
+            return None
+    if isinstance(n, str):
+        return n
+    return None
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _check_lists(collector, part_id, section, data, item_problems):
+    melodies = get_section_melodies(data) if section is not None else data.get('melodies', data.get('chords'))
+    beat_ends = data.get('beat_ends')
+    if melodies is not None and not isinstance(melodies, (list, tuple)):
+        collector.add(ERROR, 'invalid_melodies', part_id, section, None, "melodies must be a list")
+        return
+    if beat_ends is not None and not isinstance(beat_ends, (list, tuple)):
+        collector.add(ERROR, 'invalid_beat_ends', part_id, section, None, "beat_ends must be a list")
+        return
+    if section is None:
+        # build_part makes up random notes or rhythms for what is missing
+        if not melodies:
+            collector.add(WARNING, 'missing_melodies', part_id, None, None,
+                          "Part has no melodies, random notes will be used")
+        if not beat_ends:
+            collector.add(WARNING, 'missing_beat_ends', part_id, None, None,
+                          "Part has no beat_ends, random rhythms will be used")
+        if not melodies or not beat_ends:
+            return
+    melodies = melodies or []
+    beat_ends = beat_ends or []
+    if len(melodies) != len(beat_ends):
+        collector.add(WARNING, 'length_mismatch', part_id, section, None,
+                      "melodies has " + str(len(melodies)) + " entries and beat_ends " + str(len(beat_ends))
+                      + ", the last " + str(abs(len(melodies) - len(beat_ends))) + " will be ignored")
+
+    dynamics_list = data.get('dynamics') or ()
+    length = min(len(melodies), len(beat_ends))
+    previous = 0.0
+    for i in range(length):
+        beat_end = beat_ends[i]
+        if not _is_number(beat_end) or math.isnan(beat_end) or math.isinf(beat_end) or beat_end < 0:
+            collector.add(ERROR, 'invalid_beat_end', part_id, section, i,
+                          "beat_end " + repr(beat_end) + " must be a number of beats from the start")
+            continue
+        if beat_end == previous:
+            collector.add(ERROR, 'duplicate_beat_end', part_id, section, i,
+                          "You can't have two or more notes with the same beat_end value (" + str(beat_end)
+                          + ") on the same part, the note is dropped")
+        elif beat_end < previous:
+            collector.add(WARNING, 'decreasing_beat_end', part_id, section, i,
+                          "beat_end " + str(beat_end) + " is lower than the one before (" + str(previous)
+                          + ") and is taken as a length of its own. beat_ends should add up from the start")
+        previous = beat_end
+
+        n = melodies[i]
+        item_key = _melody_item_key(n)
+        problems = item_problems.get(item_key) if item_key is not None else None
+        if problems is None:
+            problems = _check_melody_item(n)
+            if item_key is not None:
+                item_problems[item_key] = problems
+        for severity, code, message in problems:
+            collector.add(severity, code, part_id, section, i, message)
+
+        if i < len(dynamics_list):
+            dynamic = dynamics_list[i]
+            if dynamic and dynamic not in _DYNAMIC_VELOCITIES:
+                collector.add(WARNING, 'unknown_dynamic', part_id, section, i,
+                              "Dynamic " + repr(dynamic) + " is not one of " + ', '.join(_DYNAMIC_VELOCITIES)
+                              + ", 'mf' is used instead")
+
+
+def _check_signature(collector, part_id, field, value):
+    if value is None:
+        return
+    if field == 'key':
+        valid = hasattr(value, 'tonic') or (isinstance(value, str) and _KEY_PATTERN.match(value))
+    elif field == 'time_signature':
+        valid = hasattr(value, 'ratioString') or (
+                isinstance(value, str) and _TIME_SIGNATURE_PATTERN.match(value) and '/0' not in value)
+    elif field == 'tempo':
+        valid = hasattr(value, 'getQuarterBPM') or (_is_number(value) and value > 0)
+    else:
+        valid = (hasattr(value, 'sign') and hasattr(value, 'line')) or (isinstance(value, str)
+                                                                         and is_clef_class_name(value))
+    if not valid:
+        collector.add(WARNING, 'invalid_' + field, part_id, None, None,
+                      field + ' ' + repr(value) + " can't be read, " + _SIGNATURE_DEFAULTS[field] + " is used")
+
+
+def _check_instrument(collector, part_id, part_instrument):
+    if hasattr(part_instrument, 'instrumentName'):
+        return
+    if not isinstance(part_instrument, str):
+        collector.add(WARNING, 'unknown_instrument', part_id, None, None,
+                      "instrument " + repr(part_instrument) + " is not a name, Piano is used")
+        return
+    name = part_instrument.replace(' ', '')
+    if name in UNSUPPORTED_VOICE_NAMES:
+        collector.add(WARNING, 'unsupported_voice', part_id, None, None,
+                      name + " is not supported! Piano will simulate " + ("voice" if name == 'Voice' else name)
+                      + " section, you will need to add your own voice in")
+    elif not is_instrument_class_name(get_instrument_class_name(part_instrument, warn=None)):
+        collector.add(WARNING, 'unknown_instrument', part_id, None, None,
+                      "Instrument " + part_instrument + " not found, replacing with piano. Maybe the name has"
+                                                        " another variation or instrument is not supported.")
+
+
+def _validate(collector, parts_data, score_data):
+    if not isinstance(parts_data, dict):
+        collector.add(ERROR, 'invalid_parts_data', None, None, None, "parts_data must be a dict of parts")
+        return
+    if score_data is not None and not isinstance(score_data, dict):
+        collector.add(ERROR, 'invalid_score_data', None, None, None, "score_data must be a dict")
+        return
+    score_data = score_data or {}
+    for field in _SIGNATURE_DEFAULTS:
+        _check_signature(collector, None, field, score_data.get(field))
+
+    item_problems = {}  # each distinct note or chord is checked once
+    section_names = set()
+    structures = []
+    for part_id, part_data in parts_data.items():
+        if not isinstance(part_data, dict):
+            collector.add(ERROR, 'invalid_part', part_id, None, None, "part data must be a dict")
+            continue
+        if 'instrument' in part_data:
+            _check_instrument(collector, part_id, part_data['instrument'])
+        for field in _SIGNATURE_DEFAULTS:
+            _check_signature(collector, part_id, field, part_data.get(field))
+        if 'sections' in part_data:
+            sections = part_data['sections']
+            if not isinstance(sections, dict):
+                collector.add(ERROR, 'invalid_sections', part_id, None, None,
+                              "sections must be a dict of section name to section data")
+                continue
+            for name, section_data in sections.items():
+                if not isinstance(section_data, dict):
+                    collector.add(ERROR, 'invalid_section', part_id, name, None, "section data must be a dict")
+                    continue
+                section_names.add(name)
+                _check_lists(collector, part_id, name, section_data, item_problems)
+            structures.append((part_id, get_song_structure(part_data, score_data)))
+        else:
+            _check_lists(collector, part_id, None, part_data, item_problems)
+
+    for part_id, structure in structures:
+        for name in structure:
+            if name not in section_names:
+                collector.add(WARNING, 'unknown_section', part_id, name, None,
+                              "section " + str(name) + " in song_structure has no data in any part. Using one bar"
+                                                       " of rest.")
+
+
+def validate_song(parts_data, score_data=None, fail_fast=False):
+    """
+    Checks parts_data and score_data in a single pass over every part, without creating any music21 objects,
+    and returns a list of Diagnostic tuples (severity, code, part, section, index, message), where index is the
+    entry's position in the part's (or section's) melodies and beat_ends.
+
+    Errors are problems that lose notes: unreadable notes, bad or repeated beat_ends and malformed data.
+    Warnings are things process_and_output_score fixes up on its own, such as truncated notes, unknown
+    instruments or dynamics and signatures it replaces with defaults.
+
+    With fail_fast=True checking stops at the first error, so a bad job is turned down as soon as it is seen.
+    """
+    collector = _Collector(fail_fast)
+    try:
+        _validate(collector, parts_data, score_data)
+    except _Stop:
+        pass
+    return collector.diagnostics
+
+
+def has_errors(diagnostics):
+    return any(diagnostic.severity == ERROR for diagnostic in diagnostics)
+
+
+def check_song(parts_data, score_data=None, fail_fast=True):
+    """
+    Raises ValidationError if the song has errors. Returns the diagnostics, which may hold warnings, otherwise.
+    """
+    diagnostics = validate_song(parts_data, score_data, fail_fast)
+    if has_errors(diagnostics):
+        raise ValidationError(diagnostics)
+    return diagnostics
+
+
+def format_diagnostic(diagnostic):
+    location = []
+    if diagnostic.part is not None:
+        location.append(str(diagnostic.part))
+    if diagnostic.section is not None:
+        location.append('section ' + str(diagnostic.section))
+    if diagnostic.index is not None:
+        location.append('entry ' + str(diagnostic.index))
+    return (diagnostic.severity.capitalize() + ' [' + diagnostic.code + ']'
+            + (' ' + ', '.join(location) if location else '') + ': ' + diagnostic.message)
+
+
+def format_diagnostics(diagnostics):
+    return '\n'.join(format_diagnostic(diagnostic) for diagnostic in diagnostics)
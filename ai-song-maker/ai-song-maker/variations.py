@@ -0,0 +1,156 @@
+import os
+import zlib
+
+from batch_render import get_job_output_paths
+from lazy_modules import lazy_module
+from parts_codec import decode_parts_data, is_encoded_parts_data
+from render_cache import RenderCache, _is_deterministic
+from score_helper import (process_and_output_score, get_key_signature, get_time_signature, get_clef_signature,
+                          get_tempo_signature)
+
+np = lazy_module('numpy')
+
+# The lengths generate_random_rhythms picks from
+RHYTHM_CHOICES = (0.25, 0.5, 1.0, 2.0)
+# How many notes generate a part with neither melodies nor beat_ends, as in build_part
+DEFAULT_FILL_LENGTH = 20
+
+_scale_degree_tables = {}
+
+
+def get_scale_degree_names(key_data):
+    """
+    Returns a NumPy array with the note names of scale degrees 1 to 7 of a key, as generate_random_notes picks
+    them. Each key is worked out with music21 once and kept.
+    """
+    cache_key = key_data if isinstance(key_data, str) or key_data is None else repr(key_data)
+    names = _scale_degree_tables.get(cache_key)
+    if names is None:
+        scale = get_key_signature(key_data).getScale()
+        names = _scale_degree_tables[cache_key] = np.array(
+            [scale.pitchFromDegree(degree).nameWithOctave for degree in range(1, 8)])
+    return names
+
+
+def random_scale_notes(degree_names, length, rng):
+    """
+    Vectorized, seeded generate_random_notes: length note names drawn uniformly from the scale degrees.
+    """
+    return degree_names[rng.integers(0, len(degree_names), length)].tolist()
+
+
+def random_beat_ends(length, rng, choices=RHYTHM_CHOICES):
+    """
+    Vectorized, seeded generate_random_rhythms, returned as proper cumulative beat_ends.
+    """
+    return np.cumsum(np.asarray(choices)[rng.integers(0, len(choices), length)]).tolist()
+
+
+def _part_rng(seed, part_id, section=None):
+    # Each part (and section) has its own stream, so adding or varying another part never changes this one
+    entropy = [int(seed), zlib.crc32(str(part_id).encode('utf-8'))]
+    if section is not None:
+        entropy.append(zlib.crc32(str(section).encode('utf-8')))
+    return np.random.default_rng(entropy)
+
+
+def _vary_lists(data, degree_names, rng, redraw):
+    melodies = data.get('melodies', data.get('chords'))
+    beat_ends = data.get('beat_ends')
+    varied = dict(data)
+    varied.pop('chords', None)
+    if not melodies and not beat_ends:
+        length = DEFAULT_FILL_LENGTH
+    else:
+        length = len(melodies or beat_ends)
+    if not beat_ends:
+        varied['beat_ends'] = random_beat_ends(length, rng)
+    if not melodies or redraw:
+        varied['melodies'] = random_scale_notes(degree_names, length, rng)
+    else:
+        varied['melodies'] = melodies
+    return varied
+
+
+def make_variation(parts_data, score_data, seed, vary_parts=None):
+    """
+    Returns a copy of parts_data for one seed. Parts missing melodies or beat_ends get them filled in with
+    random scale notes and rhythms, as process_and_output_score would, and parts listed in vary_parts get new
+    random melodies on their existing rhythm (every section of a part with sections). All other parts are the
+    same dicts as in parts_data, not copies. The same seed always gives the same variation.
+    """
+    vary_parts = set(vary_parts or ())
+    variation = {}
+    for part_id, part_data in parts_data.items():
+        redraw = part_id in vary_parts
+        if not redraw and _is_deterministic(part_data):
+            variation[part_id] = part_data
+            continue
+        degree_names = get_scale_degree_names(part_data.get('key', score_data.get('key')))
+        if 'sections' in part_data:
+            varied = dict(part_data)
+            varied['sections'] = {name: _vary_lists(section_data, degree_names, _part_rng(seed, part_id, name), True)
+                                  for name, section_data in part_data['sections'].items()}
+        else:
+            varied = _vary_lists(part_data, degree_names, _part_rng(seed, part_id), redraw)
+        variation[part_id] = varied
+    return variation
+
+
+def make_variations(parts_data, score_data, seeds, vary_parts=None):
+    """
+    Returns [(seed, parts_data)], one make_variation per seed.
+    """
+    if is_encoded_parts_data(parts_data):
+        parts_data, encoded_score_data = decode_parts_data(parts_data)
+        score_data = dict(encoded_score_data, **(score_data or {}))
+    return [(seed, make_variation(parts_data, score_data, seed, vary_parts)) for seed in seeds]
+
+
+def get_shared_score_data(score_data):
+    """
+    Returns score_data with its key, time signature, clef and tempo built into music21 objects once, so every
+    variation's parts use the same header objects instead of each building its own.
+    """
+    shared = dict(score_data)
+    for field, get_signature in (('key', get_key_signature), ('time_signature', get_time_signature),
+                                 ('clef', get_clef_signature), ('tempo', get_tempo_signature)):
+        shared[field] = get_signature(score_data.get(field))
+    return shared
+
+
+def render_variations(parts_data, score_data, seeds, output_directory='/mnt/data/music_files', vary_parts=None,
+                      render_cache=None, write_musicxml=True, **render_options):
+    """
+    Renders one variation per seed. The variations share the header objects from get_shared_score_data, and a
+    RenderCache, so a part that is the same in every variation is built once and reused by all of them.
+
+    Args:
+    - seeds (iterable of int): One variation per seed; a seed always gives the same variation.
+    - vary_parts (iterable): Part ids to give new melodies in every variation, besides parts with no melodies
+      or beat_ends, which are always filled in.
+    - render_cache (RenderCache): Shared cache to use; a new one big enough for the song by default.
+    - write_musicxml (bool): False writes only the MIDI files.
+    - render_options: Passed on to process_and_output_score, e.g. midi_encoder='native' or musicxml_writer.
+
+    Returns:
+    - list of dict: One per seed with 'seed', 'parts_data', 'musicxml_path', 'midi_path' and 'score'.
+    """
+    if is_encoded_parts_data(parts_data):
+        parts_data, encoded_score_data = decode_parts_data(parts_data)
+        score_data = dict(encoded_score_data, **(score_data or {}))
+    os.makedirs(output_directory, exist_ok=True)
+    shared_score_data = get_shared_score_data(score_data)
+    if render_cache is None:
+        render_cache = RenderCache(max_parts=max(64, 2 * len(parts_data)))
+    render_options.setdefault('archive_old_files', False)
+    results = []
+    for seed, variation in make_variations(parts_data, score_data, seeds, vary_parts):
+        musicxml_path, midi_path = get_job_output_paths(output_directory, 'variation_' + str(seed))
+        if not write_musicxml:
+            musicxml_path = None
+        score = process_and_output_score(variation, shared_score_data, musicxml_path, midi_path,
+                                         render_cache=render_cache, **render_options)
+        results.append({'seed': seed, 'parts_data': variation, 'musicxml_path': musicxml_path,
+                        'midi_path': midi_path, 'score': score})
+    return results
@@ -0,0 +1,101 @@
+"""
+Times how long importing each ai-song-maker module takes in a fresh interpreter, and whether that import
+pulled in music21 or numpy. Writes JSON in the same layout as run_benchmarks.py so runs can be compared with
+its --compare.
+
+    python benchmarks/import_times.py --output imports.json
+    python benchmarks/import_times.py --compare imports.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from run_benchmarks import PACKAGE_DIRECTORY, get_package_version, compare
+
+# Modules meant to import without music21 or numpy; music21 and numpy load when the first object is built
+MODULES = ['midi_writer', 'event_table', 'parts_codec', 'validation', 'render_metrics', 'sections', 'bar_layout',
+           'factory_cache', 'musicxml_writer', 'key_detection', 'reverse_score', 'direct_reader', 'score_helper',
+           'parse_cache', 'async_render', 'batch_render', 'render_server']
+# Reference points: what the lazy imports save
+REFERENCE_MODULES = ['numpy', 'music21']
+
+_MEASURE_IMPORT = """
+import json, sys, time
+sys.path.insert(0, {directory!r})
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'music21': 'music21' in sys.modules, 'numpy': 'numpy' in sys.modules}}))
+"""
+
+
+def measure_import(module, repeats=5):
+    """
+    Imports module in repeats fresh interpreters and returns the fastest and mean import time and which heavy
+    dependencies it loaded.
+    """
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', _MEASURE_IMPORT.format(directory=PACKAGE_DIRECTORY,
+                                                                              module=module)],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    times = [run['seconds'] for run in runs]
+    return {'seconds_min': min(times), 'seconds_mean': sum(times) / len(times), 'repeats': repeats,
+            'loads_music21': runs[0]['music21'], 'loads_numpy': runs[0]['numpy']}
+
+
+def run(modules, repeats=5):
+    results = []
+    for module in modules:
+        result = measure_import(module, repeats)
+        result.update({'name': 'import.' + module, 'size': 'import'})
+        results.append(result)
+        loaded = [name for name in ('music21', 'numpy') if result['loads_' + name]]
+        print(f"{module:20} {result['seconds_min'] * 1000:8.1f} ms  {', '.join(loaded)}", file=sys.stderr)
+    return {
+        'metadata': {
+            'package_version': get_package_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'repeats': repeats,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure ai-song-maker import times.')
+    parser.add_argument('--modules', default=None, help='comma separated, default: all package modules')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--no-reference', action='store_true', help='skip timing numpy and music21 themselves')
+    parser.add_argument('--output', default=None, help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    modules = args.modules.split(',') if args.modules else MODULES
+    if not args.no_reference and not args.modules:
+        modules = modules + REFERENCE_MODULES
+    current = run(modules, args.repeats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    else:
+        json.dump(current, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Times the render path (process_and_output_score and each of its stages), the reverse path
+(convert_to_parts_data and direct_reader) and the file writers on synthetic songs of controlled size, and
+writes the results as JSON so runs from different versions can be compared.
+
+    python benchmarks/run_benchmarks.py --sizes small,medium --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.join(HERE, '..', 'ai-song-maker')
+sys.path.insert(0, PACKAGE_DIRECTORY)
+sys.path.insert(0, HERE)
+
+import music21
+import numpy as np
+from music21 import converter
+
+from bar_layout import plan_bars
+from direct_reader import read_parts_data
+from event_table import build_event_table
+from factory_cache import create_pitch, create_note, create_chord
+from midi_writer import write_midi
+from musicxml_writer import write_streaming_musicxml
+from parts_codec import encode_parts_data, decode_parts_data, encode_parts_data_binary
+from reverse_score import convert_to_parts_data
+from score_helper import process_and_output_score, build_part, split_note_or_chord, get_time_signature
+from sections import build_section_events, get_section_lengths
+from synthetic_songs import generate_song, count_notes
+
+SIZES = {
+    'small': dict(parts=2, notes_per_part=100),
+    'medium': dict(parts=4, notes_per_part=500),
+    'large': dict(parts=8, notes_per_part=2000),
+}
+
+
+def get_package_version():
+    with open(os.path.join(PACKAGE_DIRECTORY, '__init__.py')) as f:
+        for line in f:
+            if line.startswith('__version__'):
+                return line.split('=', 1)[1].strip().strip('"\'')
+    return None
+
+
+def measure(func, repeats=3, memory=True):
+    """
+    Runs func repeats times and returns its fastest and mean wall time, and its peak traced memory from one
+    extra run under tracemalloc (kept out of the timed runs, since tracing slows everything down).
+    """
+    times = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    result = {'seconds_min': min(times), 'seconds_mean': statistics.mean(times), 'repeats': repeats}
+    if memory:
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                func()
+            result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def get_benchmarks(parts_data, score_data, directory):
+    """
+    Returns {name: callable} for every stage, with the inputs each stage needs prepared up front so only the
+    stage itself is timed.
+    """
+    musicxml_path = os.path.join(directory, 'bench.xml')
+    midi_path = os.path.join(directory, 'bench.mid')
+    time_signature = get_time_signature(score_data['time_signature'])
+
+    def build_events():
+        return [build_event_table(p['melodies'], p['beat_ends'], p.get('dynamics', []), p.get('lyrics', []))
+                for p in parts_data.values()]
+
+    events = build_events()
+
+    def build_parts(build_score=True, collect_midi=False):
+        return [build_part(part_id, part_data, score_data, build_score=build_score, collect_midi=collect_midi)
+                for part_id, part_data in parts_data.items()]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        built = build_parts(True, True)
+    score = music21.stream.Score()
+    for part, _, _ in built:
+        score.append(part)
+    midi_tracks = [midi_track for _, midi_track, _ in built]
+    streamed_parts = [(part, bar_plans) for part, _, bar_plans in built]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_and_output_score(parts_data, score_data, musicxml_path, midi_path, archive_old_files=False)
+    parsed_score = converter.parse(musicxml_path)
+
+    elements = []
+    for part_data in list(parts_data.values())[:1]:
+        for melody, start, end in zip(part_data['melodies'], [0] + part_data['beat_ends'][:-1],
+                                      part_data['beat_ends']):
+            if isinstance(melody, list):
+                elements.append(create_chord(melody, end - start))
+            elif melody != 'rest':
+                elements.append(create_note(melody, end - start))
+    note_names = [m for m in next(iter(parts_data.values()))['melodies'] if isinstance(m, str) and m != 'rest']
+    chord_names = [m for m in next(iter(parts_data.values()))['melodies'] if isinstance(m, list)]
+    # The same notes misspelled, as in a song with an invalid note repeated throughout
+    invalid_names = ['H' + name[1:] for name in note_names]
+
+    def create_note_uncached(name):
+        try:
+            return music21.note.Note(name, quarterLength=1.5)
+        except (music21.pitch.AccidentalException, music21.pitch.PitchException):
+            return None
+    bar_ticks = plan_bars(events[0], time_signature).bar_ticks
+    encoded = encode_parts_data(parts_data, score_data)
+    encoded_binary = encode_parts_data_binary(parts_data, score_data)
+
+    # The first quarter of every part as a chorus, played once and four times, to see what a repeat costs
+    chorus_parts_data = {}
+    for part_id, part_data in parts_data.items():
+        chorus_length = max(1, len(part_data['melodies']) // 4)
+        chorus_parts_data[part_id] = dict(
+            {field: part_data[field] for field in ('instrument', 'clef') if field in part_data},
+            sections={'chorus': {field: part_data[field][:chorus_length]
+                                 for field in ('melodies', 'beat_ends', 'dynamics', 'lyrics') if field in part_data}})
+    chorus_score_data = {repeats: dict(score_data, song_structure=['chorus'] * repeats) for repeats in (1, 4)}
+    chorus_events = build_section_events(chorus_parts_data)
+    chorus_lengths = get_section_lengths(chorus_events)
+
+    def build_chorus_parts(repeats):
+        return [build_part(part_id, part_data, chorus_score_data[repeats], chorus_events[part_id], chorus_lengths)
+                for part_id, part_data in chorus_parts_data.items()]
+
+    def render_chorus(repeats):
+        return process_and_output_score(chorus_parts_data, chorus_score_data[repeats], musicxml_path, midi_path,
+                                        archive_old_files=False)
+
+    return {
+        'render.process_and_output_score': lambda: process_and_output_score(
+            parts_data, score_data, musicxml_path, midi_path, archive_old_files=False),
+        'render.process_and_output_score[native,stream]': lambda: process_and_output_score(
+            parts_data, score_data, musicxml_path, midi_path, midi_encoder='native', musicxml_writer='stream',
+            archive_old_files=False),
+        'render.process_and_output_score[midi_only]': lambda: process_and_output_score(
+            parts_data, score_data, None, midi_path, midi_encoder='native', archive_old_files=False),
+        'render.sections[chorus x1]': lambda: render_chorus(1),
+        'render.sections[chorus x4]': lambda: render_chorus(4),
+        'stage.build_event_table': build_events,
+        'stage.plan_bars': lambda: [plan_bars(e, time_signature) for e in events],
+        'stage.build_part': build_parts,
+        'stage.build_part[midi_only]': lambda: build_parts(False, True),
+        'stage.build_part[chorus x1]': lambda: build_chorus_parts(1),
+        'stage.build_part[chorus x4]': lambda: build_chorus_parts(4),
+        'write.musicxml[music21]': lambda: score.write('musicxml', fp=musicxml_path),
+        'write.musicxml[stream]': lambda: write_streaming_musicxml(streamed_parts, musicxml_path),
+        'write.midi[music21]': lambda: score.write('midi', fp=midi_path),
+        'write.midi[native]': lambda: write_midi(midi_tracks, midi_path, **midi_tracks[0]['header']),
+        'reverse.parse_musicxml[music21]': lambda: converter.parse(musicxml_path, forceSource=True),
+        'reverse.convert_to_parts_data': lambda: convert_to_parts_data(parsed_score),
+        'reverse.read_parts_data[musicxml]': lambda: read_parts_data(musicxml_path),
+        'reverse.read_parts_data[midi]': lambda: read_parts_data(midi_path),
+        'split.split_note_or_chord': lambda: [split_note_or_chord(e, e.quarterLength / 2, e.quarterLength / 2)
+                                              for e in elements],
+        'split.split_at_bars': lambda: events[0].split_at_bars(bar_ticks),
+        'factory.create_pitch': lambda: [create_pitch(name) for name in note_names],
+        'factory.create_pitch[music21]': lambda: [music21.pitch.Pitch(name) for name in note_names],
+        'factory.create_note': lambda: [create_note(name, quarterLength=1.5) for name in note_names],
+        'factory.create_note[music21]': lambda: [music21.note.Note(name, quarterLength=1.5) for name in note_names],
+        'factory.create_note[invalid]': lambda: [create_note(name, quarterLength=1.5) for name in invalid_names],
+        'factory.create_note[music21,invalid]': lambda: [create_note_uncached(name) for name in invalid_names],
+        'factory.create_chord': lambda: [create_chord(names, quarterLength=1.5) for names in chord_names],
+        'factory.create_chord[music21]': lambda: [music21.chord.Chord(names, quarterLength=1.5)
+                                                  for names in chord_names],
+        'codec.encode_parts_data': lambda: encode_parts_data(parts_data, score_data),
+        'codec.decode_parts_data': lambda: decode_parts_data(encoded),
+        'codec.decode_parts_data[binary]': lambda: decode_parts_data(encoded_binary),
+    }
+
+
+def run(sizes, repeats=3, memory=True, name_filter=None, song_options=None):
+    results = []
+    for size in sizes:
+        options = dict(SIZES[size], **(song_options or {}))
+        parts_data, score_data = generate_song(**options)
+        notes = count_notes(parts_data)
+        with tempfile.TemporaryDirectory() as directory:
+            for name, func in get_benchmarks(parts_data, score_data, directory).items():
+                if name_filter and name_filter not in name:
+                    continue
+                result = measure(func, repeats, memory)
+                first_part_notes = len(next(iter(parts_data.values()))['melodies'])
+                measured_notes = first_part_notes if name.startswith(('split.', 'factory.')) else notes
+                result.update({'name': name, 'size': size, 'notes': measured_notes,
+                               'notes_per_second': measured_notes / result['seconds_min']})
+                results.append(result)
+                print(f"{size:7} {name:50} {result['seconds_min'] * 1000:10.2f} ms "
+                      f"{result['notes_per_second']:12.0f} notes/s", file=sys.stderr)
+    return {
+        'metadata': {
+            'package_version': get_package_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'music21': music21.__version__,
+            'numpy': np.__version__,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'repeats': repeats,
+            'song_options': {size: dict(SIZES[size], **(song_options or {})) for size in sizes},
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=1.2):
+    """
+    Prints the time ratio of every benchmark found in both runs and returns the ones slower than threshold.
+    """
+    baseline_times = {(r['size'], r['name']): r['seconds_min'] for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        previous = baseline_times.get((result['size'], result['name']))
+        if previous is None:
+            continue
+        ratio = result['seconds_min'] / previous
+        flag = '  SLOWER' if ratio > threshold else ''
+        print(f"{result['size']:7} {result['name']:50} {ratio:6.2f}x{flag}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append((result['size'], result['name'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ai-song-maker render and reverse paths.')
+    parser.add_argument('--sizes', default='small,medium', help='comma separated: ' + ', '.join(SIZES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory run')
+    parser.add_argument('--chord-density', type=float, default=None)
+    parser.add_argument('--bar-crossing', type=float, default=None)
+    parser.add_argument('--lyric-coverage', type=float, default=None)
+    parser.add_argument('--dynamics-coverage', type=float, default=None)
+    parser.add_argument('--output', default=None, help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    song_options = {option: getattr(args, option) for option in
+                    ('chord_density', 'bar_crossing', 'lyric_coverage', 'dynamics_coverage')
+                    if getattr(args, option) is not None}
+    current = run(args.sizes.split(','), args.repeats, not args.no_memory, args.filter, song_options)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    else:
+        json.dump(current, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
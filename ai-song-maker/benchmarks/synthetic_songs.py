@@ -0,0 +1,91 @@
+import random
+
+NOTE_NAMES = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
+ACCIDENTALS = ['', '', '', '#', '-']
+DYNAMICS = ['pp', 'p', 'mp', 'mf', 'f', 'ff']
+INSTRUMENTS = ['Piano', 'Violin', 'Flute', 'Electric Bass', 'Acoustic Guitar', 'Cello', 'Trumpet', 'Clarinet']
+SYLLABLES = ['la', 'da', 'oh', 'yeah', 'love', 'night', 'sky', 'home']
+# Note lengths in quarter notes a generated note may have, from a sixteenth to a whole note
+DURATIONS = [0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0]
+
+
+def _random_note(rng, octave):
+    return rng.choice(NOTE_NAMES) + rng.choice(ACCIDENTALS) + str(octave)
+
+
+def _random_chord(rng, octave):
+    size = rng.randint(2, 4)
+    return [_random_note(rng, octave + (i > 1)) for i in range(size)]
+
+
+def generate_beat_ends(rng, notes, bar_length=4.0, bar_crossing=0.1):
+    """
+    Returns notes cumulative beat_ends where about bar_crossing of the notes cross a bar line.
+    """
+    beat_ends = []
+    position = 0.0
+    for _ in range(notes):
+        left_in_bar = bar_length - position % bar_length
+        if rng.random() < bar_crossing:
+            # Runs past the next bar line by a sixteenth up to a half note
+            length = left_in_bar + rng.choice([0.25, 0.5, 1.0, 2.0])
+        else:
+            fitting = [d for d in DURATIONS if d <= left_in_bar]
+            length = rng.choice(fitting)
+        position += length
+        beat_ends.append(position)
+    return beat_ends
+
+
+def generate_song(parts=4, notes_per_part=500, chord_density=0.2, rest_density=0.05, lyric_coverage=0.5,
+                  dynamics_coverage=1.0, bar_crossing=0.1, time_signature='4/4', tempo=120, seed=0):
+    """
+    Generates a flat parts_data/score_data pair of a controlled size for benchmarking.
+
+    Args:
+    - parts (int): Number of parts.
+    - notes_per_part (int): Melody entries per part, notes, chords and rests together.
+    - chord_density (float): Fraction of entries that are chords.
+    - rest_density (float): Fraction of entries that are rests.
+    - lyric_coverage (float): Fraction of entries with a lyric; 0 leaves 'lyrics' out.
+    - dynamics_coverage (float): Fraction of entries with a dynamic; the others are ''. 0 leaves 'dynamics' out.
+    - bar_crossing (float): Fraction of entries that run over a bar line and have to be split.
+    - seed (int): Seed, so the same arguments always give the same song.
+
+    Returns:
+    - tuple: (parts_data, score_data)
+    """
+    rng = random.Random(seed)
+    numerator, denominator = (int(v) for v in time_signature.split('/'))
+    bar_length = numerator * 4.0 / denominator
+    parts_data = {}
+    for part_no in range(parts):
+        octave = 3 + part_no % 3
+        melodies = []
+        for _ in range(notes_per_part):
+            roll = rng.random()
+            if roll < rest_density:
+                melodies.append('rest')
+            elif roll < rest_density + chord_density:
+                melodies.append(_random_chord(rng, octave))
+            else:
+                melodies.append(_random_note(rng, octave))
+        part_data = {
+            'instrument': INSTRUMENTS[part_no % len(INSTRUMENTS)],
+            'melodies': melodies,
+            'beat_ends': generate_beat_ends(rng, notes_per_part, bar_length, bar_crossing),
+        }
+        if dynamics_coverage:
+            part_data['dynamics'] = [rng.choice(DYNAMICS) if rng.random() < dynamics_coverage else ''
+                                     for _ in range(notes_per_part)]
+        if lyric_coverage:
+            part_data['lyrics'] = [rng.choice(SYLLABLES) if rng.random() < lyric_coverage else ''
+                                   for _ in range(notes_per_part)]
+        parts_data['Part ' + str(part_no + 1)] = part_data
+
+    score_data = {'key': 'C', 'time_signature': time_signature, 'tempo': tempo, 'clef': 'TrebleClef'}
+    return parts_data, score_data
+
+
+def count_notes(parts_data):
+    return sum(len(part_data.get('melodies', [])) for part_data in parts_data.values())
@@ -0,0 +1,26 @@
+import copy
+import os
+import sys
+from fractions import Fraction
+
+import pytest
+
+PACKAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai-song-maker')
+sys.path.insert(0, PACKAGE_DIRECTORY)
+
+
+@pytest.fixture
+def song():
+    """
+    A small two-part song with chords, rests, a tie over the bar line, triplets, dynamics and lyrics.
+    """
+    parts_data = {
+        'Piano': {'instrument': 'Piano', 'melodies': ['C4', ['E4', 'G4'], 'rest', 'B-3', 'D5', 'E5', 'F#4', 'C4'],
+                  'beat_ends': [1, 2, 3, 5, Fraction(16, 3), Fraction(17, 3), 6, 8],
+                  'dynamics': ['p', 'mf', 'mf', 'f', 'f', 'f', 'mp', 'pp'],
+                  'lyrics': ['la', '', '', 'lo', '', '', 'li', '']},
+        'Bass': {'instrument': 'Electric Bass', 'clef': 'BassClef', 'melodies': ['C2', 'G2', 'A2', 'F2'],
+                 'beat_ends': [2, 4, 6, 8]},
+    }
+    score_data = {'key': 'C', 'time_signature': '4/4', 'tempo': 96, 'clef': 'TrebleClef'}
+    return copy.deepcopy(parts_data), dict(score_data)
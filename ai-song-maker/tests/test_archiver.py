@@ -0,0 +1,75 @@
+import os
+import time
+
+import pytest
+
+from archiver import MusicFileArchiver
+
+
+def write_file(path, age=0, content=b'data'):
+    with open(path, 'wb') as f:
+        f.write(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+@pytest.fixture
+def archiver(tmp_path):
+    (tmp_path / 'out').mkdir()
+    return MusicFileArchiver(str(tmp_path / 'out'), str(tmp_path / 'archive'), max_age=120)
+
+
+def archived(archiver):
+    return sorted(os.listdir(archiver.archive_directory)) if os.path.isdir(archiver.archive_directory) else []
+
+
+def test_scan_archives_old_music_files_only(archiver, tmp_path):
+    write_file(tmp_path / 'out' / 'old.mid', age=300)
+    write_file(tmp_path / 'out' / 'old.mxl', age=300)
+    write_file(tmp_path / 'out' / 'new.xml')
+    write_file(tmp_path / 'out' / 'old.txt', age=300)
+    assert archiver.scan() == 3
+    assert archiver.archive_due() == 2
+    assert archived(archiver) == ['old.mid', 'old.mxl']
+    assert archiver.stats() == {'pending': 1, 'archived': 2, 'errors': 0}
+
+
+def test_file_count_limit_archives_oldest_first(tmp_path):
+    (tmp_path / 'out').mkdir()
+    archiver = MusicFileArchiver(str(tmp_path / 'out'), str(tmp_path / 'archive'), max_files=2)
+    for age, name in ((30, 'a.mid'), (20, 'b.mid'), (10, 'c.mid')):
+        write_file(tmp_path / 'out' / name, age=age)
+    archiver.scan()
+    assert archiver.archive_due() == 1
+    assert archived(archiver) == ['a.mid']
+
+
+def test_current_outputs_are_never_archived(archiver, tmp_path):
+    midi_path = write_file(tmp_path / 'out' / 'song_midi.mid')
+    archiver.register(midi_path)
+    assert archiver.archive_due(now=time.time() + 600) == 0
+    assert os.path.exists(midi_path)
+
+    newer_path = write_file(tmp_path / 'out' / 'song2_midi.mid')
+    archiver.register(newer_path)
+    assert archiver.archive_due(now=time.time() + 600) == 1
+    assert archived(archiver) == ['song_midi.mid']
+
+
+def test_file_rewritten_since_indexing_is_kept(archiver, tmp_path):
+    path = write_file(tmp_path / 'out' / 'song.mid', age=300)
+    archiver.scan()
+    write_file(path, content=b'a new render')
+    assert archiver.archive_due() == 0
+    assert os.path.exists(path)
+    assert archiver.pending_count() == 1
+
+
+def test_recently_modified_file_is_kept(tmp_path):
+    (tmp_path / 'out').mkdir()
+    archiver = MusicFileArchiver(str(tmp_path / 'out'), str(tmp_path / 'archive'), max_age=0, min_quiet=5)
+    write_file(tmp_path / 'out' / 'song.mid', age=1)
+    archiver.scan()
+    assert archiver.archive_due(now=time.time() + 2) == 0
+    assert archiver.archive_due(now=time.time() + 600) == 1
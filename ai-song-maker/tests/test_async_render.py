@@ -0,0 +1,132 @@
+import asyncio
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_render import process_and_output_score_async, start_render
+
+PARTS_DATA = {'Piano': {'instrument': 'Piano', 'melodies': ['C4', ['E4', 'G4'], 'rest', 'D4'],
+                        'beat_ends': [1, 2, 3, 4], 'dynamics': ['p', 'mf', 'mf', 'f']}}
+SCORE_DATA = {'key': 'C', 'time_signature': '4/4', 'tempo': 100}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.mark.parametrize('midi_encoder', ['native', 'music21'])
+def test_writes_both_files(tmp_path, midi_encoder):
+    musicxml_path, midi_path = str(tmp_path / 'song.xml'), str(tmp_path / 'song.mid')
+
+    async def render():
+        return await start_render(PARTS_DATA, SCORE_DATA, musicxml_path, midi_path, midi_encoder,
+                                  archive_old_files=False)
+
+    assert run(render()) == {'midi': midi_path, 'musicxml': musicxml_path}
+    assert sorted(os.listdir(tmp_path)) == ['song.mid', 'song.xml']
+    with open(midi_path, 'rb') as f:
+        assert f.read(4) == b'MThd'
+
+
+def test_skips_outputs_without_a_path(tmp_path):
+    musicxml_path = str(tmp_path / 'song.xml')
+
+    async def render():
+        return await start_render(PARTS_DATA, SCORE_DATA, musicxml_path, None, archive_old_files=False)
+
+    assert run(render()) == {'musicxml': musicxml_path}
+    assert os.listdir(tmp_path) == ['song.xml']
+
+
+def test_writes_file_objects(capsys):
+    midi, musicxml = io.BytesIO(), io.BytesIO()
+    score = run(process_and_output_score_async(PARTS_DATA, SCORE_DATA, musicxml, midi, musicxml_format='mxl',
+                                               archive_old_files=False))
+    assert len(score.parts) == 1
+    assert midi.getvalue()[:4] == b'MThd'
+    assert zipfile.ZipFile(musicxml).namelist() == ['mimetype', 'META-INF/container.xml', 'score.musicxml']
+    assert 'save to' not in capsys.readouterr().out
+
+
+def test_mxl_member_is_named_after_the_final_path(tmp_path):
+    musicxml_path = str(tmp_path / 'song.mxl')
+    run(process_and_output_score_async(PARTS_DATA, SCORE_DATA, musicxml_path, None, archive_old_files=False))
+    assert 'song.musicxml' in zipfile.ZipFile(musicxml_path).namelist()
+    assert os.listdir(tmp_path) == ['song.mxl']
+
+
+class _BlockingFile(io.BytesIO):
+    """
+    A file object whose first write waits until release is set, to hold a write back.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, data):
+        self.release.wait(10)
+        return super().write(data)
+
+
+def test_first_completed_returns_midi_before_musicxml(tmp_path):
+    midi_path = str(tmp_path / 'song.mid')
+    musicxml = _BlockingFile()
+
+    async def render():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            started = start_render(PARTS_DATA, SCORE_DATA, musicxml, midi_path, archive_old_files=False,
+                                   executor=executor)
+            try:
+                first = await started.first_completed()
+                musicxml_done = started.musicxml.done()
+            finally:
+                musicxml.release.set()
+            outputs = await started
+        return first, musicxml_done, outputs
+
+    first, musicxml_done, outputs = run(render())
+    assert first == ('midi', midi_path)
+    assert not musicxml_done
+    assert outputs == {'midi': midi_path, 'musicxml': musicxml}
+    assert musicxml.getvalue().startswith(b'<?xml')
+
+
+def test_first_completed_needs_an_output():
+    async def render():
+        return await start_render(PARTS_DATA, SCORE_DATA, None, None, archive_old_files=False).first_completed()
+
+    with pytest.raises(ValueError, match='no output'):
+        run(render())
+
+
+def test_cancel_during_build_leaves_no_files(tmp_path):
+    parts_data = dict(PARTS_DATA, Bass={'instrument': 'Electric Bass', 'melodies': ['C2', 'G2'], 'beat_ends': [2, 4]})
+    building, cancelled = threading.Event(), threading.Event()
+
+    def hold_build(kind, name, value):
+        # Called in the build thread once the event tables are built, before any part is
+        if kind == 'stage' and name == 'events':
+            building.set()
+            cancelled.wait(10)
+
+    async def render():
+        executor = ThreadPoolExecutor(max_workers=4)
+        started = start_render(parts_data, SCORE_DATA, str(tmp_path / 'song.xml'), str(tmp_path / 'song.mid'),
+                               midi_encoder='music21', archive_old_files=False, executor=executor,
+                               metrics=hold_build)
+        await asyncio.get_running_loop().run_in_executor(None, building.wait, 10)
+        started.cancel()
+        cancelled.set()
+        with pytest.raises(asyncio.CancelledError):
+            await started
+        executor.shutdown(wait=True)
+        return started
+
+    started = run(render())
+    assert started.cancelled()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,39 @@
+import wave
+
+import numpy as np
+import pytest
+
+from audio_preview import build_wavetable, get_timbre_preset, render_preview
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as wav_file:
+        assert (wav_file.getnchannels(), wav_file.getsampwidth()) == (1, 2)
+        return wav_file.getframerate(), np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+
+
+@pytest.mark.parametrize('program, channel, preset', [(0, 0, 'piano'), (33, 1, 'bass'), (40, 2, 'strings'),
+                                                      (0, 9, 'percussion'), (None, 0, 'piano')])
+def test_timbre_preset(program, channel, preset):
+    assert get_timbre_preset(program, channel) == preset
+
+
+def test_wavetable_peak():
+    table = build_wavetable([1.0, 0.5, 0.25])
+    assert np.abs(table).max() == pytest.approx(1.0)
+
+
+def test_preview_length_and_level(song, tmp_path):
+    path = render_preview(*song, wav_path=str(tmp_path / 'song.wav'), sample_rate=8000)
+    sample_rate, samples = read_wav(path)
+    assert sample_rate == 8000
+    # Eight beats at 96 bpm, plus the last notes' release
+    assert 5.0 <= len(samples) / sample_rate < 5.5
+    assert np.abs(samples[:800]).max() > 1000
+    assert np.abs(samples).max() <= 32767
+
+
+def test_chunk_size_does_not_change_the_audio(song, tmp_path):
+    whole = render_preview(*song, wav_path=str(tmp_path / 'whole.wav'), sample_rate=8000, chunk_seconds=10)
+    chunked = render_preview(*song, wav_path=str(tmp_path / 'chunked.wav'), sample_rate=8000, chunk_seconds=0.3)
+    assert np.array_equal(read_wav(whole)[1], read_wav(chunked)[1])
@@ -0,0 +1,55 @@
+from fractions import Fraction
+
+from bar_layout import compute_bar_boundaries, plan_bars
+from event_table import TIE_START, TIE_STOP, build_event_table
+from midi_writer import TICKS_PER_QUARTER
+from score_helper import process_and_output_score
+
+
+def test_compute_bar_boundaries():
+    bar_ticks = 4 * TICKS_PER_QUARTER
+    assert compute_bar_boundaries(0, bar_ticks).tolist() == [0, bar_ticks]
+    assert compute_bar_boundaries(bar_ticks + 1, bar_ticks).tolist() == [0, bar_ticks, 2 * bar_ticks]
+
+
+def test_plan_bars_splits_notes_at_bar_lines():
+    from music21 import meter
+    events = build_event_table(['C4', 'D4', 'E4'], [3, 6, 8], ['p', 'f', 'mf'])
+    plan = plan_bars(events, meter.TimeSignature('4/4'))
+    assert plan.bar_count == 2
+    assert plan.segments.source_index.tolist() == [0, 1, 1, 2]
+    assert plan.segments.tie.tolist()[1:3] == [TIE_START, TIE_STOP]
+    assert plan.first_rows.tolist() == [0, 2, 4]
+
+
+def test_measures_match_the_original_layout(song, tmp_path):
+    parts_data, score_data = song
+    score = process_and_output_score(parts_data, score_data, str(tmp_path / 'song.xml'), None,
+                                     archive_old_files=False)
+    piano = score.parts[0]
+    measures = list(piano.getElementsByClass('Measure'))
+    assert len(measures) == 2
+    # The first bar is marked 'mf'; later bars get the dynamic of their first note
+    assert [m.getElementsByClass('Dynamic')[0].value for m in measures] == ['mf', 'f']
+    assert [(n.offset, n.quarterLength) for n in measures[1].notesAndRests][:3] == [
+        (0, 1), (1, Fraction(1, 3)), (Fraction(4, 3), Fraction(1, 3))]
+    assert measures[0].notes[-1].tie.type == 'start'
+    assert [n.lyric for n in piano.recurse().notes if n.lyric] == ['la', 'lo', 'li']
+
+
+def test_bar_is_marked_with_its_first_note(tmp_path):
+    from music21 import converter
+    parts_data = {'Piano': {'instrument': 'Piano', 'melodies': ['C4', 'D4', 'E4', 'B-3', 'C4'],
+                            'beat_ends': [1, 2, 3, 4, 6], 'dynamics': ['p', 'p', 'p', 'f', 'pp']}}
+    score_data = {'key': 'C', 'time_signature': '3/4', 'tempo': 100}
+    for musicxml_writer in ('music21', 'stream'):
+        path = str(tmp_path / (musicxml_writer + '.xml'))
+        process_and_output_score(parts_data, score_data, path, None, musicxml_writer=musicxml_writer,
+                                 archive_old_files=False)
+        measures = converter.parse(path).parts[0].getElementsByClass('Measure')
+        assert [m.getElementsByClass('Dynamic')[0].value for m in measures] == ['mf', 'f']
+
+    midi_path = str(tmp_path / 'song.mid')
+    process_and_output_score(parts_data, score_data, None, midi_path, archive_old_files=False)
+    velocities = [n.volume.velocity for n in converter.parse(midi_path).flatten().notes]
+    assert velocities[3] > velocities[2]
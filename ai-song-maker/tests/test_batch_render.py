@@ -0,0 +1,62 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_render import get_job_output_paths, render_batch
+
+PARTS_DATA = {'Piano': {'instrument': 'Piano', 'melodies': ['C4', 'E4', 'G4'], 'beat_ends': [1, 2, 3]}}
+
+
+def test_job_output_paths_are_safe_and_unique(tmp_path):
+    musicxml_path, midi_path = get_job_output_paths(str(tmp_path), 'a/b c')
+    assert os.path.basename(musicxml_path) == 'song_musicxml_a_b_c.xml'
+    assert os.path.basename(midi_path) == 'song_midi_a_b_c.mid'
+
+
+def test_render_batch(tmp_path):
+    jobs = [(PARTS_DATA, {}),
+            {'job_id': 'midi-only', 'parts_data': PARTS_DATA, 'score_data': {}, 'musicxml_path': None},
+            {'job_id': 'own-path', 'parts_data': PARTS_DATA, 'score_data': {},
+             'midi_path': str(tmp_path / 'own.mid'), 'musicxml_path': None}]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = render_batch(jobs, str(tmp_path), executor=executor, midi_encoder='native')
+
+    assert [result['job_id'] for result in results] == [0, 'midi-only', 'own-path']
+    assert all(result['error'] is None for result in results)
+    assert os.path.exists(results[0]['musicxml_path']) and os.path.exists(results[0]['midi_path'])
+    assert results[1]['musicxml_path'] is None and os.path.exists(results[1]['midi_path'])
+    assert results[2]['midi_path'] == str(tmp_path / 'own.mid')
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_colliding_job_ids_get_their_own_files(tmp_path):
+    other_parts_data = {'Piano': {'instrument': 'Piano', 'melodies': ['D4', 'F4'], 'beat_ends': [1, 2]}}
+    jobs = [{'job_id': 'x', 'parts_data': PARTS_DATA, 'score_data': {}},
+            {'job_id': 'x', 'parts_data': other_parts_data, 'score_data': {}},
+            {'job_id': 'a/b', 'parts_data': PARTS_DATA, 'score_data': {}},
+            {'job_id': 'a_b', 'parts_data': other_parts_data, 'score_data': {}}]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = render_batch(jobs, str(tmp_path), executor=executor, midi_encoder='native')
+
+    assert [result['job_id'] for result in results] == ['x', 'x', 'a/b', 'a_b']
+    assert len({result['midi_path'] for result in results}) == 4
+    assert len({result['musicxml_path'] for result in results}) == 4
+    assert len(os.listdir(tmp_path)) == 8
+    with open(results[0]['midi_path'], 'rb') as first, open(results[1]['midi_path'], 'rb') as second:
+        assert first.read() != second.read()
+
+
+class _CrashingExecutor(ThreadPoolExecutor):
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(self._crash)
+
+    @staticmethod
+    def _crash():
+        raise RuntimeError('worker died')
+
+
+def test_crashed_job_keeps_its_job_id(tmp_path):
+    with _CrashingExecutor(max_workers=1) as executor:
+        results = render_batch([{'job_id': 'song', 'parts_data': PARTS_DATA, 'score_data': {}}], str(tmp_path),
+                               executor=executor)
+    assert results[0]['job_id'] == 'song'
+    assert 'worker died' in results[0]['error']
@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from music21 import converter
+
+from direct_reader import quantize_quarter_lengths, read_midi_file, read_parts_data
+from reverse_score import convert_to_parts_data
+from score_helper import process_and_output_score
+
+
+def render(song, path):
+    parts_data, score_data = song
+    path = str(path)
+    is_midi = path.endswith('.mid')
+    process_and_output_score(parts_data, score_data, None if is_midi else path, path if is_midi else None,
+                             archive_old_files=False)
+    return path
+
+
+def merge_tied(part_data):
+    # The direct reader gives a note tied across a bar line as one element, music21 as one per tied piece
+    merged = []
+    lyrics = part_data.get('lyrics') or [''] * len(part_data['melodies'])
+    for melody, beat_end, dynamic, lyric in zip(part_data['melodies'], part_data['beat_ends'],
+                                                part_data['dynamics'], lyrics):
+        if merged and melody != 'rest' and merged[-1][0] == melody and merged[-1][2] == dynamic and not lyric:
+            merged[-1][1] = beat_end
+        else:
+            merged.append([melody, beat_end, dynamic, lyric])
+    return [(melody, pytest.approx(float(beat_end)), dynamic, lyric) for melody, beat_end, dynamic, lyric in merged]
+
+
+@pytest.mark.parametrize('extension', ['.mid', '.xml', '.mxl'])
+def test_matches_convert_to_parts_data(song, tmp_path, extension):
+    path = render(song, tmp_path / ('song' + extension))
+    parts_data, score_data, _ = read_parts_data(path)
+    expected_parts_data, expected_score_data, _ = convert_to_parts_data(converter.parse(path))
+
+    assert list(parts_data) == list(expected_parts_data)
+    for part_name, expected_part_data in expected_parts_data.items():
+        assert merge_tied(parts_data[part_name]) == merge_tied(expected_part_data)
+    for field in ('key', 'time_signature', 'tempo'):
+        assert str(score_data[field]) == str(expected_score_data[field])
+
+
+def test_musicxml_keeps_instruments_and_clefs(song, tmp_path):
+    parts_data, score_data, _ = read_parts_data(render(song, tmp_path / 'song.xml'))
+    assert [part_data['instrument'] for part_data in parts_data.values()] == ['Piano', 'Electric Bass']
+    assert parts_data['Piano']['melodies'][:4] == ['C4', ['E4', 'G4'], 'rest', 'B-3']
+    assert parts_data['Piano']['beat_ends'][3] == 5
+
+
+def test_reads_midi_from_file_object(song, tmp_path):
+    path = render(song, tmp_path / 'song.mid')
+    with open(path, 'rb') as f:
+        from_file_object = read_midi_file(io.BytesIO(f.read()))
+    assert from_file_object == read_midi_file(path)
+
+
+def test_unsupported_extension(tmp_path):
+    with pytest.raises(ValueError):
+        read_parts_data(str(tmp_path / 'song.txt'))
+
+
+def test_quantize_quarter_lengths():
+    assert list(quantize_quarter_lengths([0.26, 0.32, 0.5, 0.66, 1.01])) == pytest.approx(
+        [0.25, 1 / 3, 0.5, 2 / 3, 1.0])
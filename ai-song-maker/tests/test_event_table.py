@@ -0,0 +1,52 @@
+import pytest
+
+from event_table import (NO_PITCH, build_event_table, midi_to_note_name, note_name_to_midi, parse_note_name,
+                         resolve_melody_item)
+from midi_writer import TICKS_PER_QUARTER
+from score_helper import process_and_output_score
+
+
+@pytest.mark.parametrize('name, midi_pitch', [('C4', 60), ('F#3', 54), ('B-2', 46), ('Bb2', 46), ('c', 60),
+                                              ('E##4', 66), ('C4#', 61), ('C4-', 59), ('C~4', 61)])
+def test_note_name_to_midi_matches_music21(name, midi_pitch):
+    from music21 import pitch
+    assert note_name_to_midi(name) == midi_pitch == pitch.Pitch(name).midi
+
+
+@pytest.mark.parametrize('name', ['H4', 'Dd', 'C#-4', ''])
+def test_unreadable_note_names(name):
+    assert parse_note_name(name) is None
+    assert note_name_to_midi(name) is None
+
+
+def test_midi_to_note_name_round_trips():
+    # Below octave 0 the '-' of the octave reads as a flat, in music21 too
+    assert all(note_name_to_midi(midi_to_note_name(midi_pitch)) == midi_pitch for midi_pitch in range(12, 128))
+
+
+def test_resolve_melody_item():
+    assert resolve_melody_item('C4S') == ('C4#',)
+    assert resolve_melody_item(['C4', 'E4']) == ('C4', 'E4')
+    assert resolve_melody_item('rest') == ()
+    assert resolve_melody_item(['rest']) == ()
+
+
+def test_build_event_table():
+    warnings = []
+    events = build_event_table(['C4', ['E4', 'G4'], 'rest', 'C4S', 'D4'], [1, 2.5, 3, 3, 4], ['p', 'f'], ['la'],
+                               warn=warnings.append)
+    assert events.onset.tolist() == [0, TICKS_PER_QUARTER, 5 * TICKS_PER_QUARTER // 2, 3 * TICKS_PER_QUARTER]
+    assert events.pitches[:, :2].tolist() == [[60, NO_PITCH], [64, 67], [NO_PITCH, NO_PITCH], [62, NO_PITCH]]
+    assert events.velocity.tolist() == [42, 80, 80, 80]
+    assert events.source_index.tolist() == [0, 1, 2, 4]
+    assert len(warnings) == 1  # the repeated beat_end
+
+
+@pytest.mark.parametrize('midi_encoder', ['music21', 'native'])
+def test_sharp_written_after_the_octave_renders(tmp_path, midi_encoder, capsys):
+    parts_data = {'Piano': {'instrument': 'Piano', 'melodies': ['C4S', ['C4#', 'E4']], 'beat_ends': [1, 2]}}
+    score = process_and_output_score(parts_data, {}, str(tmp_path / 'song.xml'), str(tmp_path / 'song.mid'),
+                                     midi_encoder=midi_encoder)
+    assert 'Please fix note' not in capsys.readouterr().out
+    notes = list(score.recurse().notes)
+    assert [p.midi for n in notes for p in n.pitches] == [61, 61, 64]
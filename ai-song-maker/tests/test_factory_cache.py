@@ -0,0 +1,56 @@
+import pytest
+
+from factory_cache import (create_chord, create_clef, create_note, create_pitch, get_pitch_spelling, pitch_cache,
+                           signature_cache)
+from parse_cache import restore_score_data
+from score_helper import get_clef_signature
+
+
+def test_clef_names_build_their_clef():
+    assert type(get_clef_signature('BassClef')).__name__ == 'BassClef'
+    assert type(create_clef('AltoClef')).__name__ == 'AltoClef'
+
+
+def test_unknown_clef_names_fall_back_to_treble_and_are_not_cached():
+    signature_cache.clear()
+    assert type(get_clef_signature('NotAClef')).__name__ == 'TrebleClef'
+    assert create_clef('__name__') is None
+    assert len(signature_cache) == 0
+    assert type(get_clef_signature('BassClef')).__name__ == 'BassClef'
+
+
+def test_cached_clefs_are_copies():
+    assert create_clef('BassClef') is not create_clef('BassClef')
+
+
+def test_restored_score_data_has_clef_objects():
+    restored = restore_score_data({'clef': 'BassClef', 'key': 'G', 'time_signature': '3/4', 'tempo': 90})
+    assert type(restored['clef']).__name__ == 'BassClef'
+    assert restored['time_signature'].ratioString == '3/4'
+
+
+@pytest.mark.parametrize('name', ['C4', 'F#3', 'E-5', 'B--2', 'D~4', 'Cn4', 'G', 'c#4'])
+def test_created_pitches_match_music21(name):
+    from music21 import pitch
+    created = create_pitch(name)
+    parsed = pitch.Pitch(name)
+    assert (created.nameWithOctave, created.octave, created.midi) == (parsed.nameWithOctave, parsed.octave, parsed.midi)
+
+
+def test_notes_and_chords_never_share_pitches():
+    first, second = create_note('C#4', quarterLength=2), create_note('C#4')
+    assert first.pitch is not second.pitch
+    first.pitch.accidental = 'flat'
+    assert second.pitch.nameWithOctave == 'C#4'
+    assert first.quarterLength == 2
+    chord = create_chord(['C4', 'E4', 'G4'])
+    assert [p.nameWithOctave for p in chord.pitches] == ['C4', 'E4', 'G4']
+    assert create_chord(['C4', 'E4'])[0].pitch is not chord[0].pitch
+
+
+def test_invalid_names_are_parsed_once():
+    pitch_cache.clear()
+    assert create_note('H4') is None
+    assert create_chord(['C4', 'H4']) is None
+    assert get_pitch_spelling('H4') is None
+    assert pitch_cache.stats()['misses'] == 2
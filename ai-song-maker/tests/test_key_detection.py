@@ -0,0 +1,77 @@
+import pytest
+from music21 import converter, corpus, key, meter, note, stream
+
+from key_detection import detect_key, estimate_key, get_pitch_class_histogram
+from reverse_score import convert_to_parts_data
+
+
+def make_score(note_names, key_signature=None):
+    part = stream.Part()
+    part.append(meter.TimeSignature('4/4'))
+    if key_signature is not None:
+        part.append(key_signature)
+    for name in note_names:
+        part.append(note.Rest() if name == 'rest' else note.Note(name))
+    score = stream.Score()
+    score.insert(0, part)
+    return score
+
+
+PIECES = {
+    'bach minor': lambda: corpus.parse('bach/bwv66.6'),
+    'bach e minor': lambda: corpus.parse('bach/bwv7.7'),
+    'c minor melody': lambda: make_score(['C4', 'E-4', 'G4', 'A-4', 'G4', 'F4', 'E-4', 'D4', 'B3', 'C4']),
+    'd flat major': lambda: make_score(['D-4', 'F4', 'A-4', 'G-4', 'B-4', 'E-5', 'C5', 'D-5', 'A-4', 'D-4']),
+    'chromatic': lambda: converter.parse('tinyNotation: 4/4 c#4 d#4 e#4 f#4 g#4 a#4 b#4 c#\'4 g#4 e#4 c#2'),
+}
+
+
+@pytest.mark.parametrize('name', sorted(PIECES))
+def test_fast_matches_music21(name):
+    score = PIECES[name]()
+    expected = score.analyze('key')
+    detected = detect_key(score, 'fast')
+    assert (detected.tonic.name, detected.mode) == (expected.tonic.name, expected.mode)
+    assert detected.correlationCoefficient == pytest.approx(expected.correlationCoefficient)
+
+
+def test_music21_method():
+    score = PIECES['c minor melody']()
+    assert detect_key(score, 'music21') == score.analyze('key')
+
+
+def test_signature_uses_the_written_key():
+    # The notes are in C major, but the written key signature wins
+    score = make_score(['C4', 'E4', 'G4', 'C5'], key.KeySignature(-3))
+    detected = detect_key(score, 'signature')
+    assert (detected.tonic.name, detected.mode) == ('E-', 'major')
+    written_minor = make_score(['C4', 'E4', 'G4', 'C5'], key.Key('g'))
+    detected = detect_key(written_minor, 'signature')
+    assert (detected.tonic.name, detected.mode) == ('G', 'minor')
+
+
+def test_signature_falls_back_to_fast():
+    score = make_score(['C4', 'E-4', 'G4', 'A-4', 'G4', 'F4', 'E-4', 'D4', 'B3', 'C4'])
+    assert detect_key(score, 'signature') == detect_key(score, 'fast')
+
+
+@pytest.mark.parametrize('note_names', [[], ['rest', 'rest']])
+def test_score_without_pitches_is_c_major(note_names):
+    score = make_score(note_names)
+    assert not get_pitch_class_histogram(score).any()
+    assert estimate_key(get_pitch_class_histogram(score)) is None
+    assert detect_key(score).name == 'C major'
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        detect_key(make_score(['C4']), 'slow')
+
+
+@pytest.mark.parametrize('method, expected', [('fast', 'C major'), ('music21', 'C major'),
+                                              ('signature', 'E- major')])
+def test_convert_to_parts_data_passes_the_method(method, expected):
+    # C major notes under a written E-flat major key signature, so 'signature' gives a different answer
+    score = make_score(['C4', 'E4', 'G4', 'C5', 'G4', 'E4', 'C4'], key.KeySignature(-3))
+    _, score_data, _ = convert_to_parts_data(score, key_detection=method)
+    assert score_data['key'].name == expected
@@ -0,0 +1,46 @@
+import io
+
+import pytest
+
+from midi_writer import PERCUSSION_CHANNEL, TICKS_PER_QUARTER, assign_channels, encode_variable_length, write_midi
+from score_helper import process_and_output_score
+
+
+@pytest.mark.parametrize('value, encoded', [(0, b'\x00'), (0x7F, b'\x7f'), (0x80, b'\x81\x00'),
+                                            (0x3FFF, b'\xff\x7f'), (0x200000, b'\x81\x80\x80\x00')])
+def test_encode_variable_length(value, encoded):
+    assert encode_variable_length(value) == encoded
+
+
+def test_assign_channels_skips_percussion():
+    tracks = [{}] * 10 + [{'channel': PERCUSSION_CHANNEL}]
+    assert assign_channels(tracks) == [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, PERCUSSION_CHANNEL]
+
+
+def test_write_midi_to_a_file_object():
+    fp = io.BytesIO()
+    write_midi([{'name': 'Piano', 'program': 0, 'notes': [(0, 1, [60], 64, None)]}], fp, bpm=90)
+    data = fp.getvalue()
+    assert data[:4] == b'MThd'
+    assert int.from_bytes(data[12:14], 'big') == TICKS_PER_QUARTER
+    assert data.count(b'MTrk') == 2
+
+
+def _read_notes(midi_path):
+    from music21 import converter
+    score = converter.parse(midi_path)
+    return [[(n.offset, n.quarterLength, tuple(p.midi for p in n.pitches), n.volume.velocity)
+             for n in part.recurse().notes] for part in score.parts]
+
+
+def test_native_midi_matches_music21(song, tmp_path):
+    parts_data, score_data = song
+    paths = {}
+    for midi_encoder in ('music21', 'native'):
+        paths[midi_encoder] = str(tmp_path / (midi_encoder + '.mid'))
+        process_and_output_score(parts_data, score_data, None, paths[midi_encoder], midi_encoder=midi_encoder,
+                                 archive_old_files=False)
+    native, music21 = _read_notes(paths['native']), _read_notes(paths['music21'])
+    assert [[note[:3] for note in part] for part in native] == [[note[:3] for note in part] for part in music21]
+    # music21 scales velocities by the bar's dynamic marking; the native file has each note's own velocity
+    assert [note[3] for note in native[0]] == [42, 64, 80, 80, 80, 80, 53, 31]
@@ -0,0 +1,65 @@
+import zipfile
+
+import pytest
+from music21 import converter
+
+from midi_writer import TICKS_PER_QUARTER
+from musicxml_writer import MXL_MIMETYPE, get_duration_pieces
+from score_helper import process_and_output_score
+
+
+def render_musicxml(song, path, musicxml_writer):
+    parts_data, score_data = song
+    process_and_output_score(parts_data, score_data, str(path), None, musicxml_writer=musicxml_writer,
+                             archive_old_files=False)
+    return str(path)
+
+
+def describe(score):
+    parts = []
+    for part in score.parts:
+        notes = []
+        for element in part.flatten().notesAndRests:
+            pitches = tuple(p.nameWithOctave for p in element.pitches)
+            notes.append((float(element.getOffsetInHierarchy(part)), float(element.quarterLength), pitches,
+                          element.tie.type if element.tie else None, element.lyric))
+        instrument = part.getInstrument()
+        parts.append((instrument.instrumentName, instrument.midiProgram, part.flatten().getElementsByClass('Clef')
+                      [0].__class__.__name__, len(part.getElementsByClass('Measure')), notes))
+    return parts
+
+
+@pytest.mark.parametrize('ticks, expected', [
+    (TICKS_PER_QUARTER, [(TICKS_PER_QUARTER, 'quarter', 0, False)]),
+    (TICKS_PER_QUARTER * 3 // 2, [(TICKS_PER_QUARTER * 3 // 2, 'quarter', 1, False)]),
+    (TICKS_PER_QUARTER // 3, [(TICKS_PER_QUARTER // 3, 'eighth', 0, True)]),
+    (TICKS_PER_QUARTER * 5, [(TICKS_PER_QUARTER * 4, 'whole', 0, False), (TICKS_PER_QUARTER, 'quarter', 0, False)]),
+])
+def test_duration_pieces(ticks, expected):
+    assert get_duration_pieces(ticks) == expected
+
+
+def test_duration_pieces_always_add_up():
+    for ticks in range(1, TICKS_PER_QUARTER * 9, 97):
+        assert sum(piece[0] for piece in get_duration_pieces(ticks)) == ticks
+
+
+def test_streaming_writer_matches_music21_export(song, tmp_path):
+    expected = converter.parse(render_musicxml(song, tmp_path / 'music21.xml', 'music21'))
+    streamed = converter.parse(render_musicxml(song, tmp_path / 'stream.xml', 'stream'))
+    assert describe(streamed) == describe(expected)
+
+
+@pytest.mark.parametrize('musicxml_writer', ['music21', 'stream'])
+def test_mxl_archive_layout(song, tmp_path, musicxml_writer):
+    path = render_musicxml(song, tmp_path / 'song.mxl', musicxml_writer)
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+        assert infos[0].filename == 'mimetype'
+        assert infos[0].compress_type == zipfile.ZIP_STORED
+        assert archive.read('mimetype').decode() == MXL_MIMETYPE
+        assert 'full-path="song.musicxml"' in archive.read('META-INF/container.xml').decode()
+        assert archive.read('song.musicxml').startswith(b'<?xml')
+
+    expected = converter.parse(render_musicxml(song, tmp_path / 'song.xml', musicxml_writer))
+    assert describe(converter.parse(path)) == describe(expected)
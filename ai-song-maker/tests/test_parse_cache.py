@@ -0,0 +1,79 @@
+import os
+
+import pytest
+from music21 import clef, key
+
+from parse_cache import CACHE_FILE_EXTENSION, ParseCache, convert_file_to_parts_data, restore_score_data
+from score_helper import process_and_output_score
+
+
+@pytest.fixture
+def midi_path(song, tmp_path):
+    parts_data, score_data = song
+    path = str(tmp_path / 'song.mid')
+    process_and_output_score(parts_data, score_data, None, path, archive_old_files=False)
+    return path
+
+
+def test_put_get_round_trip(song, tmp_path):
+    parts_data, score_data = song
+    cache = ParseCache(str(tmp_path / 'cache'))
+    assert cache.get('missing') is None
+    cache.put('entry', parts_data, {'key': 'C', 'time_signature': '4/4', 'tempo': 96})
+    cached_parts_data, cached_score_data = cache.get('entry')
+    assert cached_parts_data == parts_data
+    assert cached_score_data == {'key': 'C', 'time_signature': '4/4', 'tempo': 96}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_damaged_entry_is_a_miss(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'broken' + CACHE_FILE_EXTENSION), 'wb') as f:
+        f.write(b'not an entry')
+    assert cache.get('broken') is None
+
+
+@pytest.mark.parametrize('reader', ['direct', 'music21'])
+def test_cached_conversion_matches_uncached(midi_path, tmp_path, reader):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    expected = convert_file_to_parts_data(midi_path, reader=reader)
+    first = convert_file_to_parts_data(midi_path, cache, reader=reader)
+    second = convert_file_to_parts_data(midi_path, cache, reader=reader)
+    assert cache.stats()['misses'] == 1 and cache.stats()['hits'] == 1
+    # Entries hold beat_ends on parts_codec's tick grid, so float noise from the reader is rounded away
+    assert first[0] == expected[0]
+    for part_name, part_data in expected[0].items():
+        cached_part_data = dict(second[0][part_name])
+        assert cached_part_data.pop('beat_ends') == pytest.approx(part_data['beat_ends'])
+        assert cached_part_data == {field: value for field, value in part_data.items() if field != 'beat_ends'}
+    for field in ('key', 'time_signature', 'tempo'):
+        assert str(second[1][field]) == str(expected[1][field])
+    assert isinstance(second[1]['key'], key.Key)
+
+
+def test_clef_is_restored(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.put('entry', {}, {'clef': 'BassClef'})
+    assert isinstance(restore_score_data(cache.get('entry')[1])['clef'], clef.BassClef)
+
+
+def test_changed_file_or_options_miss(midi_path, tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    first_key = cache.cache_key(midi_path, 'direct', 'fast')
+    assert cache.cache_key(midi_path, 'music21', 'fast') != first_key
+    with open(midi_path, 'ab') as f:
+        f.write(b'\0')
+    assert cache.cache_key(midi_path, 'direct', 'fast') != first_key
+
+
+def test_evicts_least_recently_used(song, tmp_path):
+    parts_data, score_data = song
+    cache = ParseCache(str(tmp_path), max_bytes=None)
+    for number, name in enumerate(['old', 'used', 'new']):
+        cache.put(name, parts_data, {})
+        os.utime(os.path.join(str(tmp_path), name + CACHE_FILE_EXTENSION), (number, number))
+    cache.get('used')
+    entry_size = os.path.getsize(os.path.join(str(tmp_path), 'new' + CACHE_FILE_EXTENSION))
+    assert cache.evict(entry_size * 2) == 1
+    assert cache.get('old') is None
+    assert cache.get('used') is not None and cache.get('new') is not None
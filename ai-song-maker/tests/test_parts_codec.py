@@ -0,0 +1,52 @@
+import io
+
+from parts_codec import (decode_parts_data, decode_parts_data_binary, dump_parts_data, encode_columns,
+                         encode_parts_data, encode_parts_data_binary, encode_score_data, is_encoded_parts_data,
+                         load_parts_data)
+
+SECTIONED = {'Guitar': {'instrument': 'Acoustic Guitar', 'song_structure': ['verse', 'chorus', 'verse'],
+                        'sections': {'verse': {'melodies': ['D-4', 'C4S', '', 'Q2'], 'beat_ends': [1, 1.5, 2, 4]},
+                                     'chorus': {'chords': [['C4', 'E4'], ['rest']], 'beat_ends': [2, 4]}}}}
+
+
+def test_json_round_trip(song):
+    parts_data, score_data = song
+    encoded = encode_parts_data(parts_data, score_data)
+    assert is_encoded_parts_data(encoded)
+    assert not is_encoded_parts_data(parts_data)
+    assert decode_parts_data(encoded) == (parts_data, score_data)
+
+
+def test_binary_round_trip(song):
+    parts_data, score_data = song
+    assert decode_parts_data_binary(encode_parts_data_binary(parts_data, score_data)) == (parts_data, score_data)
+
+
+def test_sections_and_spellings_round_trip():
+    for encoded in (encode_parts_data(SECTIONED), encode_parts_data_binary(SECTIONED)):
+        decoder = decode_parts_data if isinstance(encoded, str) else decode_parts_data_binary
+        assert decoder(encoded)[0] == SECTIONED
+
+
+def test_dump_and_load(song):
+    parts_data, score_data = song
+    fp = io.StringIO()
+    dump_parts_data(parts_data, score_data, fp)
+    fp.seek(0)
+    assert load_parts_data(fp) == (parts_data, score_data)
+
+
+def test_columns_are_compact():
+    columns = encode_columns({'melodies': ['C4', 'D4', 'B-3'], 'beat_ends': [0.5, 1, 1.5],
+                              'dynamics': ['p', 'p', 'f']})
+    assert columns['pitches'] == [60, 62, 58]
+    assert 'sizes' not in columns and 'spellings' not in columns
+    assert columns['deltas'] == [1, 1, 1]
+    assert columns['dynamics'] == [0, 0, 1] and columns['dynamic_table'] == ['p', 'f']
+
+
+def test_encode_score_data_uses_plain_values():
+    from music21 import clef, key, meter, tempo
+    score_data = {'key': key.Key('a'), 'time_signature': meter.TimeSignature('6/8'),
+                  'tempo': tempo.MetronomeMark(number=72), 'clef': clef.BassClef()}
+    assert encode_score_data(score_data) == {'key': 'a', 'time_signature': '6/8', 'tempo': 72, 'clef': 'BassClef'}
@@ -0,0 +1,62 @@
+import copy
+from fractions import Fraction
+
+from render_cache import RenderCache, stable_hash
+from score_helper import process_and_output_score
+
+
+def test_stable_hash():
+    assert stable_hash({'a': 1, 'b': [Fraction(1, 3)]}) == stable_hash({'b': [Fraction(1, 3)], 'a': 1})
+    assert stable_hash({'a': 1}) != stable_hash({'a': 1.5})
+    assert stable_hash([Fraction(1, 2)]) != stable_hash([0.5])
+
+
+def render(parts_data, score_data, directory, name, render_cache=None):
+    musicxml_path, midi_path = str(directory / (name + '.xml')), str(directory / (name + '.mid'))
+    score = process_and_output_score(parts_data, score_data, musicxml_path, midi_path, render_cache=render_cache,
+                                     archive_old_files=False)
+    with open(midi_path, 'rb') as f:
+        return score, f.read()
+
+
+def test_unchanged_song_reuses_its_outputs(song, tmp_path):
+    parts_data, score_data = song
+    render_cache = RenderCache()
+    first, midi = render(parts_data, score_data, tmp_path, 'first', render_cache)
+    second, copied_midi = render(copy.deepcopy(parts_data), score_data, tmp_path, 'second', render_cache)
+    assert second is first
+    assert copied_midi == midi
+    assert render_cache.stats()['output_hits'] == 1
+
+
+def test_changed_part_is_rebuilt_and_others_reused(song, tmp_path):
+    parts_data, score_data = song
+    render_cache = RenderCache()
+    render(parts_data, score_data, tmp_path, 'first', render_cache)
+    parts_data['Bass']['melodies'][0] = 'D2'
+    _, midi = render(parts_data, score_data, tmp_path, 'cached', render_cache)
+    assert render_cache.stats()['part_hits'] == 1
+    assert render_cache.stats()['output_hits'] == 0
+
+    _, uncached_midi = render(parts_data, score_data, tmp_path, 'uncached')
+    assert midi == uncached_midi
+
+
+def test_outputs_changed_on_disk_are_not_reused(song, tmp_path):
+    parts_data, score_data = song
+    render_cache = RenderCache()
+    render(parts_data, score_data, tmp_path, 'song', render_cache)
+    with open(str(tmp_path / 'song.mid'), 'ab') as f:
+        f.write(b'changed')
+    render(parts_data, score_data, tmp_path, 'song', render_cache)
+    assert render_cache.stats()['output_hits'] == 0
+    assert render_cache.stats()['output_misses'] == 2
+
+
+def test_parts_without_melodies_are_never_cached(tmp_path):
+    render_cache = RenderCache()
+    parts_data = {'Piano': {'instrument': 'Piano', 'beat_ends': [1, 2, 3]}}
+    assert render_cache.part_key('Piano', parts_data['Piano'], {}, {}) is None
+    render(parts_data, {}, tmp_path, 'first', render_cache)
+    render(parts_data, {}, tmp_path, 'second', render_cache)
+    assert render_cache.stats()['output_hits'] == 0
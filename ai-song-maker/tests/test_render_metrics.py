@@ -0,0 +1,55 @@
+import os
+
+from music21 import converter
+
+from render_metrics import NULL_METRICS, RenderMetrics, get_metrics
+from reverse_score import convert_to_parts_data
+from score_helper import process_and_output_score
+
+
+def test_get_metrics():
+    metrics = RenderMetrics()
+    assert get_metrics(None) is NULL_METRICS
+    assert get_metrics(metrics) is metrics
+    measurements = []
+    callback_metrics = get_metrics(lambda *measurement: measurements.append(measurement))
+    callback_metrics.count('notes', 3)
+    callback_metrics.set('midi_bytes', 10)
+    assert measurements == [('count', 'notes', 3), ('value', 'midi_bytes', 10)]
+
+
+def test_stages_add_up():
+    metrics = RenderMetrics()
+    for _ in range(3):
+        with metrics.stage('part'):
+            pass
+    assert metrics.stages['part']['calls'] == 3
+    assert metrics.stages['part']['wall'] >= 0
+
+
+def test_warnings_are_counted():
+    metrics = RenderMetrics()
+    warnings = []
+    warn = metrics.make_warn(warnings.append)
+    warn('first')
+    warn('second')
+    assert warnings == ['first', 'second']
+    assert metrics.counts['warnings'] == 2
+    assert NULL_METRICS.make_warn(warnings.append) == warnings.append
+
+
+def test_render_records_stages_counts_and_sizes(song, tmp_path):
+    parts_data, score_data = song
+    musicxml_path, midi_path = str(tmp_path / 'song.xml'), str(tmp_path / 'song.mid')
+    metrics = RenderMetrics()
+    process_and_output_score(parts_data, score_data, musicxml_path, midi_path, metrics=metrics,
+                             archive_old_files=False)
+    assert {'events', 'write_musicxml', 'write_midi'} <= set(metrics.stages)
+    assert metrics.counts['chords'] == 1
+    assert metrics.counts['rests'] >= 1
+    assert metrics.values['musicxml_bytes'] == os.path.getsize(musicxml_path)
+    assert metrics.values['midi_bytes'] == os.path.getsize(midi_path)
+
+    import_metrics = RenderMetrics()
+    convert_to_parts_data(converter.parse(midi_path), metrics=import_metrics)
+    assert {'key_detection', 'extract_parts', 'format_output'} <= set(import_metrics.stages)
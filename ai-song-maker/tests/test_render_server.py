@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+import pytest
+
+from render_server import RenderClient, RenderService, make_server, percentile
+from score_helper import process_and_output_score
+
+
+@pytest.fixture
+def client(tmp_path):
+    service = RenderService(workers=2, max_queue=2, output_directory=str(tmp_path),
+                            executor=ThreadPoolExecutor(max_workers=2))
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield RenderClient(port=server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    service.executor.shutdown()
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+
+
+def test_render_and_import(client, tmp_path):
+    parts_data = {'Piano': {'instrument': 'Piano', 'melodies': ['C4', 'E4', 'G4', 'C5'],
+                            'beat_ends': [1, 2, 3, 4]}}
+    result = client.render(parts_data, {'tempo': 100}, job_id='song')
+    assert result['error'] is None
+    assert result['midi_path'].endswith('.mid')
+
+    imported = client.import_file(result['midi_path'])
+    assert imported['error'] is None
+    assert imported['score_data']['tempo'] == 100
+    assert client.stats()['jobs']['import']['failed'] == 0
+
+
+def test_import_with_triplets_is_sent_as_json(client, tmp_path):
+    midi_path = str(tmp_path / 'triplets.mid')
+    parts_data = {'Piano': {'instrument': 'Piano', 'melodies': ['C4', 'D4', 'E4', 'F4'],
+                            'beat_ends': [Fraction(1, 3), Fraction(2, 3), 1, 2]}}
+    process_and_output_score(parts_data, {}, None, midi_path, archive_old_files=False)
+
+    imported = client.import_file(midi_path)
+    assert imported['error'] is None
+    assert imported['parts_data']['Piano']['beat_ends'][0] == pytest.approx(1 / 3)
+    assert client.stats()['jobs']['import']['failed'] == 0
+
+
+def test_invalid_song_is_rejected(client):
+    result = client.render({'Piano': {'melodies': ['Q4'], 'beat_ends': [1]}}, {}, validate='strict')
+    assert result['error']
+    assert result['diagnostics']
@@ -0,0 +1,40 @@
+import io
+import zipfile
+
+import pytest
+
+from score_helper import get_musicxml_format, get_mxl_member_name, process_and_output_score, render_to_bytes
+
+
+def test_render_to_bytes_matches_files(song, tmp_path):
+    parts_data, score_data = song
+    musicxml_path, midi_path = str(tmp_path / 'song.xml'), str(tmp_path / 'song.mid')
+    process_and_output_score(parts_data, score_data, musicxml_path, midi_path, midi_encoder='native',
+                             archive_old_files=False)
+    outputs = render_to_bytes(parts_data, score_data, ('midi', 'musicxml'), midi_encoder='native')
+    with open(midi_path, 'rb') as f:
+        assert outputs['midi'] == f.read()
+    assert outputs['musicxml'].startswith(b'<?xml')
+    assert set(outputs) == {'midi', 'musicxml'}
+
+
+def test_render_to_bytes_mxl(song):
+    outputs = render_to_bytes(*song, formats=('mxl',))
+    assert list(outputs) == ['mxl']
+    with zipfile.ZipFile(io.BytesIO(outputs['mxl'])) as archive:
+        assert archive.namelist() == ['mimetype', 'META-INF/container.xml', 'score.musicxml']
+
+
+@pytest.mark.parametrize('formats', [('musicxml', 'mxl'), ('wav',)])
+def test_render_to_bytes_rejects_formats(song, formats):
+    with pytest.raises(ValueError):
+        render_to_bytes(*song, formats=formats)
+
+
+def test_musicxml_format_and_member_name():
+    assert get_musicxml_format('song.MXL') == 'mxl'
+    assert get_musicxml_format('song.xml') == 'musicxml'
+    assert get_musicxml_format(io.BytesIO()) == 'musicxml'
+    assert get_musicxml_format('song.xml', 'mxl') == 'mxl'
+    assert get_mxl_member_name('/tmp/out/song.mxl') == 'song.musicxml'
+    assert get_mxl_member_name(io.BytesIO()) == 'score.musicxml'
@@ -0,0 +1,100 @@
+from music21 import converter
+
+from score_helper import process_and_output_score
+from sections import build_section_events, get_section_lengths, get_song_structure
+
+VERSE = {'melodies': ['C4', 'D4', 'E4', 'F4'], 'beat_ends': [1, 2, 3, 4], 'dynamics': ['mp'] * 4}
+CHORUS = {'melodies': ['G4', ['C5', 'E5'], 'A4', 'G4'], 'beat_ends': [2, 4, 6, 8], 'dynamics': ['f'] * 4,
+          'lyrics': ['oh', '', '', 'yeah']}
+BASS_CHORUS = {'melodies': ['C2', 'G2'], 'beat_ends': [2, 3], 'dynamics': ['f', 'f']}
+STRUCTURE = ['verse', 'chorus', 'verse', 'chorus']
+
+
+def sectioned_song():
+    parts_data = {'Piano': {'instrument': 'Piano', 'sections': {'verse': VERSE, 'chorus': CHORUS}},
+                  'Bass': {'instrument': 'Electric Bass', 'clef': 'BassClef', 'sections': {'chorus': BASS_CHORUS}}}
+    score_data = {'key': 'C', 'time_signature': '4/4', 'tempo': 100, 'song_structure': STRUCTURE}
+    return parts_data, score_data
+
+
+def flat_song():
+    # The same song written out in full: every section is padded to the longest part's length in whole bars
+    piano = {'melodies': [], 'beat_ends': [], 'dynamics': [], 'lyrics': []}
+    bass = {'melodies': [], 'beat_ends': [], 'dynamics': []}
+    start = 0
+    for name in STRUCTURE:
+        section = VERSE if name == 'verse' else CHORUS
+        piano['melodies'] += section['melodies']
+        piano['beat_ends'] += [start + beat_end for beat_end in section['beat_ends']]
+        piano['dynamics'] += section['dynamics']
+        piano['lyrics'] += section.get('lyrics', [''] * len(section['melodies']))
+        if name == 'chorus':
+            bass['melodies'] += BASS_CHORUS['melodies'] + ['rest']
+            bass['beat_ends'] += [start + beat_end for beat_end in BASS_CHORUS['beat_ends']] + [start + 8]
+            bass['dynamics'] += BASS_CHORUS['dynamics'] + ['f']
+        else:
+            bass['melodies'].append('rest')
+            bass['beat_ends'].append(start + 4)
+            bass['dynamics'].append('mf')
+        start += section['beat_ends'][-1]
+    parts_data = {'Piano': dict(piano, instrument='Piano'),
+                  'Bass': dict(bass, instrument='Electric Bass', clef='BassClef')}
+    return parts_data, {'key': 'C', 'time_signature': '4/4', 'tempo': 100}
+
+
+def notes(path):
+    score = converter.parse(path)
+    return [[(float(n.getOffsetInHierarchy(part)), float(n.quarterLength), tuple(p.midi for p in n.pitches))
+             for n in part.flatten().notes] for part in score.parts]
+
+
+def test_song_structure_fallbacks():
+    part_data = {'sections': {'a': {}, 'b': {}}}
+    assert get_song_structure(part_data, {}) == ['a', 'b']
+    assert get_song_structure(part_data, {'song_structure': ['b', 'a', 'b']}) == ['b', 'a', 'b']
+    assert get_song_structure(dict(part_data, song_structure=['a']), {'song_structure': ['b']}) == ['a']
+
+
+def test_sections_are_as_long_as_their_longest_part():
+    parts_data, _ = sectioned_song()
+    section_events = build_section_events(parts_data)
+    assert set(section_events['Piano']) == {'verse', 'chorus'}
+    assert set(section_events['Bass']) == {'chorus'}
+    lengths = get_section_lengths(section_events)
+    assert lengths == {'verse': 4 * 10080, 'chorus': 8 * 10080}
+
+
+def test_sections_render_like_the_song_written_out(tmp_path):
+    for midi_encoder in ('music21', 'native'):
+        sectioned_path, flat_path = str(tmp_path / 'sectioned.mid'), str(tmp_path / 'flat.mid')
+        process_and_output_score(*sectioned_song(), None, sectioned_path, midi_encoder=midi_encoder,
+                                 archive_old_files=False)
+        process_and_output_score(*flat_song(), None, flat_path, midi_encoder=midi_encoder, archive_old_files=False)
+        assert notes(sectioned_path) == notes(flat_path)
+
+    sectioned_path, flat_path = str(tmp_path / 'sectioned.xml'), str(tmp_path / 'flat.xml')
+    process_and_output_score(*sectioned_song(), sectioned_path, None, archive_old_files=False)
+    process_and_output_score(*flat_song(), flat_path, None, archive_old_files=False)
+    sectioned_notes = notes(sectioned_path)
+    assert sectioned_notes == notes(flat_path)
+    assert sectioned_notes[1][:2] == [(4.0, 2.0, (36,)), (6.0, 1.0, (43,))]
+
+
+def test_unknown_section_is_a_bar_of_rest(tmp_path, capsys):
+    parts_data, score_data = sectioned_song()
+    score_data['song_structure'] = ['verse', 'bridge', 'verse']
+    score = process_and_output_score(parts_data, score_data, str(tmp_path / 'song.xml'), None,
+                                     archive_old_files=False)
+    assert 'section bridge' in capsys.readouterr().out
+    assert score.parts[0].highestTime == 12
+
+
+def test_repeats_reuse_the_plan_but_not_its_elements(tmp_path):
+    score = process_and_output_score(*sectioned_song(), str(tmp_path / 'song.xml'), None, archive_old_files=False)
+    measures = list(score.parts[0].getElementsByClass('Measure'))
+    # verse (1 bar), chorus (2 bars), verse, chorus
+    assert [m.number for m in measures] == [1, 2, 3, 4, 5, 6]
+    first_chorus, second_chorus = measures[1].notes, measures[4].notes
+    assert [n.pitches for n in first_chorus] == [n.pitches for n in second_chorus]
+    assert not {id(n) for n in first_chorus} & {id(n) for n in second_chorus}
+    assert [m.getElementsByClass('Dynamic')[0].value for m in measures] == ['mf', 'f', 'f', 'mp', 'f', 'f']
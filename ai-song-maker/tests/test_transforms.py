@@ -0,0 +1,94 @@
+from fractions import Fraction
+
+import pytest
+
+from parts_codec import decode_parts_data, encode_parts_data
+from transforms import Transform, transform
+
+PARTS_DATA = {
+    'Piano': {'instrument': 'Piano', 'melodies': ['C4', ['E4', 'G4'], 'rest', 'Bb3'], 'beat_ends': [1, 2, 3, 4],
+              'dynamics': ['pp', 'p', 'pp', 'f']},
+    'Bass': {'instrument': 'Electric Bass', 'sections': {'A': {'melodies': ['C2', 'G1'], 'beat_ends': [2, 4]}}},
+}
+SCORE_DATA = {'tempo': 100, 'key': 'C'}
+
+
+def test_transpose_and_double_octave():
+    parts_data, _ = transform(PARTS_DATA).transpose(2).double_octave(-1, parts=['Bass']).apply()
+    assert parts_data['Piano']['melodies'] == ['D4', ['F#4', 'A4'], 'rest', 'C4']
+    assert parts_data['Bass']['sections']['A']['melodies'] == [['D2', 'D1'], ['A1', 'A0']]
+    assert PARTS_DATA['Piano']['melodies'][0] == 'C4'
+
+
+def test_transpose_folds_into_the_midi_range():
+    parts_data, _ = transform({'P': {'melodies': ['G9', 'C0'], 'beat_ends': [1, 2]}}).transpose(5).apply()
+    assert parts_data['P']['melodies'] == ['C9', 'F0']
+
+
+def test_transpose_reads_every_spelling_or_raises():
+    part = {'melodies': ['C4S', 'C4#', 'E4'], 'beat_ends': [1, 2, 3]}
+    parts_data, _ = transform({'P': part}).transpose(14).apply()
+    assert parts_data['P']['melodies'] == ['E-5', 'E-5', 'F#5']
+    with pytest.raises(ValueError, match="'Q9' at 1"):
+        transform({'P': {'melodies': ['C4', 'Q9'], 'beat_ends': [1, 2]}}).transpose(2).apply()
+
+
+def test_untouched_parts_keep_their_lists():
+    parts_data, _ = transform(PARTS_DATA).remap_dynamics({'pp': 'p'}, parts=['Piano']).apply()
+    assert parts_data['Piano']['dynamics'] == ['p', 'p', 'p', 'f']
+    assert parts_data['Piano']['melodies'] is PARTS_DATA['Piano']['melodies']
+    assert parts_data['Bass']['sections'] is PARTS_DATA['Bass']['sections']
+
+
+def test_quantize_keeps_later_notes_on_their_grid_positions():
+    warnings = []
+    part = {'melodies': ['C4', 'D4', 'E4', 'F4', 'G4'], 'beat_ends': [1, Fraction(4, 3), Fraction(5, 3), 2, 3],
+            'lyrics': ['a', 'b', 'c', 'd', 'e']}
+    parts_data, _ = transform({'P': part}, warn=warnings.append).quantize(1).apply()
+    assert parts_data['P'] == {'melodies': ['C4', 'E4', 'G4'], 'beat_ends': [1, 2, 3], 'lyrics': ['a', 'c', 'e']}
+    assert len(warnings) == 1
+
+
+def test_quantize_rounds_to_the_grid():
+    part = {'melodies': ['C4', 'D4', 'E4'], 'beat_ends': [1.1, 1.9, 3.12]}
+    parts_data, _ = transform({'P': part}).quantize(0.5).apply()
+    assert parts_data['P']['beat_ends'] == [1, 2, 3]
+
+
+def test_stretch_keeps_fractions():
+    part = {'melodies': ['C4', 'D4', 'E4'], 'beat_ends': [Fraction(1, 3), Fraction(2, 3), 1]}
+    parts_data, _ = transform({'P': part}).stretch(2).apply()
+    assert parts_data['P']['beat_ends'] == [Fraction(2, 3), Fraction(4, 3), 2]
+    parts_data, _ = transform({'P': {'melodies': ['C4'], 'beat_ends': [1.5]}}).stretch(0.5).apply()
+    assert parts_data['P']['beat_ends'] == [0.75]
+
+
+def test_scale_tempo():
+    _, score_data = transform(PARTS_DATA, SCORE_DATA).scale_tempo(1.5).apply()
+    assert score_data['tempo'] == 150
+    _, score_data = transform(PARTS_DATA, {}).scale_tempo(0.5).apply()
+    assert score_data['tempo'] == 60
+
+
+def test_chains_are_immutable_and_reusable():
+    chain = Transform({}).transpose(12)
+    longer = chain.double_octave()
+    assert len(chain.operations) == 1 and len(longer.operations) == 2
+    parts_data, _ = chain.with_song({'P': {'melodies': ['C4'], 'beat_ends': [1]}}).apply()
+    assert parts_data['P']['melodies'] == ['C5']
+
+
+def test_compact_input_and_output():
+    encoded = transform(encode_parts_data(PARTS_DATA, SCORE_DATA)).transpose(-2).apply('compact')
+    parts_data, score_data = decode_parts_data(encoded)
+    assert parts_data['Piano']['melodies'] == ['B-3', ['D4', 'F4'], 'rest', 'G#3']
+    assert score_data['tempo'] == 100
+    with pytest.raises(ValueError):
+        transform(PARTS_DATA).apply('xml')
+
+
+def test_render(tmp_path):
+    score = transform(PARTS_DATA, SCORE_DATA).transpose(1).render(None, str(tmp_path / 'song.mid'),
+                                                                  midi_encoder='native', archive_old_files=False)
+    assert (tmp_path / 'song.mid').exists()
+    assert score is not None
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pytest
+
+from instrument_names import CLEF_CLASS_NAMES, INSTRUMENT_CLASS_NAMES
+from validation import ERROR, WARNING, ValidationError, check_song, has_errors, validate_song
+from conftest import PACKAGE_DIRECTORY
+
+
+def codes(diagnostics):
+    return [(diagnostic.severity, diagnostic.code) for diagnostic in diagnostics]
+
+
+def test_valid_song_has_no_diagnostics():
+    parts_data = {'Piano': {'instrument': 'Piano', 'melodies': ['C4', ['E4', 'G4'], 'C4S'], 'beat_ends': [1, 2, 3],
+                            'dynamics': ['p', 'mf', 'f'], 'clef': 'BassClef'}}
+    assert validate_song(parts_data, {'key': 'G', 'time_signature': '3/4', 'tempo': 90}) == []
+
+
+def test_problems_are_reported():
+    parts_data = {'Lead': {'instrument': 'Kazoo Deluxe', 'melodies': ['Q4', 'C4'], 'beat_ends': [1, 1],
+                           'dynamics': ['loud'], 'clef': 'BanjoClef'}}
+    diagnostics = validate_song(parts_data, {'time_signature': '3/0'})
+    assert has_errors(diagnostics)
+    assert (WARNING, 'unknown_instrument') in codes(diagnostics)
+    assert (WARNING, 'invalid_clef') in codes(diagnostics)
+    assert (WARNING, 'invalid_time_signature') in codes(diagnostics)
+    assert any(severity == ERROR for severity, _ in codes(diagnostics))
+
+
+def test_check_song_raises_on_errors():
+    with pytest.raises(ValidationError) as raised:
+        check_song({'P': {'melodies': ['Q4'], 'beat_ends': [1]}})
+    assert raised.value.diagnostics
+
+
+def test_name_tables_match_music21():
+    from music21 import clef, instrument
+    assert INSTRUMENT_CLASS_NAMES == {name for name, value in vars(instrument).items()
+                                      if isinstance(value, type) and issubclass(value, instrument.Instrument)}
+    assert CLEF_CLASS_NAMES == {name for name, value in vars(clef).items()
+                                if isinstance(value, type) and issubclass(value, clef.Clef)}
+
+
+def test_validation_does_not_import_music21():
+    code = ("import sys; sys.path.insert(0, {!r}); from validation import validate_song; "
+            "validate_song({{'P': {{'instrument': 'French Horn', 'clef': 'BassClef', 'melodies': ['C4', 'Q4', 'H2'],"
+            " 'beat_ends': [1, 2, 3]}}}}, {{'clef': 'NoSuchClef'}}); print('music21' in sys.modules)")
+    output = subprocess.run([sys.executable, '-c', code.format(PACKAGE_DIRECTORY)], check=True, capture_output=True,
+                            text=True).stdout
+    assert output.strip() == 'False'
@@ -0,0 +1,52 @@
+import os
+
+from variations import get_scale_degree_names, make_variation, render_variations
+
+
+def skeleton(song):
+    parts_data, score_data = song
+    parts_data['Lead'] = {'instrument': 'Flute', 'beat_ends': [1, 2, 4]}
+    parts_data['Pad'] = {'instrument': 'Piano'}
+    return parts_data, score_data
+
+
+def test_scale_degree_names():
+    assert list(get_scale_degree_names('C')) == ['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4']
+
+
+def test_same_seed_same_variation(song):
+    parts_data, score_data = skeleton(song)
+    first = make_variation(parts_data, score_data, 7, vary_parts=['Bass'])
+    assert first == make_variation(parts_data, score_data, 7, vary_parts=['Bass'])
+    assert first != make_variation(parts_data, score_data, 8, vary_parts=['Bass'])
+
+
+def test_only_missing_or_listed_parts_change(song):
+    parts_data, score_data = skeleton(song)
+    variation = make_variation(parts_data, score_data, 1, vary_parts=['Bass'])
+    assert variation['Piano'] is parts_data['Piano']
+    assert variation['Bass']['beat_ends'] == parts_data['Bass']['beat_ends']
+    assert len(variation['Bass']['melodies']) == 4
+    assert variation['Lead']['beat_ends'] == [1, 2, 4]
+    assert set(variation['Lead']['melodies']) <= set(get_scale_degree_names('C'))
+    assert len(variation['Pad']['melodies']) == len(variation['Pad']['beat_ends']) == 20
+    assert 'melodies' not in parts_data['Pad']
+
+
+def test_part_streams_are_independent(song):
+    parts_data, score_data = skeleton(song)
+    with_bass = make_variation(parts_data, score_data, 3, vary_parts=['Bass'])
+    without_bass = make_variation(parts_data, score_data, 3)
+    assert with_bass['Lead'] == without_bass['Lead']
+
+
+def test_render_variations(song, tmp_path):
+    parts_data, score_data = skeleton(song)
+    results = render_variations(parts_data, score_data, [1, 2], str(tmp_path), vary_parts=['Bass'],
+                                write_musicxml=False, midi_encoder='native')
+    assert [result['seed'] for result in results] == [1, 2]
+    for result in results:
+        assert result['musicxml_path'] is None
+        assert os.path.exists(result['midi_path'])
+    with open(results[0]['midi_path'], 'rb') as first, open(results[1]['midi_path'], 'rb') as second:
+        assert first.read() != second.read()